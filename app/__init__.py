@@ -115,6 +115,10 @@ def create_app() -> Flask:
         
         return context
 
+    # リクエスト単位のDB接続をteardownでプールへ返却
+    from .utils.db import init_app as init_db
+    init_db(app)
+
     # データベース初期化
     try:
         from .utils import get_db
@@ -127,6 +131,12 @@ def create_app() -> Flask:
     except Exception as e:
         print(f"⚠️ データベース初期化エラー: {e}")
 
+    # 開発時はWebプロセス内でジョブワーカーを動かす（本番は Procfile の worker プロセス）
+    worker_threads = int(os.getenv("JOB_WORKER_THREADS", "0"))
+    if worker_threads > 0:
+        from .utils.jobs import start_worker_threads
+        start_worker_threads(worker_threads)
+
     # blueprints 登録
     try:
         from .blueprints.health import bp as health_bp  # type: ignore
@@ -171,7 +171,7 @@ def admins():
     """管理者一覧"""
     user_id = session.get('user_id')
     tenant_id = session.get('tenant_id')
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     cur = conn.cursor()
     
     # オーナー権限チェック
@@ -432,7 +432,7 @@ def employees():
         flash('店舗が選択されていません', 'error')
         return redirect(url_for('admin.dashboard'))
     
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     cur = conn.cursor()
     
     # 選択中の店舗に所属する従業員を取得
@@ -7,9 +7,20 @@ from flask import Blueprint, render_template, request, redirect, url_for, sessio
 from werkzeug.security import generate_password_hash, check_password_hash
 from ..utils import get_db, _sql, login_user, admin_exists, ROLES
 from ..utils.db import _sql
+from ..utils.statements import Statement
 
 bp = Blueprint('auth', __name__)
 
+# ログイン照会（頻出クエリ）
+ADMIN_LOGIN_LOOKUP = Statement(
+    'admin_login_lookup',
+    'SELECT id, name, password_hash, tenant_id, is_owner FROM "T_管理者" WHERE login_id=%s AND role=%s'
+)
+EMPLOYEE_LOGIN_LOOKUP = Statement(
+    'employee_login_lookup',
+    'SELECT id, name, password_hash, tenant_id FROM "T_従業員" WHERE login_id=%s OR email=%s'
+)
+
 
 @bp.route('/')
 def index():
@@ -104,8 +115,7 @@ def system_admin_login():
         conn = get_db()
         try:
             cur = conn.cursor()
-            sql = _sql(conn, 'SELECT id, name, password_hash, tenant_id FROM "T_管理者" WHERE login_id=%s AND role=%s')
-            cur.execute(sql, (login_id, ROLES["SYSTEM_ADMIN"]))
+            cur.execute(*ADMIN_LOGIN_LOOKUP.bind(conn, (login_id, ROLES["SYSTEM_ADMIN"])))
             row = cur.fetchone()
             if row and check_password_hash(row[2], password):
                 user_id, name, tenant_id = row[0], row[1], row[3]
@@ -128,8 +138,7 @@ def tenant_admin_login():
         conn = get_db()
         try:
             cur = conn.cursor()
-            sql = _sql(conn, 'SELECT id, name, password_hash, tenant_id, is_owner FROM "T_管理者" WHERE login_id=%s AND role=%s')
-            cur.execute(sql, (login_id, ROLES["TENANT_ADMIN"]))
+            cur.execute(*ADMIN_LOGIN_LOOKUP.bind(conn, (login_id, ROLES["TENANT_ADMIN"])))
             row = cur.fetchone()
             if row and check_password_hash(row[2], password):
                 user_id, name, tenant_id, is_owner = row[0], row[1], row[3], row[4]
@@ -158,8 +167,7 @@ def admin_login():
         conn = get_db()
         try:
             cur = conn.cursor()
-            sql = _sql(conn, 'SELECT id, name, password_hash, tenant_id, is_owner FROM "T_管理者" WHERE login_id=%s AND role=%s')
-            cur.execute(sql, (login_id, ROLES["ADMIN"]))
+            cur.execute(*ADMIN_LOGIN_LOOKUP.bind(conn, (login_id, ROLES["ADMIN"])))
             row = cur.fetchone()
             if row and check_password_hash(row[2], password):
                 user_id, name, tenant_id, is_owner = row[0], row[1], row[3], row[4]
@@ -192,8 +200,7 @@ def employee_login():
         conn = get_db()
         try:
             cur = conn.cursor()
-            sql = _sql(conn, 'SELECT id, name, password_hash, tenant_id FROM "T_従業員" WHERE login_id=%s OR email=%s')
-            cur.execute(sql, (login_id, login_id))
+            cur.execute(*EMPLOYEE_LOGIN_LOOKUP.bind(conn, (login_id, login_id)))
             row = cur.fetchone()
             if row:
                 user_id, name, hashv, tenant_id = row[0], row[1], row[2], row[3]
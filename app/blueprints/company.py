@@ -9,10 +9,40 @@ from datetime import datetime
 
 from ..utils import get_db, _sql
 from ..utils.decorators import require_roles
+from ..utils.pagination import KeysetQuery, parse_page_size
+from ..utils.statements import Statement
 from ..utils.nta_api import NTAInvoiceAPI, extract_invoice_number_from_text
 
 bp = Blueprint('company', __name__, url_prefix='/company')
 
+# 企業情報一覧（created_at, id の降順でキーセットページネーション）
+COMPANY_LIST = KeysetQuery(
+    'company_list',
+    '''
+    SELECT
+        id,
+        会社名,
+        会社名カナ,
+        郵便番号,
+        住所,
+        電話番号,
+        インボイス登録番号,
+        インボイス登録有無,
+        created_at
+    FROM "T_企業情報"
+    WHERE tenant_id = %s
+    ''',
+    keys=('created_at', 'id'),
+    key_positions=(8, 0),
+    count_from='FROM "T_企業情報" WHERE tenant_id = %s',
+)
+
+# インボイス登録番号による既存チェック（頻出クエリ）
+COMPANY_LOOKUP_BY_INVOICE = Statement(
+    'company_lookup_by_invoice',
+    'SELECT id FROM "T_企業情報" WHERE インボイス登録番号 = %s'
+)
+
 
 @bp.route('/')
 @require_roles(['system_admin', 'tenant_admin', 'admin', 'employee'])
@@ -23,31 +53,20 @@ def index():
         flash('テナントが選択されていません', 'error')
         return redirect(url_for('auth.index'))
     
-    conn = get_db()
-    cur = conn.cursor()
+    conn = get_db(readonly=True)
     
-    # 企業情報一覧を取得
-    sql = _sql(conn, '''
-        SELECT 
-            id,
-            会社名,
-            会社名カナ,
-            郵便番号,
-            住所,
-            電話番号,
-            インボイス登録番号,
-            インボイス登録有無,
-            created_at
-        FROM "T_企業情報"
-        WHERE tenant_id = %s
-        ORDER BY created_at DESC
-    ''')
-    cur.execute(sql, (tenant_id,))
+    # 企業情報一覧を1ページ分取得
+    page = COMPANY_LIST.fetch(
+        conn,
+        (tenant_id,),
+        cursor=request.args.get('cursor'),
+        page_size=parse_page_size(request.args.get('page_size')),
+        with_total=request.args.get('count') == '1',
+    )
     
-    companies = cur.fetchall()
     conn.close()
     
-    return render_template('company_list.html', companies=companies)
+    return render_template('company_list.html', companies=page.rows, page=page)
 
 
 @bp.route('/search', methods=['GET', 'POST'])
@@ -112,8 +131,7 @@ def register():
         # 既存チェック（インボイス登録番号）
         invoice_number = request.form.get('invoice_number')
         if invoice_number:
-            sql = _sql(conn, 'SELECT id FROM "T_企業情報" WHERE インボイス登録番号 = %s')
-            cur.execute(sql, (invoice_number,))
+            cur.execute(*COMPANY_LOOKUP_BY_INVOICE.bind(conn, (invoice_number,)))
             existing = cur.fetchone()
             
             if existing:
@@ -168,7 +186,7 @@ def detail(company_id):
     """企業情報詳細"""
     tenant_id = session.get('tenant_id')
     
-    conn = get_db()
+    conn = get_db(readonly=True)
     cur = conn.cursor()
     
     sql = _sql(conn, '''
@@ -305,9 +323,9 @@ def api_search_by_phone():
         return jsonify({
             'found': True,
             'company': {
-                'id': company[0] if isinstance(company, tuple) else company['id'],
-                'name': company[4] if isinstance(company, tuple) else company['会社名'],
-                'address': company[7] if isinstance(company, tuple) else company['住所'],
+                'id': company['id'],
+                'name': company['会社名'],
+                'address': company['住所'],
             }
         })
     
@@ -9,10 +9,58 @@ from datetime import datetime
 
 from ..utils import get_db, _sql
 from ..utils.decorators import require_roles
+from ..utils.statements import Statement
 from ..utils.export import export_journals, get_supported_formats
 
 bp = Blueprint('export', __name__, url_prefix='/export')
 
+# エクスポート対象の列（SELECT * を避け、列順を固定する）
+EXPORT_COLUMNS = (
+    'id, tenant_id, 証憑ID, 企業情報ID, 日付, '
+    '借方勘定科目, 借方金額, 借方補助科目, '
+    '貸方勘定科目, 貸方金額, 貸方補助科目, '
+    '摘要, 自動生成フラグ, 確認済みフラグ'
+)
+
+# 確認済み仕訳数（エクスポート画面の統計）
+EXPORT_CONFIRMED_COUNT = Statement(
+    'export_confirmed_count',
+    'SELECT COUNT(*) FROM "T_仕訳" WHERE tenant_id = %s AND 確認済みフラグ = 1'
+)
+
+# 絞り込み条件の組み合わせごとの Statement キャッシュ
+_export_statements = {}
+
+
+def _export_statement(start_date, end_date, confirmed_only, limit=None) -> Statement:
+    """エクスポート用 SELECT を絞り込み条件の組み合わせごとに1つ生成して使い回す"""
+    key = (bool(start_date), bool(end_date), bool(confirmed_only), limit)
+    stmt = _export_statements.get(key)
+    if stmt is None:
+        sql_parts = [f'SELECT {EXPORT_COLUMNS} FROM "T_仕訳" WHERE tenant_id = %s']
+        if start_date:
+            sql_parts.append('AND 日付 >= %s')
+        if end_date:
+            sql_parts.append('AND 日付 <= %s')
+        if confirmed_only:
+            sql_parts.append('AND 確認済みフラグ = 1')
+        sql_parts.append('ORDER BY 日付 ASC, id ASC')
+        if limit:
+            sql_parts.append(f'LIMIT {int(limit)}')
+        name = 'export_select_{}{}{}'.format(*(int(k) for k in key[:3])) + (f'_limit{limit}' if limit else '')
+        stmt = Statement(name, ' '.join(sql_parts))
+        _export_statements[key] = stmt
+    return stmt
+
+
+def _export_params(tenant_id, start_date, end_date) -> tuple:
+    params = [tenant_id]
+    if start_date:
+        params.append(start_date)
+    if end_date:
+        params.append(end_date)
+    return tuple(params)
+
 
 @bp.route('/')
 @require_roles(['system_admin', 'tenant_admin', 'admin', 'employee'])
@@ -27,15 +75,11 @@ def index():
     formats = get_supported_formats()
     
     # 仕訳の統計情報を取得
-    conn = get_db()
+    conn = get_db(readonly=True)
     cur = conn.cursor()
     
     # 確認済み仕訳数
-    sql = _sql(conn, '''
-        SELECT COUNT(*) FROM "T_仕訳"
-        WHERE tenant_id = %s AND 確認済みフラグ = 1
-    ''')
-    cur.execute(sql, (tenant_id,))
+    cur.execute(*EXPORT_CONFIRMED_COUNT.bind(conn, (tenant_id,)))
     confirmed_count = cur.fetchone()[0]
     
     # 未確認仕訳数
@@ -84,29 +128,12 @@ def download():
             return redirect(url_for('export.index'))
         
         # 仕訳データを取得
-        conn = get_db()
+        conn = get_db(readonly=True)
         cur = conn.cursor()
         
-        sql_parts = ['SELECT * FROM "T_仕訳" WHERE tenant_id = %s']
-        params = [tenant_id]
-        
-        # 日付範囲フィルタ
-        if start_date:
-            sql_parts.append('AND 日付 >= %s')
-            params.append(start_date)
-        
-        if end_date:
-            sql_parts.append('AND 日付 <= %s')
-            params.append(end_date)
-        
-        # 確認済みフィルタ
-        if confirmed_only:
-            sql_parts.append('AND 確認済みフラグ = 1')
-        
-        sql_parts.append('ORDER BY 日付 ASC, id ASC')
-        
-        sql = _sql(conn, ' '.join(sql_parts))
-        cur.execute(sql, tuple(params))
+        # 日付範囲・確認済みフィルタ
+        stmt = _export_statement(start_date, end_date, confirmed_only)
+        cur.execute(*stmt.bind(conn, _export_params(tenant_id, start_date, end_date)))
         
         rows = cur.fetchall()
         conn.close()
@@ -115,28 +142,8 @@ def download():
             flash('エクスポートする仕訳がありません', 'warning')
             return redirect(url_for('export.index'))
         
-        # 辞書形式に変換
-        journals = []
-        for row in rows:
-            if isinstance(row, tuple):
-                journals.append({
-                    'id': row[0],
-                    'tenant_id': row[1],
-                    '証憑ID': row[2],
-                    '企業情報ID': row[3],
-                    '日付': row[4],
-                    '借方勘定科目': row[5],
-                    '借方金額': row[6],
-                    '借方補助科目': row[7],
-                    '貸方勘定科目': row[8],
-                    '貸方金額': row[9],
-                    '貸方補助科目': row[10],
-                    '摘要': row[11],
-                    '自動生成フラグ': row[12],
-                    '確認済みフラグ': row[13],
-                })
-            else:
-                journals.append(dict(row))
+        # Row は列名で参照できるため、そのまま出力処理に渡す
+        journals = rows
         
         # CSV生成
         csv_content = export_journals(journals, format_id)
@@ -177,27 +184,11 @@ def preview():
             return redirect(url_for('export.index'))
         
         # 仕訳データを取得（最大10件）
-        conn = get_db()
+        conn = get_db(readonly=True)
         cur = conn.cursor()
         
-        sql_parts = ['SELECT * FROM "T_仕訳" WHERE tenant_id = %s']
-        params = [tenant_id]
-        
-        if start_date:
-            sql_parts.append('AND 日付 >= %s')
-            params.append(start_date)
-        
-        if end_date:
-            sql_parts.append('AND 日付 <= %s')
-            params.append(end_date)
-        
-        if confirmed_only:
-            sql_parts.append('AND 確認済みフラグ = 1')
-        
-        sql_parts.append('ORDER BY 日付 ASC, id ASC LIMIT 10')
-        
-        sql = _sql(conn, ' '.join(sql_parts))
-        cur.execute(sql, tuple(params))
+        stmt = _export_statement(start_date, end_date, confirmed_only, limit=10)
+        cur.execute(*stmt.bind(conn, _export_params(tenant_id, start_date, end_date)))
         
         rows = cur.fetchall()
         conn.close()
@@ -206,28 +197,8 @@ def preview():
             flash('プレビューする仕訳がありません', 'warning')
             return redirect(url_for('export.index'))
         
-        # 辞書形式に変換
-        journals = []
-        for row in rows:
-            if isinstance(row, tuple):
-                journals.append({
-                    'id': row[0],
-                    'tenant_id': row[1],
-                    '証憑ID': row[2],
-                    '企業情報ID': row[3],
-                    '日付': row[4],
-                    '借方勘定科目': row[5],
-                    '借方金額': row[6],
-                    '借方補助科目': row[7],
-                    '貸方勘定科目': row[8],
-                    '貸方金額': row[9],
-                    '貸方補助科目': row[10],
-                    '摘要': row[11],
-                    '自動生成フラグ': row[12],
-                    '確認済みフラグ': row[13],
-                })
-            else:
-                journals.append(dict(row))
+        # Row は列名で参照できるため、そのまま出力処理に渡す
+        journals = rows
         
         # CSV生成
         csv_content = export_journals(journals, format_id)
@@ -1,11 +1,21 @@
 from flask import Blueprint, jsonify, current_app
 
+from ..utils.ai_cache import ai_cache
+from ..utils.db import backend_status
+from ..utils import rate_limit
+from ..utils.sql_metrics import endpoint_totals
+from ..utils.statements import registry as statement_registry
+from ..utils.decorators import require_roles, ROLES
+
 bp = Blueprint("health", __name__)
 
+# /healthz（死活監視）以外は SQL 文・テナントごとの件数・接続エラーなどを含むため、
+# システム管理者のみ参照できます
+
 @bp.get("/healthz")
 def healthz():
     """
-    アプリケーションの状態を返します。
+    アプリケーションの状態を返します（ログイン不要の死活監視用）。
     ok=True のとき正常稼働です。
     """
     return jsonify(
@@ -13,3 +23,54 @@ def healthz():
         env=current_app.config.get("ENVIRONMENT"),
         version=current_app.config.get("VERSION"),
     )
+
+
+@bp.get("/healthz/db")
+@require_roles(ROLES["SYSTEM_ADMIN"])
+def healthz_db():
+    """
+    DBバックエンドとサーキットブレーカーの状態を返します。
+    circuit.state が "open" の間は PostgreSQL に接続できず SQLite で稼働しています。
+    """
+    return jsonify(backend_status())
+
+
+@bp.get("/healthz/sql")
+@require_roles(ROLES["SYSTEM_ADMIN"])
+def healthz_sql():
+    """
+    SQL ステートメントごとの実行回数（多い順）を返します。
+    どのクエリが負荷の中心かを確認するためのものです。
+    """
+    return jsonify(statements=statement_registry.stats(limit=50))
+
+
+@bp.get("/healthz/sql/endpoints")
+@require_roles(ROLES["SYSTEM_ADMIN"])
+def healthz_sql_endpoints():
+    """
+    エンドポイントごとの SQL 実行回数・所要時間の累計（合計時間の多い順）を返します。
+    n_plus_one_requests は同じ形の SQL を繰り返し実行したリクエストの数です。
+    """
+    return jsonify(endpoints=endpoint_totals.snapshot())
+
+
+@bp.get("/healthz/ai-cache")
+@require_roles(ROLES["SYSTEM_ADMIN"])
+def healthz_ai_cache():
+    """
+    AI応答キャッシュのテナントごとのヒット／ミス数（このプロセスの起動後の累計）を返します。
+    DB の "T_AIキャッシュ統計" には全プロセスの累計が定期的に書き出されます。
+    """
+    return jsonify(ai_cache.snapshot())
+
+
+@bp.get("/healthz/rate-limit")
+@require_roles(ROLES["SYSTEM_ADMIN"])
+def healthz_rate_limit():
+    """
+    外部APIのレート制限の設定と、制限を確認できずに（DB に接続できない・接続プールが空かない）
+    呼び出した回数（このプロセスの起動後の累計）を返します。
+    bypassed が増え続ける場合は DB_POOL_SIZE / RATE_LIMIT_DB_TIMEOUT を見直してください。
+    """
+    return jsonify(rate_limit.snapshot())
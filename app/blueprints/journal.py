@@ -9,7 +9,12 @@ from datetime import datetime
 
 from ..utils import get_db, _sql
 from ..utils.decorators import require_roles
+from ..utils.statements import Statement
+from ..utils.pagination import KeysetQuery, parse_page_size
+from ..utils.voucher_pipeline import load_ai_settings
 from ..utils.journal_generator import (
+    ACCOUNT_SUBJECTS,
+    estimate_account_subjects,
     generate_journal_entry,
     validate_journal_entry,
     get_account_subject_list,
@@ -18,6 +23,71 @@ from ..utils.journal_generator import (
 
 bp = Blueprint('journal', __name__, url_prefix='/journal')
 
+# 仕訳一覧（日付, id の降順でキーセットページネーション）
+# 日付は NULL になりうるため、キーは COALESCE(日付, '') にする（NULL と行値比較すると続きのページが
+# 取得できず、NULL の並び位置も PostgreSQL と SQLite で異なる）。NULL の仕訳は最後に並ぶ
+JOURNAL_LIST = KeysetQuery(
+    'journal_list',
+    '''
+    SELECT
+        j.id,
+        j.日付,
+        j.借方勘定科目,
+        j.借方金額,
+        j.貸方勘定科目,
+        j.貸方金額,
+        j.摘要,
+        j.自動生成フラグ,
+        j.確認済みフラグ,
+        j.created_at,
+        c.会社名,
+        COALESCE(j.日付, '') AS 日付キー
+    FROM "T_仕訳" j
+    LEFT JOIN "T_企業情報" c ON j.企業情報ID = c.id
+    WHERE j.tenant_id = %s
+    ''',
+    keys=("COALESCE(j.日付, '')", 'j.id'),
+    key_positions=(11, 0),
+    count_from='FROM "T_仕訳" WHERE tenant_id = %s',
+)
+
+# 仕訳生成画面の未処理の証憑一覧
+JOURNAL_PENDING_VOUCHERS = Statement('journal_pending_vouchers', '''
+    SELECT
+        v.id,
+        v.日付,
+        v.金額,
+        v.摘要,
+        v.電話番号,
+        v.住所,
+        c.id as company_id,
+        c.会社名
+    FROM "T_証憑" v
+    LEFT JOIN "T_企業情報" c ON v.電話番号 = c.電話番号
+    WHERE v.tenant_id = %s AND v.ステータス = 'pending'
+    ORDER BY v.created_at DESC
+''')
+
+# 仕訳登録（頻出クエリ）
+JOURNAL_INSERT = Statement('journal_insert', '''
+    INSERT INTO "T_仕訳" (
+        tenant_id,
+        証憑ID,
+        企業情報ID,
+        日付,
+        借方勘定科目,
+        借方金額,
+        借方補助科目,
+        貸方勘定科目,
+        貸方金額,
+        貸方補助科目,
+        摘要,
+        自動生成フラグ,
+        確認済みフラグ,
+        created_by
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+''')
+
 
 @bp.route('/')
 @require_roles(['system_admin', 'tenant_admin', 'admin', 'employee'])
@@ -28,34 +98,20 @@ def index():
         flash('テナントが選択されていません', 'error')
         return redirect(url_for('auth.index'))
     
-    conn = get_db()
-    cur = conn.cursor()
+    conn = get_db(readonly=True)
     
-    # 仕訳一覧を取得
-    sql = _sql(conn, '''
-        SELECT 
-            j.id,
-            j.日付,
-            j.借方勘定科目,
-            j.借方金額,
-            j.貸方勘定科目,
-            j.貸方金額,
-            j.摘要,
-            j.自動生成フラグ,
-            j.確認済みフラグ,
-            j.created_at,
-            c.会社名
-        FROM "T_仕訳" j
-        LEFT JOIN "T_企業情報" c ON j.企業情報ID = c.id
-        WHERE j.tenant_id = %s
-        ORDER BY j.日付 DESC, j.created_at DESC
-    ''')
-    cur.execute(sql, (tenant_id,))
+    # 仕訳一覧を1ページ分取得
+    page = JOURNAL_LIST.fetch(
+        conn,
+        (tenant_id,),
+        cursor=request.args.get('cursor'),
+        page_size=parse_page_size(request.args.get('page_size')),
+        with_total=request.args.get('count') == '1',
+    )
     
-    journals = cur.fetchall()
     conn.close()
     
-    return render_template('journal_list.html', journals=journals)
+    return render_template('journal_list.html', journals=page.rows, page=page)
 
 
 @bp.route('/generate', methods=['GET', 'POST'])
@@ -70,22 +126,7 @@ def generate():
         conn = get_db()
         cur = conn.cursor()
         
-        sql = _sql(conn, '''
-            SELECT 
-                v.id,
-                v.日付,
-                v.金額,
-                v.摘要,
-                v.電話番号,
-                v.住所,
-                c.id as company_id,
-                c.会社名
-            FROM "T_証憑" v
-            LEFT JOIN "T_企業情報" c ON v.電話番号 = c.電話番号
-            WHERE v.tenant_id = %s AND v.ステータス = 'pending'
-            ORDER BY v.created_at DESC
-        ''')
-        cur.execute(sql, (tenant_id,))
+        cur.execute(*JOURNAL_PENDING_VOUCHERS.bind(conn, (tenant_id,)))
         
         vouchers = cur.fetchall()
         conn.close()
@@ -105,12 +146,18 @@ def generate():
         
         generated_count = 0
         
+        vouchers = []
         for voucher_id in voucher_ids:
-            # 証憑データを取得
+            # 証憑データを取得（電話番号が一致する企業情報を結合）
             sql = _sql(conn, '''
-                SELECT 
-                    v.*,
-                    c.id as company_id,
+                SELECT
+                    v.id,
+                    v.金額,
+                    v.日付,
+                    v.摘要,
+                    v.OCR結果_生データ,
+                    v.勘定科目候補,
+                    c.id as matched_company_id,
                     c.会社名
                 FROM "T_証憑" v
                 LEFT JOIN "T_企業情報" c ON v.電話番号 = c.電話番号
@@ -119,25 +166,45 @@ def generate():
             cur.execute(sql, (voucher_id, tenant_id))
             voucher = cur.fetchone()
             
-            if not voucher:
-                continue
-            
-            # 証憑データを辞書に変換
+            if voucher:
+                vouchers.append((voucher_id, voucher))
+        
+        # 証憑処理時の勘定科目候補がないものは、AIでまとめて推定（1回の呼び出しで数十件ずつ）
+        unresolved = [voucher for _, voucher in vouchers if voucher['勘定科目候補'] not in ACCOUNT_SUBJECTS]
+        estimated = {}
+        if unresolved:
+            ai_settings, api_keys = load_ai_settings(conn, tenant_id)
+            subjects = estimate_account_subjects(
+                [{
+                    'description': voucher['摘要'],
+                    'amount': voucher['金額'],
+                    'company_name': voucher['会社名'],
+                    'ocr_text': voucher['OCR結果_生データ'],
+                } for voucher in unresolved],
+                use_ai=bool(api_keys.get('google_api_key') or api_keys.get('openai_api_key')),
+                ai_model=ai_settings['ai_model'],
+                api_keys=api_keys,
+                tenant_id=tenant_id,
+                conn=conn,
+            )
+            estimated = {voucher['id']: subject for voucher, subject in zip(unresolved, subjects)}
+        
+        for voucher_id, voucher in vouchers:
             voucher_data = {
-                'id': voucher[0] if isinstance(voucher, tuple) else voucher['id'],
-                '金額': voucher[3] if isinstance(voucher, tuple) else voucher['金額'],
-                '日付': voucher[4] if isinstance(voucher, tuple) else voucher['日付'],
-                '摘要': voucher[5] if isinstance(voucher, tuple) else voucher['摘要'],
+                'id': voucher['id'],
+                '金額': voucher['金額'],
+                '日付': voucher['日付'],
+                '摘要': voucher['摘要'],
+                '勘定科目候補': voucher['勘定科目候補'],
             }
+            if voucher['id'] in estimated:
+                subject, description = estimated[voucher['id']]
+                voucher_data['勘定科目候補'] = subject
+                voucher_data['摘要'] = voucher['摘要'] or description
             
             # 企業情報
-            company_data = None
-            if isinstance(voucher, tuple):
-                if len(voucher) > 14 and voucher[14]:
-                    company_data = {'会社名': voucher[15]}
-            else:
-                if voucher.get('company_id'):
-                    company_data = {'会社名': voucher['会社名']}
+            company_id = voucher['matched_company_id']
+            company_data = {'会社名': voucher['会社名']} if company_id else None
             
             # 仕訳を生成
             journal_entry = generate_journal_entry(voucher_data, company_data)
@@ -149,32 +216,7 @@ def generate():
                 continue
             
             # データベースに保存
-            sql = _sql(conn, '''
-                INSERT INTO "T_仕訳" (
-                    tenant_id,
-                    証憑ID,
-                    企業情報ID,
-                    日付,
-                    借方勘定科目,
-                    借方金額,
-                    借方補助科目,
-                    貸方勘定科目,
-                    貸方金額,
-                    貸方補助科目,
-                    摘要,
-                    自動生成フラグ,
-                    確認済みフラグ,
-                    created_by
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ''')
-            
-            company_id = None
-            if isinstance(voucher, tuple):
-                company_id = voucher[14] if len(voucher) > 14 else None
-            else:
-                company_id = voucher.get('company_id')
-            
-            cur.execute(sql, (
+            cur.execute(*JOURNAL_INSERT.bind(conn, (
                 tenant_id,
                 voucher_data['id'],
                 company_id,
@@ -189,7 +231,7 @@ def generate():
                 journal_entry['自動生成フラグ'],
                 journal_entry['確認済みフラグ'],
                 user_id
-            ))
+            )))
             
             # 証憑のステータスを更新
             sql = _sql(conn, '''
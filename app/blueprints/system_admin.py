@@ -26,7 +26,7 @@ def dashboard():
 @require_roles(ROLES["SYSTEM_ADMIN"])
 def tenants():
     """テナント一覧"""
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     cur = conn.cursor()
     cur.execute(_sql(conn, 'SELECT id, 名称, slug, 有効 FROM "T_テナント" ORDER BY id'))
     tenants = []
@@ -437,7 +437,7 @@ def tenant_admin_delete(tid, admin_id):
 @require_roles(ROLES["SYSTEM_ADMIN"])
 def system_admins():
     """システム管理者一覧"""
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     cur = conn.cursor()
     cur.execute(_sql(conn, '''
         SELECT id, login_id, name, active, created_at, is_owner, can_manage_admins 
@@ -132,7 +132,7 @@ def portal():
 def stores():
     """店舗一覧"""
     tenant_id = session.get('tenant_id')
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     cur = conn.cursor()
     
     cur.execute(_sql(conn, '''
@@ -318,7 +318,7 @@ def store_delete(store_id):
 def admins():
     """管理者一覧"""
     tenant_id = session.get('tenant_id')
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     cur = conn.cursor()
     
     cur.execute(_sql(conn, '''
@@ -583,7 +583,7 @@ def toggle_admin_manage_permission(admin_id):
 def employees():
     """従業員一覧"""
     tenant_id = session.get('tenant_id')
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     cur = conn.cursor()
     
     cur.execute(_sql(conn, '''
@@ -805,7 +805,7 @@ def employee_delete(employee_id):
 def tenant_admins():
     """テナント管理者一覧"""
     tenant_id = session.get('tenant_id')
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     cur = conn.cursor()
     
     cur.execute(_sql(conn, '''
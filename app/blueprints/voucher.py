@@ -4,22 +4,57 @@
 レシート・領収書のアップロード、OCR処理、一覧表示
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, Response, abort
 from werkzeug.utils import secure_filename
+import io
+import json
+import mimetypes
 import os
+import zipfile
 from datetime import datetime
+from werkzeug.datastructures import FileStorage
 
-from ..utils import get_db, _sql
+from ..utils import get_db, _is_pg, _sql
+from ..utils.db import transaction
 from ..utils.decorators import require_roles
-from ..utils.ocr import process_receipt_image, save_uploaded_file
-from ..utils.nta_api import search_company_by_ocr_data
-from ..utils.nta_api_enhanced import enhanced_company_search
-from ..utils.ai_helper import get_ai_settings, correct_ocr_text, normalize_company_name_with_ai, select_best_company_from_candidates
+from ..utils.pagination import KeysetQuery, parse_page_size
+from ..utils.upload_store import save_uploaded_file, release_reference
+from ..utils.storage import get_storage
+from ..utils.jobs import enqueue, latest_job_for_voucher
+from ..utils.voucher_pipeline import JOB_KIND as VOUCHER_JOB, VOUCHER_QUEUED
 
 bp = Blueprint('voucher', __name__, url_prefix='/voucher')
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf'}
 
+# 一括アップロードの上限（ファイル数 / ZIP 内の1ファイルあたりの展開後サイズ）
+BATCH_MAX_FILES = int(os.environ.get('VOUCHER_BATCH_MAX_FILES', '200'))
+BATCH_MAX_FILE_BYTES = int(os.environ.get('VOUCHER_BATCH_MAX_FILE_BYTES', str(16 * 1024 * 1024)))
+
+# 証憑一覧（created_at, id の降順でキーセットページネーション）
+VOUCHER_LIST = KeysetQuery(
+    'voucher_list',
+    '''
+    SELECT
+        v.id,
+        v.日付,
+        v.金額,
+        v.摘要,
+        v.電話番号,
+        v.住所,
+        v.ステータス,
+        v.created_at,
+        u.name as uploaded_by_name
+    FROM "T_証憑" v
+    LEFT JOIN "T_従業員" u ON v.uploaded_by = u.id
+    WHERE v.tenant_id = %s
+    ''',
+    keys=('v.created_at', 'v.id'),
+    key_positions=(7, 0),
+    count_from='FROM "T_証憑" WHERE tenant_id = %s',
+)
+
+
 
 def allowed_file(filename):
     """アップロード可能なファイル形式かチェック"""
@@ -35,36 +70,20 @@ def index():
         flash('テナントが選択されていません', 'error')
         return redirect(url_for('auth.index'))
     
-    conn = get_db()
-    cur = conn.cursor()
+    conn = get_db(readonly=True)
     
-    # 証憑一覧を取得
-    sql = _sql(conn, '''
-        SELECT 
-            v.id,
-            v.日付,
-            v.金額,
-            v.摘要,
-            v.電話番号,
-            v.住所,
-            v.ステータス,
-            v.created_at,
-            u.name as uploaded_by_name
-        FROM "T_証憑" v
-        LEFT JOIN "T_従業員" u ON v.uploaded_by = u.id
-        WHERE v.tenant_id = %s
-        ORDER BY v.created_at DESC
-    ''')
-    cur.execute(sql, (tenant_id,))
-    
-    if hasattr(cur, 'fetchall'):
-        vouchers = cur.fetchall()
-    else:
-        vouchers = [dict(row) for row in cur.fetchall()]
+    # 証憑一覧を1ページ分取得
+    page = VOUCHER_LIST.fetch(
+        conn,
+        (tenant_id,),
+        cursor=request.args.get('cursor'),
+        page_size=parse_page_size(request.args.get('page_size')),
+        with_total=request.args.get('count') == '1',
+    )
     
     conn.close()
     
-    return render_template('voucher_list.html', vouchers=vouchers)
+    return render_template('voucher_list.html', vouchers=page.rows, page=page)
 
 
 @bp.route('/upload', methods=['GET', 'POST'])
@@ -97,175 +116,14 @@ def upload():
         return redirect(request.url)
     
     try:
-        # ファイルを保存
-        filepath = save_uploaded_file(file)
-        
-        # OCR処理
-        ocr_result = process_receipt_image(filepath)
-        
-        # AI設定を取得
-        conn_temp = get_db()
-        cur_temp = conn_temp.cursor()
-        ai_settings = {'ai_model': 'gemini-1.5-flash'}  # デフォルト
-        api_keys = {}
-        
-        try:
-            cur_temp.execute(_sql(conn_temp, 'SELECT ai_model, openai_api_key, google_api_key, anthropic_api_key FROM "T_テナント" WHERE id = %s'), (tenant_id,))
-            tenant_settings = cur_temp.fetchone()
-            if tenant_settings:
-                ai_settings['ai_model'] = tenant_settings[0] or 'gemini-1.5-flash'
-                api_keys = {
-                    'openai_api_key': tenant_settings[1],
-                    'google_api_key': tenant_settings[2],
-                    'anthropic_api_key': tenant_settings[3],
-                }
-        except Exception as e:
-            print(f"AI設定取得エラー: {e}")
-        finally:
-            conn_temp.close()
-        
-        # AIでOCR結果を補正
-        try:
-            if api_keys.get('google_api_key') or api_keys.get('openai_api_key'):
-                corrected_text = correct_ocr_text(
-                    ocr_result.get('full_text', ''),
-                    ai_settings['ai_model'],
-                    api_keys
-                )
-                # 補正後のテキストを再解析
-                from ..utils.ocr import extract_phone_numbers, extract_addresses, extract_company_name
-                ocr_result['phone_numbers'] = extract_phone_numbers(corrected_text)
-                ocr_result['addresses'] = extract_addresses(corrected_text)
-                ocr_result['company_name'] = extract_company_name(corrected_text)
-        except Exception as e:
-            print(f"AI補正エラー: {e}")
-        
-        # 電話番号と住所は最初の1件を使用
-        phone = ocr_result['phone_numbers'][0] if ocr_result['phone_numbers'] else None
-        address = ocr_result['addresses'][0] if ocr_result['addresses'] else None
-        company_name = ocr_result.get('company_name')
-        
-        # AIで会社名を正規化
-        if company_name and (api_keys.get('google_api_key') or api_keys.get('openai_api_key')):
-            try:
-                company_name = normalize_company_name_with_ai(
-                    company_name,
-                    ai_settings['ai_model'],
-                    api_keys
-                )
-            except Exception as e:
-                print(f"AI会社名正規化エラー: {e}")
-        
-        # 拡張検索フローを使用
-        search_result = enhanced_company_search(ocr_result)
-        
-        company_id = None
-        invoice_number = search_result.get('invoice_number')
-        corporate_number = search_result.get('corporate_number')
-        company_info = search_result.get('company_info')
-        
-        # 検証結果をチェック
-        if not search_result.get('verification_passed'):
-            flash(search_result.get('warning_message'), 'warning')
-        
-        if company_info:
-                
-                # 企業情報をデータベースに保存（既存の場合は更新）
-                conn = get_db()
-                cur = conn.cursor()
-                
-                # 既存の企業情報をチェック
-                check_sql = _sql(conn, '''
-                    SELECT id FROM "T_企業情報"
-                    WHERE 法人番号 = %s OR インボイス登録番号 = %s
-                ''')
-                cur.execute(check_sql, (corporate_number, invoice_number))
-                existing = cur.fetchone()
-                
-                if existing:
-                    company_id = existing[0] if isinstance(existing, tuple) else existing['id']
-                else:
-                    # 新規企業情報を登録
-                    insert_company_sql = _sql(conn, '''
-                        INSERT INTO "T_企業情報" (
-                            tenant_id,
-                            法人番号,
-                            インボイス登録番号,
-                            会社名,
-                            会社名カナ,
-                            郵便番号,
-                            住所,
-                            都道府県,
-                            市区町村,
-                            番地,
-                            インボイス登録有無,
-                            インボイス登録日,
-                            法人種別
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ''')
-                    
-                    cur.execute(insert_company_sql, (
-                        tenant_id,
-                        company_info.get('法人番号'),
-                        company_info.get('インボイス登録番号'),
-                        company_info.get('会社名'),
-                        company_info.get('会社名カナ'),
-                        company_info.get('郵便番号'),
-                        company_info.get('住所'),
-                        company_info.get('都道府県'),
-                        company_info.get('市区町村'),
-                        company_info.get('番地'),
-                        company_info.get('インボイス登録有無', 0),
-                        company_info.get('インボイス登録日'),
-                        company_info.get('法人種別')
-                    ))
-                    
-                    if hasattr(conn, 'commit'):
-                        conn.commit()
-                    
-                    # 挿入されたIDを取得
-                    company_id = cur.lastrowid
-                
-                conn.close()
-        
-        # データベースに証憑情報を保存
+        # ファイルを保存し、OCR待ちの証憑として登録（OCR以降はジョブワーカーで処理）
+        # 参照数・証憑・ジョブは1つのトランザクションで登録（途中で失敗したらすべて取り消す）
         conn = get_db()
-        cur = conn.cursor()
-        
-        sql = _sql(conn, '''
-            INSERT INTO "T_証憑" (
-                tenant_id,
-                uploaded_by,
-                company_id,
-                画像パス,
-                OCR結果_生データ,
-                電話番号,
-                住所,
-                金額,
-                日付,
-                ステータス
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ''')
-        
-        cur.execute(sql, (
-            tenant_id,
-            user_id,
-            company_id,
-            filepath,
-            ocr_result['raw_text'],
-            phone,
-            address,
-            ocr_result['amount'],
-            ocr_result['date'],
-            'pending'
-        ))
-        
-        if hasattr(conn, 'commit'):
-            conn.commit()
-        
+        with transaction(conn):
+            queue_uploaded_file(conn, file, tenant_id, user_id)
         conn.close()
         
-        flash('証憑をアップロードしました', 'success')
+        flash('証憑をアップロードしました（読み取り処理中です）', 'success')
         return redirect(url_for('voucher.index'))
         
     except Exception as e:
@@ -273,6 +131,193 @@ def upload():
         return redirect(request.url)
 
 
+def queue_uploaded_file(conn, file, tenant_id, user_id) -> int:
+    """
+    ファイルを保存し、OCR待ちの証憑と処理ジョブを登録して証憑 ID を返す（トランザクションは呼び出し側）
+    ロールバックしても保存したファイルは残るが、内容のハッシュで同じパスになるため再アップロードで再利用される
+    """
+    stored = save_uploaded_file(conn, file)
+    voucher_id = insert_queued_voucher(conn, tenant_id, user_id, stored.path)
+    enqueue(conn, VOUCHER_JOB, tenant_id, job_payload(stored), voucher_id=voucher_id)
+    return voucher_id
+
+
+def insert_queued_voucher(conn, tenant_id, user_id, filepath) -> int:
+    """OCR待ち（queued）の証憑を登録して ID を返す（コミットは呼び出し側）"""
+    cur = conn.cursor()
+    sql = '''
+        INSERT INTO "T_証憑" (
+            tenant_id,
+            uploaded_by,
+            画像パス,
+            ステータス
+        ) VALUES (%s, %s, %s, %s)
+    '''
+    params = (tenant_id, user_id, filepath, VOUCHER_QUEUED)
+    if _is_pg(conn):
+        cur.execute(sql + ' RETURNING id', params)
+        return cur.fetchone()[0]
+    cur.execute(_sql(conn, sql), params)
+    return cur.lastrowid
+
+
+def job_payload(stored) -> dict:
+    """証憑処理ジョブの入力（内容のハッシュは OCR キャッシュのキーに使う）"""
+    return {'filepath': stored.path, 'content_hash': stored.content_hash}
+
+
+def _zip_entry_name(info: zipfile.ZipInfo) -> str:
+    """ZIP内のファイル名（UTF-8 フラグのない Windows の ZIP は cp932 として読む）"""
+    name = info.filename
+    if not info.flag_bits & 0x800:
+        try:
+            name = name.encode('cp437').decode('cp932')
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+    return os.path.basename(name)
+
+
+def iter_batch_files(files):
+    """
+    一括アップロードのファイルを1件ずつ返す（ZIP は展開）
+
+    Yields:
+        (ファイル名, FileStorage, エラーメッセージ)。エラー時は FileStorage が None
+    """
+    for file in files:
+        if not file or not file.filename:
+            continue
+        if file.filename.lower().endswith('.zip'):
+            try:
+                with zipfile.ZipFile(file.stream) as zf:
+                    for info in zf.infolist():
+                        name = _zip_entry_name(info)
+                        if info.is_dir() or not name or name.startswith('.') or '__MACOSX' in info.filename:
+                            continue
+                        if not allowed_file(name):
+                            yield name, None, '許可されていないファイル形式です'
+                        elif info.file_size > BATCH_MAX_FILE_BYTES:
+                            yield name, None, 'ファイルサイズが大きすぎます'
+                        else:
+                            yield name, FileStorage(stream=io.BytesIO(zf.read(info)), filename=name), None
+            except zipfile.BadZipFile:
+                yield file.filename, None, 'ZIPファイルを読み込めません'
+            continue
+        if not allowed_file(file.filename):
+            yield file.filename, None, '許可されていないファイル形式です'
+            continue
+        yield file.filename, file, None
+
+
+@bp.route('/upload/batch', methods=['GET', 'POST'])
+@require_roles(['system_admin', 'tenant_admin', 'admin', 'employee'])
+def upload_batch():
+    """証憑の一括アップロード（複数ファイル／ZIP）。読み取りはジョブワーカーが並列に行う"""
+    if request.method == 'GET':
+        return render_template('voucher_upload_batch.html', results=None)
+    
+    tenant_id = session.get('tenant_id')
+    user_id = session.get('user_id')
+    
+    if not tenant_id or not user_id:
+        flash('セッション情報が不正です', 'error')
+        return redirect(url_for('auth.index'))
+    
+    results = []
+    accepted = 0
+    conn = get_db()
+    for filename, file, error in iter_batch_files(request.files.getlist('files')):
+        if error is None and accepted >= BATCH_MAX_FILES:
+            error = f'一度にアップロードできるのは{BATCH_MAX_FILES}件までです'
+        if error:
+            results.append({'filename': filename, 'voucher_id': None, 'error': error})
+            continue
+        try:
+            # 1ファイル＝1トランザクション（失敗したファイルの参照数・証憑は残さない）
+            with transaction(conn):
+                voucher_id = queue_uploaded_file(conn, file, tenant_id, user_id)
+            results.append({'filename': filename, 'voucher_id': voucher_id, 'error': None})
+            accepted += 1
+        except Exception as e:
+            results.append({'filename': filename, 'voucher_id': None, 'error': str(e)})
+    conn.close()
+    
+    if not results:
+        flash('ファイルが選択されていません', 'error')
+        return redirect(request.url)
+    
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'accepted': accepted, 'results': results})
+    return render_template('voucher_upload_batch.html', results=results, accepted=accepted)
+
+
+@bp.route('/status')
+@require_roles(['system_admin', 'tenant_admin', 'admin', 'employee'])
+def status_many():
+    """複数の証憑の処理状況（?ids=1,2,3。一覧・一括アップロード画面のポーリング用）"""
+    tenant_id = session.get('tenant_id')
+    ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip().isdigit()][:BATCH_MAX_FILES]
+    if not ids:
+        return jsonify({'vouchers': []})
+    
+    conn = get_db()
+    cur = conn.cursor()
+    placeholders = ', '.join(['%s'] * len(ids))
+    cur.execute(_sql(conn, f'''
+        SELECT v.id, v.ステータス, j.処理段階, j.試行回数, j.エラー内容
+        FROM "T_証憑" v
+        LEFT JOIN "T_ジョブ" j ON j.id = (
+            SELECT MAX(id) FROM "T_ジョブ" WHERE 証憑ID = v.id AND tenant_id = v.tenant_id
+        )
+        WHERE v.tenant_id = %s AND v.id IN ({placeholders})
+    '''), (tenant_id, *ids))
+    vouchers = [
+        {
+            'voucher_id': row['id'],
+            'status': row['ステータス'],
+            'stage': row['処理段階'],
+            'attempts': row['試行回数'],
+            'error': row['エラー内容'],
+        }
+        for row in cur.fetchall()
+    ]
+    conn.close()
+    return jsonify({'vouchers': vouchers})
+
+
+@bp.route('/<int:voucher_id>/status')
+@require_roles(['system_admin', 'tenant_admin', 'admin', 'employee'])
+def status(voucher_id):
+    """証憑の処理状況（ポーリング用 JSON）"""
+    tenant_id = session.get('tenant_id')
+    
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute(_sql(conn, 'SELECT ステータス FROM "T_証憑" WHERE id = %s AND tenant_id = %s'), (voucher_id, tenant_id))
+    voucher = cur.fetchone()
+    if not voucher:
+        conn.close()
+        return jsonify({'error': '証憑が見つかりません'}), 404
+    
+    job = latest_job_for_voucher(conn, voucher_id, tenant_id)
+    conn.close()
+    
+    job_info = None
+    if job:
+        job_info = {
+            'id': job['id'],
+            'status': job['ステータス'],
+            'stage': job['処理段階'],
+            'attempts': job['試行回数'],
+            'max_attempts': job['最大試行回数'],
+            'result': json.loads(job['結果']) if job['結果'] else None,
+            'error': job['エラー内容'],
+            'next_run_at': job['実行予定日時'] if job['ステータス'] == 'queued' else None,
+            'updated_at': job['updated_at'],
+        }
+    return jsonify({'voucher_id': voucher_id, 'status': voucher['ステータス'], 'job': job_info})
+
+
 @bp.route('/<int:voucher_id>')
 @require_roles(['system_admin', 'tenant_admin', 'admin', 'employee'])
 def detail(voucher_id):
@@ -302,6 +347,51 @@ def detail(voucher_id):
     return render_template('voucher_detail.html', voucher=voucher)
 
 
+@bp.route('/<int:voucher_id>/image')
+@require_roles(['system_admin', 'tenant_admin', 'admin', 'employee'])
+def image(voucher_id):
+    """証憑画像（ストレージから配信。Range 指定で一部だけ取得できる）"""
+    tenant_id = session.get('tenant_id')
+    
+    conn = get_db(readonly=True)
+    cur = conn.cursor()
+    cur.execute(_sql(conn, 'SELECT 画像パス FROM "T_証憑" WHERE id = %s AND tenant_id = %s'), (voucher_id, tenant_id))
+    row = cur.fetchone()
+    conn.close()
+    
+    if not row or not row['画像パス']:
+        abort(404)
+    
+    key = row['画像パス']
+    storage = get_storage()
+    try:
+        size = storage.size(key)
+    except Exception:
+        abort(404)
+    mimetype = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+    
+    byte_range = request.range.range_for_length(size) if request.range else None
+    if byte_range:
+        start, stop = byte_range
+        response = Response(storage.read_range(key, start, stop - 1), 206, mimetype=mimetype)
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    else:
+        def generate():
+            body = storage.open(key)
+            try:
+                for chunk in iter(lambda: body.read(256 * 1024), b''):
+                    yield chunk
+            finally:
+                body.close()
+        response = Response(generate(), mimetype=mimetype)
+        response.headers['Content-Length'] = str(size)
+    
+    response.headers['Accept-Ranges'] = 'bytes'
+    # キーは内容のハッシュなので内容は変わらない
+    response.headers['Cache-Control'] = 'private, max-age=86400'
+    return response
+
+
 @bp.route('/<int:voucher_id>/edit', methods=['GET', 'POST'])
 @require_roles(['system_admin', 'tenant_admin', 'admin'])
 def edit(voucher_id):
@@ -381,19 +471,18 @@ def delete(voucher_id):
         row = cur.fetchone()
         
         if row:
-            filepath = row[0] if isinstance(row, tuple) else row['画像パス']
+            filepath = row['画像パス']
             
             # データベースから削除
             sql = _sql(conn, 'DELETE FROM "T_証憑" WHERE id = %s AND tenant_id = %s')
             cur.execute(sql, (voucher_id, tenant_id))
+            # 参照数を減らす（どの証憑からも参照されなくなったファイルはジョブワーカーが後で削除）
+            if filepath:
+                release_reference(conn, filepath)
             
             if hasattr(conn, 'commit'):
                 conn.commit()
             
-            # ファイルを削除
-            if filepath and os.path.exists(filepath):
-                os.remove(filepath)
-            
             flash('証憑を削除しました', 'success')
         else:
             flash('証憑が見つかりません', 'error')
@@ -9,6 +9,9 @@ class JsonFormatter(logging.Formatter):
             "message": record.getMessage(),
             "logger": record.name,
         }
+        fields = getattr(record, "fields", None)
+        if isinstance(fields, dict):
+            base.update(fields)
         if record.exc_info:
             base["exc_info"] = self.formatException(record.exc_info)
         return json.dumps(base, ensure_ascii=False)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+住所の解析（都道府県・郡・市区町村・政令指定都市の区）
+都道府県名と、接尾辞（市・区・町・村）だけでは区切れない市町村名は、インポート時に
+1つの正規表現（選択肢の自動機械）にまとめておき、住所1件につき1回の照合で分解する。
+同じ住所は何度も解析されるため（OCR の行・国税庁APIの候補）、結果は文字列ごとにキャッシュする
+"""
+
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+
+PREFECTURES = (
+    '北海道', '青森県', '岩手県', '宮城県', '秋田県', '山形県', '福島県',
+    '茨城県', '栃木県', '群馬県', '埼玉県', '千葉県', '東京都', '神奈川県',
+    '新潟県', '富山県', '石川県', '福井県', '山梨県', '長野県', '岐阜県',
+    '静岡県', '愛知県', '三重県', '滋賀県', '京都府', '大阪府', '兵庫県',
+    '奈良県', '和歌山県', '鳥取県', '島根県', '岡山県', '広島県', '山口県',
+    '徳島県', '香川県', '愛媛県', '高知県', '福岡県', '佐賀県', '長崎県',
+    '熊本県', '大分県', '宮崎県', '鹿児島県', '沖縄県',
+)
+
+# 名前の途中に 市・町・村 を含み、接尾辞で区切ると誤る市町村
+IRREGULAR_MUNICIPALITIES = (
+    '四日市市', '廿日市市', '野々市市', '上市町', '市貝町', '市川三郷町', '大町町',
+)
+
+# 区を持つ政令指定都市
+DESIGNATED_CITIES = frozenset((
+    '札幌市', '仙台市', 'さいたま市', '千葉市', '横浜市', '川崎市', '相模原市', '新潟市',
+    '静岡市', '浜松市', '名古屋市', '京都市', '大阪市', '堺市', '神戸市', '岡山市',
+    '広島市', '北九州市', '福岡市', '熊本市',
+))
+
+
+def _alternation(names) -> str:
+    # 長い名前を先に並べ、前方が共通する名前でも最長のものに一致させる
+    return '|'.join(map(re.escape, sorted(names, key=len, reverse=True)))
+
+
+_PREFECTURE_RE = re.compile(_alternation(PREFECTURES))
+
+_ADDRESS_RE = re.compile(
+    r'(?:〒?\s*\d{3}-?\d{4})?\s*'
+    r'(?P<prefecture>' + _alternation(PREFECTURES) + r')?\s*'
+    r'(?:'
+    r'(?P<irregular>' + _alternation(IRREGULAR_MUNICIPALITIES) + r')'
+    r'|(?P<county>[^\d\s市区町村郡]{1,5}郡)'
+    r'(?P<town>' + _alternation(IRREGULAR_MUNICIPALITIES) + r'|[^\d\s市区郡]{1,6}?[町村])'
+    r'|(?P<city>[^\d\s区]{1,6}?市)'
+    r'|(?P<special_ward>[^\d\s市区]{1,6}?区)'
+    r'|(?P<town_only>[^\d\s市区郡]{1,6}?[町村])'
+    r')?'
+)
+# 区の名前には 町・村 を含むものがある（名古屋市中村区など）ため、除くのは 市・区 のみ
+_WARD_RE = re.compile(r'[^\d\s市区]{1,4}?区')
+
+
+@dataclass(frozen=True)
+class AddressParts:
+    """住所を分解した結果（該当しない部分は None）"""
+    prefecture: Optional[str] = None
+    county: Optional[str] = None
+    city: Optional[str] = None
+    ward: Optional[str] = None
+    rest: str = ''
+
+    @property
+    def municipality(self) -> Optional[str]:
+        """市区町村（郡と政令指定都市の区を含む）"""
+        if not self.city:
+            return None
+        return f"{self.county or ''}{self.city}{self.ward or ''}"
+
+
+def find_prefecture(text: str) -> Optional[str]:
+    """テキスト中で最初に現れる都道府県名"""
+    match = _PREFECTURE_RE.search(text)
+    return match.group(0) if match else None
+
+
+def has_prefecture(text: str) -> bool:
+    """テキストに都道府県名が含まれるか"""
+    return _PREFECTURE_RE.search(text) is not None
+
+
+@lru_cache(maxsize=4096)
+def parse_address(address: str) -> AddressParts:
+    """
+    住所を都道府県・郡・市区町村・区に分解
+    住所の前に郵便番号があってもよい。都道府県が省略された住所は市区町村から解析する。
+    都道府県が先頭にない（前に店名などがある）場合は都道府県だけを返す
+    """
+    address = (address or '').strip()
+    match = _ADDRESS_RE.match(address)
+    city = match.group('irregular') or match.group('city') or match.group('special_ward') \
+        or match.group('town') or match.group('town_only')
+    if not match.group('prefecture') and not city:
+        return AddressParts(prefecture=find_prefecture(address), rest=address)
+
+    rest = address[match.end():]
+    ward = None
+    if city in DESIGNATED_CITIES:
+        ward_match = _WARD_RE.match(rest)
+        if ward_match:
+            ward = ward_match.group(0)
+            rest = rest[ward_match.end():]
+
+    return AddressParts(
+        prefecture=match.group('prefecture'),
+        county=match.group('county'),
+        city=city,
+        ward=ward,
+        rest=rest.strip(),
+    )
+
+
+def same_municipality(a: str, b: str) -> bool:
+    """2つの住所の市区町村（政令指定都市は区まで）が一致するか"""
+    parts_a = parse_address(a)
+    parts_b = parse_address(b)
+    if not parts_a.city or not parts_b.city or parts_a.city != parts_b.city:
+        return False
+    if parts_a.prefecture and parts_b.prefecture and parts_a.prefecture != parts_b.prefecture:
+        return False
+    # 区が片方にしかない場合（区を省略した住所）は市の一致で足りる
+    return not (parts_a.ward and parts_b.ward) or parts_a.ward == parts_b.ward
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+AI応答のキャッシュ
+モデル名・応答形式（JSON モードか）・プロンプトのハッシュをキーに、AIの応答を "T_AIキャッシュ" に保存する。
+同じ取引先の会社名の正規化など、同じプロンプトはプロバイダーに送らずに応答を返す。
+- プロセス内の LRU を前段に置き、直近のものは DB にも問い合わせない
+- 有効期限（AI_CACHE_TTL_SECONDS）を過ぎた応答は使わない
+- DB の件数が AI_CACHE_MAX_ROWS を超えたら古いものから削除する
+- テナントごとのヒット／ミス数を数え、"T_AIキャッシュ統計" に定期的に書き出す
+- 書き込み（保存・削除・統計）は呼び出し元のトランザクションを巻き込まないよう、
+  get_independent_db() の別の接続でその場でコミットする
+  （SQLite では呼び出し元が書き込み中のトランザクションを持っているとロック待ちになるため、
+  AI はコミットしてから呼び出す。保存できなかった応答もプロセス内の LRU には残る）
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from .db import get_db, get_independent_db, _is_pg, _sql
+
+
+# プロンプトの前提（システムプロンプト・temperature など）を変えたら上げる（古い応答を使わないため）
+AI_CACHE_REVISION = 1
+AI_CACHE_ENABLED = os.environ.get("AI_CACHE_ENABLED", "1") in ("1", "true", "True")
+AI_CACHE_TTL_SECONDS = int(os.environ.get("AI_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+AI_CACHE_MEMORY_ITEMS = int(os.environ.get("AI_CACHE_MEMORY_ITEMS", "2048"))
+AI_CACHE_MAX_ROWS = int(os.environ.get("AI_CACHE_MAX_ROWS", "200000"))
+# 何回保存するごとに期限切れ・上限超過の削除を行うか
+AI_CACHE_EVICT_EVERY = int(os.environ.get("AI_CACHE_EVICT_EVERY", "200"))
+# テナントごとのヒット／ミス数を DB に書き出す間隔（秒）
+AI_CACHE_STATS_FLUSH_SECONDS = int(os.environ.get("AI_CACHE_STATS_FLUSH_SECONDS", "60"))
+
+
+def cache_key(ai_model: str, prompt: str, json_mode: bool = False) -> str:
+    """
+    モデル名・応答形式・プロンプトのハッシュ
+    JSON モードと通常の呼び出しは同じプロンプトでも応答が異なるため、別のキーにする
+    """
+    digest = hashlib.sha256()
+    response_format = 'json' if json_mode else 'text'
+    digest.update(f'{AI_CACHE_REVISION}\0{ai_model}\0{response_format}\0'.encode('utf-8'))
+    digest.update(prompt.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def init_ai_cache_schema(conn):
+    """AI応答キャッシュのテーブル作成"""
+    cur = conn.cursor()
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS "T_AIキャッシュ"(
+        cache_key           TEXT PRIMARY KEY,
+        モデル              TEXT NOT NULL,
+        応答                TEXT NOT NULL,
+        有効期限            DOUBLE PRECISION NOT NULL,
+        created_at          TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    cur.execute('CREATE INDEX IF NOT EXISTS "idx_AIキャッシュ_有効期限" ON "T_AIキャッシュ"(有効期限)')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS "T_AIキャッシュ統計"(
+        tenant_id           INTEGER PRIMARY KEY,
+        ヒット数            BIGINT NOT NULL DEFAULT 0,
+        ミス数              BIGINT NOT NULL DEFAULT 0,
+        updated_at          TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    if not _is_pg(conn):
+        conn.commit()
+
+
+class AiResponseCache:
+    """AI応答のキャッシュ（プロセス内 LRU + DB）"""
+
+    def __init__(self, max_items: int = AI_CACHE_MEMORY_ITEMS, ttl: int = AI_CACHE_TTL_SECONDS):
+        self._max_items = max_items
+        self._ttl = ttl
+        self._items: 'OrderedDict[str, Tuple[str, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        # tenant_id -> [ヒット数, ミス数]（プロセス起動後の累計と、DB に未反映の差分）
+        self._totals: Dict[Optional[int], list] = {}
+        self._pending: Dict[Optional[int], list] = {}
+        self._flushed_at = time.monotonic()
+
+    def _remember(self, key: str, response: str, expires_at: float):
+        with self._lock:
+            self._items[key] = (response, expires_at)
+            self._items.move_to_end(key)
+            while len(self._items) > self._max_items:
+                self._items.popitem(last=False)
+
+    def _count(self, tenant_id: Optional[int], hit: bool):
+        i = 0 if hit else 1
+        with self._lock:
+            self._totals.setdefault(tenant_id, [0, 0])[i] += 1
+            self._pending.setdefault(tenant_id, [0, 0])[i] += 1
+
+    def get(self, ai_model: str, prompt: str, tenant_id: Optional[int] = None, conn=None,
+            json_mode: bool = False) -> Optional[str]:
+        """キャッシュ済みの応答（なければ None。ヒット／ミスを数える）"""
+        key = cache_key(ai_model, prompt, json_mode)
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                if item[1] > now:
+                    self._items.move_to_end(key)
+                else:
+                    del self._items[key]
+                    item = None
+        if item is not None:
+            self._count(tenant_id, True)
+            return item[0]
+
+        own = conn is None
+        if own:
+            conn = get_db()
+        row = None
+        try:
+            cur = conn.cursor()
+            cur.execute(_sql(conn, '''
+                SELECT 応答, 有効期限 FROM "T_AIキャッシュ" WHERE cache_key = %s AND 有効期限 > %s
+            '''), (key, now))
+            row = cur.fetchone()
+        except Exception as e:
+            print(f"AIキャッシュ参照エラー: {e}")
+        finally:
+            if own:
+                conn.close()
+        self._count(tenant_id, row is not None)
+        self._maybe_flush_stats()
+        if row is None:
+            return None
+        self._remember(key, row[0], row[1])
+        return row[0]
+
+    def put(self, ai_model: str, prompt: str, response: str, json_mode: bool = False):
+        """応答を保存（同じキーがあれば置き換える）"""
+        key = cache_key(ai_model, prompt, json_mode)
+        expires_at = time.time() + self._ttl
+        self._remember(key, response, expires_at)
+
+        try:
+            conn = get_independent_db()
+        except Exception as e:
+            print(f"AIキャッシュ保存エラー: {e}")
+            return
+        try:
+            cur = conn.cursor()
+            cur.execute(_sql(conn, '''
+                INSERT INTO "T_AIキャッシュ" (cache_key, モデル, 応答, 有効期限)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (cache_key) DO UPDATE SET 応答 = excluded.応答, 有効期限 = excluded.有効期限
+            '''), (key, ai_model, response, expires_at))
+            with self._lock:
+                self._puts += 1
+                evict = self._puts % AI_CACHE_EVICT_EVERY == 0
+            if evict:
+                self.evict(conn)
+            if not _is_pg(conn):
+                conn.commit()
+        except Exception as e:
+            print(f"AIキャッシュ保存エラー: {e}")
+        finally:
+            conn.close()
+
+    def evict(self, conn, max_rows: int = AI_CACHE_MAX_ROWS):
+        """期限切れの応答を削除し、件数が上限を超えていれば古いものから削除（コミットは呼び出し側）"""
+        cur = conn.cursor()
+        cur.execute(_sql(conn, 'DELETE FROM "T_AIキャッシュ" WHERE 有効期限 <= %s'), (time.time(),))
+        cur.execute('SELECT COUNT(*) FROM "T_AIキャッシュ"')
+        excess = cur.fetchone()[0] - max_rows
+        if excess > 0:
+            cur.execute(_sql(conn, '''
+                DELETE FROM "T_AIキャッシュ" WHERE cache_key IN (
+                    SELECT cache_key FROM "T_AIキャッシュ" ORDER BY 有効期限 LIMIT %s
+                )
+            '''), (excess,))
+
+    def _maybe_flush_stats(self):
+        if time.monotonic() - self._flushed_at >= AI_CACHE_STATS_FLUSH_SECONDS:
+            try:
+                self.flush_stats()
+            except Exception as e:
+                print(f"AIキャッシュ統計の保存エラー: {e}")
+
+    def flush_stats(self):
+        """未反映のヒット／ミス数を "T_AIキャッシュ統計" に加算"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = time.monotonic()
+        if not pending:
+            return
+        conn = get_independent_db()
+        try:
+            self._write_stats(conn, pending)
+        finally:
+            conn.close()
+
+    def _write_stats(self, conn, pending: Dict[Optional[int], list]):
+        cur = conn.cursor()
+        for tenant_id, (hits, misses) in pending.items():
+            cur.execute(_sql(conn, '''
+                INSERT INTO "T_AIキャッシュ統計" (tenant_id, ヒット数, ミス数)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (tenant_id) DO UPDATE SET
+                    ヒット数 = "T_AIキャッシュ統計".ヒット数 + excluded.ヒット数,
+                    ミス数 = "T_AIキャッシュ統計".ミス数 + excluded.ミス数,
+                    updated_at = CURRENT_TIMESTAMP
+            '''), (tenant_id or 0, hits, misses))
+        if not _is_pg(conn):
+            conn.commit()
+
+    def snapshot(self) -> Dict:
+        """プロセス起動後のテナントごとのヒット／ミス数"""
+        with self._lock:
+            return {
+                'memory_items': len(self._items),
+                'tenants': {
+                    str(tenant_id or 0): {
+                        'hits': hits,
+                        'misses': misses,
+                        'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None,
+                    }
+                    for tenant_id, (hits, misses) in self._totals.items()
+                },
+            }
+
+
+ai_cache = AiResponseCache()
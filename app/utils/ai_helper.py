@@ -4,10 +4,37 @@ AI統合ヘルパー
 Gemini 1.5 Flash、GPT-4o-mini、GPT-4oの3モデルに対応
 """
 
+import hashlib
+import json
 import os
-from typing import Dict, Optional, List
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Optional, List, Tuple
 from sqlalchemy.orm import Session
 
+from .ai_cache import ai_cache, AI_CACHE_ENABLED
+from .journal_generator import ACCOUNT_SUBJECTS
+from .fanout import run_all
+from .rate_limit import acquire as acquire_rate_limit, PROVIDER_GOOGLE, PROVIDER_OPENAI
+
+
+# 使われていないクライアントを破棄するまでの秒数と、1プロセスで保持するクライアント数の目安
+AI_CLIENT_IDLE_SECONDS = int(os.environ.get("AI_CLIENT_IDLE_SECONDS", "300"))
+AI_CLIENT_POOL_MAX = int(os.environ.get("AI_CLIENT_POOL_MAX", "32"))
+
+# 勘定科目の一括推定で1回のプロンプトに入れる量（トークン数の概算）と件数の上限
+AI_BATCH_TOKEN_BUDGET = int(os.environ.get("AI_BATCH_TOKEN_BUDGET", "30000"))
+AI_BATCH_MAX_ITEMS = int(os.environ.get("AI_BATCH_MAX_ITEMS", "50"))
+# 一括推定で1件あたりに送るOCRテキストの最大文字数
+AI_BATCH_ITEM_TEXT_CHARS = int(os.environ.get("AI_BATCH_ITEM_TEXT_CHARS", "600"))
+
+# レシートから推定する勘定科目（勘定科目マスタの費用）
+RECEIPT_ACCOUNT_SUBJECTS = tuple(name for name, info in ACCOUNT_SUBJECTS.items() if info['type'] == '費用')
+
 
 def get_ai_settings(db: Session, tenant_id: int) -> Dict[str, str]:
     """
@@ -40,35 +67,176 @@ def get_ai_settings(db: Session, tenant_id: int) -> Dict[str, str]:
     }
 
 
-def call_ai(prompt: str, ai_model: str, api_keys: Dict[str, str]) -> str:
+def call_ai(
+    prompt: str,
+    ai_model: str,
+    api_keys: Dict[str, str],
+    tenant_id: Optional[int] = None,
+    conn=None,
+    use_cache: bool = True,
+    json_mode: bool = False
+) -> str:
     """
     AIモデルを呼び出してテキスト生成
+    同じモデル・応答形式・プロンプトの応答は "T_AIキャッシュ" から返す（ai_cache.py）
     
     Args:
         prompt: プロンプト
         ai_model: AIモデル名（'gemini-1.5-flash', 'gpt-4o-mini', 'gpt-4o'）
         api_keys: APIキーの辞書
+        tenant_id: テナントID（キャッシュのヒット／ミス数の集計用）
+        conn: キャッシュに使うDB接続（省略時は get_db()）
+        use_cache: False の場合はキャッシュを使わずに毎回呼び出す
+        json_mode: True の場合は応答をJSONに限定する（プロンプトでJSONの形式を指示すること）
     
     Returns:
         AI応答テキスト
     """
+    if ai_model not in ('gemini-1.5-flash', 'gpt-4o-mini', 'gpt-4o'):
+        raise ValueError(f"サポートされていないAIモデル: {ai_model}")
+
+    use_cache = use_cache and AI_CACHE_ENABLED
+    if use_cache:
+        cached = ai_cache.get(ai_model, prompt, tenant_id=tenant_id, conn=conn, json_mode=json_mode)
+        if cached is not None:
+            return cached
+
+    # 全ワーカーで共有するプロバイダーごとの呼び出し回数の制限（足りなければ待つ）
+    acquire_rate_limit(PROVIDER_GOOGLE if ai_model == 'gemini-1.5-flash' else PROVIDER_OPENAI)
     if ai_model == 'gemini-1.5-flash':
-        return call_gemini(prompt, api_keys.get('google_api_key'))
-    elif ai_model == 'gpt-4o-mini':
-        return call_openai(prompt, 'gpt-4o-mini', api_keys.get('openai_api_key'))
-    elif ai_model == 'gpt-4o':
-        return call_openai(prompt, 'gpt-4o', api_keys.get('openai_api_key'))
+        response = call_gemini(prompt, api_keys.get('google_api_key'), json_mode=json_mode)
     else:
-        raise ValueError(f"サポートされていないAIモデル: {ai_model}")
+        response = call_openai(prompt, ai_model, api_keys.get('openai_api_key'), json_mode=json_mode)
+
+    # 失敗（例外）や空の応答は保存しない
+    if use_cache and response:
+        ai_cache.put(ai_model, prompt, response, json_mode=json_mode)
+    return response
+
+
+def _create_client(provider: str, api_key: str):
+    """プロバイダーのクライアントを作成（APIキーはクライアントごとに持ち、プロセス全体の設定は変えない）"""
+    if provider == PROVIDER_GOOGLE:
+        from google.ai import generativelanguage as glm
+        from google.api_core.client_options import ClientOptions
+        return glm.GenerativeServiceClient(client_options=ClientOptions(api_key=api_key))
+    from openai import OpenAI
+    return OpenAI(api_key=api_key)
+
 
+def _close_client(client):
+    try:
+        transport = getattr(client, 'transport', None)
+        if transport is not None:
+            transport.close()
+        else:
+            client.close()
+    except Exception as e:
+        print(f"⚠️ AIクライアントの終了エラー: {e}")
+
+
+class _PooledClient:
+    __slots__ = ('client', 'in_use', 'last_used')
+
+    def __init__(self, client):
+        self.client = client
+        self.in_use = 0
+        self.last_used = time.monotonic()
+
+
+class AiClientPool:
+    """
+    (プロバイダー, APIキー) ごとに1つのクライアントを保持して使い回すプール
+    クライアントは HTTP/gRPC の接続を保持したままスレッド間で共有できるため、呼び出しごとに作らない。
+    テナントごとに別のクライアントを使うので、スレッドで同時に処理してもAPIキーが混ざらない。
+    AI_CLIENT_IDLE_SECONDS 使われていないクライアントと、上限を超えた分（古い順）は破棄する
+    """
 
-def call_gemini(prompt: str, api_key: Optional[str]) -> str:
+    def __init__(self, idle_seconds: int = AI_CLIENT_IDLE_SECONDS, max_clients: int = AI_CLIENT_POOL_MAX):
+        self._idle_seconds = idle_seconds
+        self._max_clients = max(1, max_clients)
+        self._lock = threading.Lock()
+        self._clients: 'OrderedDict[Tuple[str, str], _PooledClient]' = OrderedDict()
+        self._pid = os.getpid()
+
+    def _reset_after_fork(self):
+        # fork 前のクライアントの接続は親プロセスのものなので使わない（close も呼ばない）
+        if self._pid != os.getpid():
+            self._clients = OrderedDict()
+            self._pid = os.getpid()
+
+    def _evict(self, now: float) -> List:
+        """使用中でないクライアントのうち、アイドル時間切れと上限超過のものを外す（呼び出し側でロック）"""
+        evicted = []
+        for key, entry in list(self._clients.items()):
+            if entry.in_use:
+                continue
+            if len(self._clients) > self._max_clients or now - entry.last_used >= self._idle_seconds:
+                del self._clients[key]
+                evicted.append(entry.client)
+        return evicted
+
+    @contextmanager
+    def client(self, provider: str, api_key: str):
+        """(プロバイダー, APIキー) のクライアントを借りる（なければ作成）"""
+        key = (provider, hashlib.sha256(api_key.encode('utf-8')).hexdigest())
+        with self._lock:
+            self._reset_after_fork()
+            entry = self._clients.get(key)
+            if entry is not None:
+                entry.in_use += 1
+                self._clients.move_to_end(key)
+            evicted = self._evict(time.monotonic())
+        for old in evicted:
+            _close_client(old)
+
+        if entry is None:
+            created = _create_client(provider, api_key)
+            with self._lock:
+                entry = self._clients.get(key)
+                if entry is None:
+                    entry = self._clients[key] = _PooledClient(created)
+                    created = None
+                entry.in_use += 1
+            if created is not None:
+                # 同時に別のスレッドが作成したものを使う
+                _close_client(created)
+
+        try:
+            yield entry.client
+        finally:
+            with self._lock:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+
+    def close_all(self):
+        """使用中でないクライアントをすべて破棄"""
+        with self._lock:
+            self._reset_after_fork()
+            evicted = []
+            for key, entry in list(self._clients.items()):
+                if not entry.in_use:
+                    del self._clients[key]
+                    evicted.append(entry.client)
+        for old in evicted:
+            _close_client(old)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._clients)
+
+
+client_pool = AiClientPool()
+
+
+def call_gemini(prompt: str, api_key: Optional[str], json_mode: bool = False) -> str:
     """
     Google Gemini APIを呼び出し
     
     Args:
         prompt: プロンプト
         api_key: Google API Key
+        json_mode: 応答をJSONに限定するか
     
     Returns:
         AI応答テキスト
@@ -76,16 +244,22 @@ def call_gemini(prompt: str, api_key: Optional[str]) -> str:
     if not api_key:
         raise ValueError("Google API Keyが設定されていません")
     
-    import google.generativeai as genai
+    from google.ai import generativelanguage as glm
     
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    
-    response = model.generate_content(prompt)
-    return response.text
+    # genai.configure（プロセス全体のAPIキー）を使わず、このキーの共有クライアントにリクエストを送る
+    request = glm.GenerateContentRequest(
+        model='models/gemini-1.5-flash',
+        contents=[glm.Content(role='user', parts=[glm.Part(text=prompt)])],
+        generation_config=glm.GenerationConfig(response_mime_type='application/json') if json_mode else None,
+    )
+    with client_pool.client(PROVIDER_GOOGLE, api_key) as client:
+        response = client.generate_content(request=request)
+    if not response.candidates:
+        raise ValueError(f"Gemini の応答がありません: {response.prompt_feedback}")
+    return ''.join(part.text for part in response.candidates[0].content.parts)
 
 
-def call_openai(prompt: str, model: str, api_key: Optional[str]) -> str:
+def call_openai(prompt: str, model: str, api_key: Optional[str], json_mode: bool = False) -> str:
     """
     OpenAI APIを呼び出し
     
@@ -93,6 +267,7 @@ def call_openai(prompt: str, model: str, api_key: Optional[str]) -> str:
         prompt: プロンプト
         model: モデル名（'gpt-4o-mini' or 'gpt-4o'）
         api_key: OpenAI API Key
+        json_mode: 応答をJSONに限定するか
     
     Returns:
         AI応答テキスト
@@ -100,23 +275,27 @@ def call_openai(prompt: str, model: str, api_key: Optional[str]) -> str:
     if not api_key:
         raise ValueError("OpenAI API Keyが設定されていません")
     
-    from openai import OpenAI
-    
-    client = OpenAI(api_key=api_key)
-    
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": "あなたは会計処理の専門家です。"},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.3,
-    )
+    with client_pool.client(PROVIDER_OPENAI, api_key) as client:
+        response = client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": "あなたは会計処理の専門家です。"},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.3,
+            **({'response_format': {'type': 'json_object'}} if json_mode else {}),
+        )
     
     return response.choices[0].message.content
 
 
-def correct_ocr_text(ocr_text: str, ai_model: str, api_keys: Dict[str, str]) -> str:
+def correct_ocr_text(
+    ocr_text: str,
+    ai_model: str,
+    api_keys: Dict[str, str],
+    tenant_id: Optional[int] = None,
+    conn=None
+) -> str:
     """
     OCR結果をAIで補正
     
@@ -124,6 +303,8 @@ def correct_ocr_text(ocr_text: str, ai_model: str, api_keys: Dict[str, str]) ->
         ocr_text: OCRで抽出されたテキスト
         ai_model: 使用するAIモデル
         api_keys: APIキーの辞書
+        tenant_id: テナントID
+        conn: DB接続（省略時は get_db()）
     
     Returns:
         補正されたテキスト
@@ -147,7 +328,7 @@ OCRの誤認識を修正し、正確なテキストに補正してください
 """
     
     try:
-        return call_ai(prompt, ai_model, api_keys)
+        return call_ai(prompt, ai_model, api_keys, tenant_id=tenant_id, conn=conn)
     except Exception as e:
         print(f"AI補正エラー: {e}")
         return ocr_text  # エラー時は元のテキストを返す
@@ -158,7 +339,9 @@ def estimate_account_subject_with_ai(
     company_name: Optional[str],
     amount: Optional[float],
     ai_model: str,
-    api_keys: Dict[str, str]
+    api_keys: Dict[str, str],
+    tenant_id: Optional[int] = None,
+    conn=None
 ) -> Dict[str, str]:
     """
     AIを使用して勘定科目を推定
@@ -169,6 +352,8 @@ def estimate_account_subject_with_ai(
         amount: 金額
         ai_model: 使用するAIモデル
         api_keys: APIキーの辞書
+        tenant_id: テナントID
+        conn: DB接続（省略時は get_db()）
     
     Returns:
         推定結果の辞書（勘定科目、摘要）
@@ -210,7 +395,7 @@ JSONのみを出力し、説明は不要です。
 """
     
     try:
-        response = call_ai(prompt, ai_model, api_keys)
+        response = call_ai(prompt, ai_model, api_keys, tenant_id=tenant_id, conn=conn)
         
         # JSON部分を抽出
         import json
@@ -240,10 +425,277 @@ JSONのみを出力し、説明は不要です。
         }
 
 
+def _parse_json_object(response: str) -> Optional[Dict]:
+    """応答からJSONオブジェクトを取り出す（```json ... ``` で囲まれていてもよい）"""
+    text = response.strip()
+    fenced = re.search(r'```(?:json)?\s*(\{.*\})\s*```', text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1)
+    else:
+        start, end = text.find('{'), text.rfind('}')
+        if start < 0 or end < start:
+            return None
+        text = text[start:end + 1]
+    try:
+        result = json.loads(text)
+    except ValueError:
+        return None
+    return result if isinstance(result, dict) else None
+
+
+def _optional_text(value) -> Optional[str]:
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    return value if value and value not in ('不明', 'null', 'None') else None
+
+
+def _validate_receipt_understanding(result: Dict) -> Optional[Dict]:
+    """
+    understand_receipt の応答を検証して正規化
+    形式が正しくない項目は None（勘定科目は 雑費）にし、補正後テキストがなければ None を返す
+    """
+    corrected_text = _optional_text(result.get('corrected_text'))
+    if not corrected_text:
+        return None
+
+    amount = result.get('amount')
+    if isinstance(amount, str):
+        amount = re.sub(r'[¥￥,円\s]', '', amount)
+        try:
+            amount = float(amount)
+        except ValueError:
+            amount = None
+    elif isinstance(amount, bool) or not isinstance(amount, (int, float)):
+        amount = None
+    if amount is not None and amount < 0:
+        amount = None
+
+    date = _optional_text(result.get('date'))
+    if date:
+        try:
+            date = datetime.strptime(date, '%Y-%m-%d').strftime('%Y-%m-%d')
+        except ValueError:
+            date = None
+
+    invoice_number = _optional_text(result.get('invoice_number'))
+    if invoice_number:
+        invoice_number = invoice_number.replace(' ', '').replace('-', '')
+        if not re.fullmatch(r'T\d{13}', invoice_number):
+            invoice_number = None
+
+    account_subject = _optional_text(result.get('account_subject'))
+    if account_subject not in RECEIPT_ACCOUNT_SUBJECTS:
+        account_subject = '雑費'
+
+    return {
+        'corrected_text': corrected_text,
+        'company_name': _optional_text(result.get('company_name')),
+        'amount': amount,
+        'date': date,
+        'invoice_number': invoice_number,
+        'account_subject': account_subject,
+        'description': _optional_text(result.get('description')) or '',
+    }
+
+
+def understand_receipt(
+    ocr_text: str,
+    ai_model: str,
+    api_keys: Dict[str, str],
+    tenant_id: Optional[int] = None,
+    conn=None
+) -> Optional[Dict]:
+    """
+    レシートのOCR補正・会社名の正規化・項目の読み取り・勘定科目の推定を1回のAI呼び出しで行う
+    correct_ocr_text / normalize_company_name_with_ai / estimate_account_subject_with_ai を
+    順に呼ぶ代わりに、OCRテキストを1回だけ送ってJSONで受け取る
+    
+    Args:
+        ocr_text: OCRで抽出されたテキスト
+        ai_model: 使用するAIモデル
+        api_keys: APIキーの辞書
+        tenant_id: テナントID
+        conn: DB接続（省略時は get_db()）
+    
+    Returns:
+        検証済みの結果の辞書（corrected_text, company_name, amount, date, invoice_number,
+        account_subject, description）。応答が読み取れない場合は None
+        （呼び出し側は個別のヘルパーにフォールバックする）
+    """
+    subjects = '、'.join(RECEIPT_ACCOUNT_SUBJECTS)
+    prompt = f"""
+以下はレシート・領収書からOCRで抽出されたテキストです。
+OCRの誤認識を補正したうえで、各項目を読み取ってください。
+
+【補正ルール】
+1. 「林式会社」→「株式会社」
+2. 数字の「0」と英字の「O」を区別
+3. 「1」と「l」（エル）を区別
+4. 住所の番地の誤認識を修正
+5. 会社名の略称を正式名称に変換（㈱→株式会社、(株)→株式会社、(有)→有限会社など）
+
+【OCRテキスト】
+{ocr_text}
+
+【利用可能な勘定科目】
+{subjects}
+
+【出力形式】
+以下のJSON形式で出力してください。読み取れない項目は null にしてください。
+{{
+  "corrected_text": "補正後のテキスト全文",
+  "company_name": "発行元の会社名（正式名称）",
+  "amount": 合計金額（数値）,
+  "date": "YYYY-MM-DD",
+  "invoice_number": "T + 13桁のインボイス登録番号",
+  "account_subject": "勘定科目名（利用可能な勘定科目から1つ）",
+  "description": "摘要（具体的な内容）"
+}}
+
+JSONのみを出力し、説明は不要です。
+"""
+    
+    try:
+        response = call_ai(prompt, ai_model, api_keys, tenant_id=tenant_id, conn=conn, json_mode=True)
+    except Exception as e:
+        print(f"AIレシート読み取りエラー: {e}")
+        return None
+
+    result = _parse_json_object(response)
+    understanding = _validate_receipt_understanding(result) if result else None
+    if understanding is None:
+        print("⚠️ AIレシート読み取りの応答が不正なため、個別の補正にフォールバックします")
+    return understanding
+
+
+def _estimate_tokens(text: str) -> int:
+    """トークン数の概算（日本語は1文字が1トークン前後になるため、文字数を上限として使う）"""
+    return len(text)
+
+
+def _account_subject_item_text(number: int, item: Dict) -> str:
+    ocr_text = (item.get('ocr_text') or item.get('description') or '')[:AI_BATCH_ITEM_TEXT_CHARS]
+    return f"""
+[{number}]
+会社名: {item.get('company_name') or '不明'}
+金額: {item.get('amount') or '不明'}円
+摘要: {item.get('description') or '不明'}
+レシート内容:
+{ocr_text}
+"""
+
+
+def _split_by_token_budget(item_texts: List[str], budget: int, max_items: int) -> List[List[int]]:
+    """各件のテキストを、概算トークン数が budget 以内・max_items 件以内になるよう分ける（1件で超える場合は単独）"""
+    batches = []
+    current, used = [], 0
+    for index, text in enumerate(item_texts):
+        tokens = _estimate_tokens(text)
+        if current and (used + tokens > budget or len(current) >= max_items):
+            batches.append(current)
+            current, used = [], 0
+        current.append(index)
+        used += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def estimate_account_subjects_with_ai(
+    items: List[Dict],
+    ai_model: str,
+    api_keys: Dict[str, str],
+    tenant_id: Optional[int] = None,
+    conn=None
+) -> List[Optional[Dict[str, str]]]:
+    """
+    複数の証憑の勘定科目をまとめて推定
+    1件ずつ estimate_account_subject_with_ai を呼ぶ代わりに、AI_BATCH_TOKEN_BUDGET に収まる
+    件数ずつ1つのプロンプトに入れ、番号付きのJSONで受け取る
+    
+    Args:
+        items: 証憑のリスト（ocr_text, description, company_name, amount）
+        ai_model: 使用するAIモデル
+        api_keys: APIキーの辞書
+        tenant_id: テナントID
+        conn: DB接続（省略時は get_db()）
+    
+    Returns:
+        items と同じ順の推定結果（account_subject, description）。
+        推定できなかった件は None（呼び出し側でキーワードマッチングにフォールバックする）
+    """
+    results: List[Optional[Dict[str, str]]] = [None] * len(items)
+    if not items:
+        return results
+
+    subjects = '、'.join(RECEIPT_ACCOUNT_SUBJECTS)
+    item_texts = [_account_subject_item_text(n, item) for n, item in enumerate(items, start=1)]
+    # 番号は batch 内ではなく items 全体の通し番号（応答の番号をそのまま位置に戻せるように）
+    batches = _split_by_token_budget(item_texts, AI_BATCH_TOKEN_BUDGET, AI_BATCH_MAX_ITEMS)
+    # 複数のバッチは並行して呼び出す（スレッドでは呼び出し元の接続を使わない）
+    batch_conn = conn if len(batches) == 1 else None
+
+    def request(batch: List[int]) -> Optional[str]:
+        prompt = f"""
+以下の{len(batch)}件のレシート・領収書情報から、それぞれ適切な勘定科目を推定してください。
+
+【利用可能な勘定科目】
+{subjects}
+
+【レシート】
+{''.join(item_texts[i] for i in batch)}
+
+【出力形式】
+以下のJSON形式で、すべてのレシートについて番号とともに出力してください。
+{{
+  "items": [
+    {{"id": 番号, "account_subject": "勘定科目名", "description": "摘要（具体的な内容）"}}
+  ]
+}}
+
+JSONのみを出力し、説明は不要です。
+"""
+        try:
+            return call_ai(prompt, ai_model, api_keys, tenant_id=tenant_id, conn=batch_conn, json_mode=True)
+        except Exception as e:
+            print(f"AI勘定科目一括推定エラー: {e}")
+            return None
+
+    responses = run_all([lambda batch=batch: request(batch) for batch in batches])
+    for batch, response in zip(batches, responses):
+        if response is None:
+            continue
+        parsed = _parse_json_object(response) or {}
+        entries = parsed.get('items')
+        if not isinstance(entries, list):
+            print(f"⚠️ AI勘定科目一括推定の応答が不正です（{len(batch)}件）")
+            continue
+        expected = set(batch)
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            try:
+                index = int(entry.get('id')) - 1
+            except (TypeError, ValueError):
+                continue
+            subject = _optional_text(entry.get('account_subject'))
+            if index not in expected or subject not in RECEIPT_ACCOUNT_SUBJECTS:
+                continue
+            results[index] = {
+                'account_subject': subject,
+                'description': _optional_text(entry.get('description')) or '',
+            }
+
+    return results
+
+
 def normalize_company_name_with_ai(
     company_name: str,
     ai_model: str,
-    api_keys: Dict[str, str]
+    api_keys: Dict[str, str],
+    tenant_id: Optional[int] = None,
+    conn=None
 ) -> str:
     """
     AIを使用して会社名を正規化
@@ -252,6 +704,8 @@ def normalize_company_name_with_ai(
         company_name: 会社名
         ai_model: 使用するAIモデル
         api_keys: APIキーの辞書
+        tenant_id: テナントID
+        conn: DB接続（省略時は get_db()）
     
     Returns:
         正規化された会社名
@@ -273,7 +727,7 @@ def normalize_company_name_with_ai(
 """
     
     try:
-        return call_ai(prompt, ai_model, api_keys).strip()
+        return call_ai(prompt, ai_model, api_keys, tenant_id=tenant_id, conn=conn).strip()
     except Exception as e:
         print(f"AI会社名正規化エラー: {e}")
         return company_name
@@ -283,7 +737,9 @@ def select_best_company_from_candidates(
     candidates: List[Dict],
     ocr_address: Optional[str],
     ai_model: str,
-    api_keys: Dict[str, str]
+    api_keys: Dict[str, str],
+    tenant_id: Optional[int] = None,
+    conn=None
 ) -> Optional[Dict]:
     """
     複数の企業候補から最適な企業をAIで選択
@@ -293,6 +749,8 @@ def select_best_company_from_candidates(
         ocr_address: OCRで抽出された住所
         ai_model: 使用するAIモデル
         api_keys: APIキーの辞書
+        tenant_id: テナントID
+        conn: DB接続（省略時は get_db()）
     
     Returns:
         選択された企業情報
@@ -324,7 +782,7 @@ def select_best_company_from_candidates(
 """
     
     try:
-        response = call_ai(prompt, ai_model, api_keys).strip()
+        response = call_ai(prompt, ai_model, api_keys, tenant_id=tenant_id, conn=conn).strip()
         # 数字のみを抽出
         import re
         match = re.search(r'\d+', response)
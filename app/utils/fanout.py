@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+外部API呼び出しの並行実行
+AI・国税庁API の SDK はブロッキングのため、プロセス内で共有するスレッドプールで
+互いに依存しない呼び出し（国税庁APIの検索とAIの会社名正規化、証憑ごとのAI呼び出しなど）を
+同時に実行する。呼び出し回数は rate_limit.py のバケットで制限する。
+
+スレッドではリクエストの DB接続（flask.g）を使えないため、渡す関数の中では conn=None
+（get_db() がプールから貸し出す）を使い、呼び出し元の接続を渡さないこと
+"""
+
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Sequence, TypeVar
+
+
+# 1プロセスで同時に実行する外部API呼び出しの数（1 なら並行実行しない）
+FANOUT_WORKERS = int(os.environ.get("FANOUT_WORKERS", "4"))
+
+T = TypeVar('T')
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_local = threading.local()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """プロセス内で共有するスレッドプール（fork 後は作り直す）"""
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix='fanout')
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def _run_in_worker(fn: Callable[[], T]) -> T:
+    _local.in_worker = True
+    try:
+        return fn()
+    finally:
+        _local.in_worker = False
+
+
+def submit(fn: Callable[[], T]) -> Future:
+    """引数なしの関数をスレッドプールで実行"""
+    return _get_executor().submit(_run_in_worker, fn)
+
+
+def run_all(calls: Sequence[Callable[[], T]]) -> List[T]:
+    """
+    引数なしの関数をまとめて並行実行し、同じ順で結果を返す（例外は呼び出し元に送出）
+    先頭の関数は呼び出し元のスレッドで実行し、残りをスレッドプールで実行する。
+    1件だけの場合と、プールのスレッドの中から呼ばれた場合（待ち合わせでプールが詰まらないように）はその場で順に実行する
+    """
+    if len(calls) <= 1 or FANOUT_WORKERS <= 1 or getattr(_local, 'in_worker', False):
+        return [call() for call in calls]
+    futures = [submit(call) for call in calls[1:]]
+    first = calls[0]()
+    return [first] + [future.result() for future in futures]
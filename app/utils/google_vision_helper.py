@@ -7,6 +7,16 @@ import os
 import json
 import base64
 import tempfile
+import threading
+from typing import List, Optional, Tuple
+
+# batch_annotate_images の1リクエストあたりの上限（画像数 / 画像バイト数の合計。JSON は10MBまで）
+VISION_BATCH_SIZE = 16
+VISION_BATCH_MAX_BYTES = 7 * 1024 * 1024
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
 
 
 def setup_google_credentials():
@@ -55,3 +65,64 @@ def is_google_vision_available() -> bool:
         利用可能な場合True
     """
     return bool(os.environ.get('GOOGLE_APPLICATION_CREDENTIALS'))
+
+
+def get_vision_client():
+    """
+    プロセス内で共有する Vision API クライアントを返す
+    gRPC チャネルは fork を跨いで使えないため、初回利用時（gunicorn の fork 後）に作成し、
+    プロセスIDが変わっていたら作り直す
+    """
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        return _client
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            from google.cloud import vision
+            if not os.environ.get('GOOGLE_APPLICATION_CREDENTIALS'):
+                raise Exception("GOOGLE_APPLICATION_CREDENTIALS環境変数が設定されていません")
+            _client = vision.ImageAnnotatorClient()
+            _client_pid = os.getpid()
+    return _client
+
+
+def _batches(contents: List[bytes]):
+    """画像数とバイト数の上限に収まるよう (開始位置, 画像リスト) に分割"""
+    start, chunk, size = 0, [], 0
+    for i, content in enumerate(contents):
+        if chunk and (len(chunk) >= VISION_BATCH_SIZE or size + len(content) > VISION_BATCH_MAX_BYTES):
+            yield start, chunk
+            start, chunk, size = i, [], 0
+        chunk.append(content)
+        size += len(content)
+    if chunk:
+        yield start, chunk
+
+
+def batch_detect_text(image_paths: List[str]) -> List[Tuple[Optional[str], Optional[str]]]:
+    """
+    複数画像のテキスト検出を batch_annotate_images でまとめて実行
+
+    Returns:
+        画像ごとの (テキスト, エラーメッセージ)。成功時はエラーが None、失敗時はテキストが None
+    """
+    from google.cloud import vision
+
+    client = get_vision_client()
+    contents = []
+    for path in image_paths:
+        with open(path, 'rb') as f:
+            contents.append(f.read())
+
+    results: List[Tuple[Optional[str], Optional[str]]] = [(None, None)] * len(contents)
+    feature = vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)
+    for start, chunk in _batches(contents):
+        requests = [vision.AnnotateImageRequest(image=vision.Image(content=c), features=[feature]) for c in chunk]
+        response = client.batch_annotate_images(requests=requests)
+        for offset, r in enumerate(response.responses):
+            if r.error.message:
+                results[start + offset] = (None, r.error.message)
+            else:
+                text = r.text_annotations[0].description if r.text_annotations else ""
+                results[start + offset] = (text, None)
+    return results
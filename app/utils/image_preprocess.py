@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+OCR前の画像前処理（OpenCV）
+- EXIF の向きを補正
+- レシートの輪郭で切り抜き
+- 傾き補正（デスキュー）
+- 目標解像度まで縮小
+- 二値化
+処理結果は元画像と同じフォルダの .derived/ に保存し、元画像が変わらない限り再利用する
+"""
+
+import os
+import threading
+from typing import Optional, Tuple
+
+from PIL import Image, ImageOps
+
+try:
+    import cv2
+    import numpy as np
+except Exception:
+    cv2 = None
+    np = None
+
+
+# 前処理の内容を変えたら上げる（古い派生画像を使わないため）
+PREPROCESS_VERSION = 2
+
+# 画像に解像度情報があればこの DPI まで縮小し、いずれの場合も長辺をこのピクセル数までにする
+OCR_TARGET_DPI = int(os.environ.get("OCR_TARGET_DPI", "300"))
+OCR_MAX_LONG_EDGE = int(os.environ.get("OCR_MAX_LONG_EDGE", "2000"))
+OCR_PREPROCESS = os.environ.get("OCR_PREPROCESS", "1") in ("1", "true", "True")
+
+DERIVED_DIR = '.derived'
+RASTER_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif'}
+
+
+def derived_path(image_path: str) -> str:
+    """前処理済み画像の保存先"""
+    folder, name = os.path.split(image_path)
+    return os.path.join(folder, DERIVED_DIR, f'{name}.ocr-v{PREPROCESS_VERSION}.png')
+
+
+def _load_upright(image_path: str) -> Tuple['np.ndarray', Optional[float]]:
+    """EXIF の向きを反映したグレースケール画像と、元画像の DPI（不明なら None）"""
+    with Image.open(image_path) as image:
+        dpi = image.info.get('dpi')
+        image = ImageOps.exif_transpose(image).convert('L')
+        gray = np.array(image)
+    if dpi and dpi[0] and dpi[0] > 1:
+        return gray, float(dpi[0])
+    return gray, None
+
+
+def _crop_to_receipt(gray: 'np.ndarray') -> 'np.ndarray':
+    """背景より明るいレシート部分の輪郭で切り抜く（見つからなければそのまま）"""
+    h, w = gray.shape
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    _, mask = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((15, 15), np.uint8))
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return gray
+    x, y, cw, ch = cv2.boundingRect(max(contours, key=cv2.contourArea))
+    # 小さすぎる（誤検出）／ほぼ全体（背景なし）の場合は切り抜かない
+    if cw * ch < 0.2 * w * h or cw * ch > 0.95 * w * h:
+        return gray
+    return gray[y:y + ch, x:x + cw]
+
+
+def _deskew(gray: 'np.ndarray') -> 'np.ndarray':
+    """文字部分の外接矩形の角度で傾きを補正"""
+    _, ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    coords = cv2.findNonZero(ink)
+    if coords is None:
+        return gray
+    angle = cv2.minAreaRect(coords)[-1]
+    # OpenCV のバージョンで角度の範囲が異なるため -45〜45 度に正規化
+    if angle > 45:
+        angle -= 90
+    elif angle < -45:
+        angle += 90
+    if abs(angle) < 0.5:
+        return gray
+    h, w = gray.shape
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(gray, matrix, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+
+
+# これ以下の DPI は画面用の既定値（スマートフォンの JPEG の 72 など）で、実際の解像度を表さないため使わない
+MIN_TRUSTED_DPI = 96
+
+
+def _downscale(gray: 'np.ndarray', dpi: Optional[float]) -> 'np.ndarray':
+    """目標解像度まで縮小し、長辺は常に OCR_MAX_LONG_EDGE までにする（拡大はしない）"""
+    h, w = gray.shape
+    scale = OCR_MAX_LONG_EDGE / max(h, w)
+    if dpi and dpi > MIN_TRUSTED_DPI:
+        scale = min(scale, OCR_TARGET_DPI / dpi)
+    if scale >= 1:
+        return gray
+    return cv2.resize(gray, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+def _binarize(gray: 'np.ndarray') -> 'np.ndarray':
+    """影やムラがあっても文字が残るよう、局所的な閾値で二値化"""
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15)
+
+
+def preprocess_image(image_path: str, output_path: str) -> str:
+    """前処理を行い output_path に PNG で保存"""
+    gray, dpi = _load_upright(image_path)
+    gray = _crop_to_receipt(gray)
+    gray = _deskew(gray)
+    gray = _downscale(gray, dpi)
+    binary = _binarize(gray)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    # 同時に（別プロセス・別スレッドで）同じ画像を処理しても壊れたファイルを読まないよう、書き終えてから置き換える
+    tmp_path = f'{output_path}.{os.getpid()}.{threading.get_ident()}.tmp.png'
+    cv2.imwrite(tmp_path, binary)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def preprocess_for_ocr(image_path: str) -> str:
+    """
+    OCR に渡す画像のパスを返す
+    前処理済みの派生画像があればそれを、なければ作成して返す。
+    PDF・OpenCV 未導入・前処理の失敗時は元画像のパスを返す
+    """
+    if not OCR_PREPROCESS or cv2 is None:
+        return image_path
+    if os.path.splitext(image_path)[1].lower() not in RASTER_EXTENSIONS:
+        return image_path
+
+    output_path = derived_path(image_path)
+    try:
+        if os.path.getmtime(output_path) >= os.path.getmtime(image_path):
+            return output_path
+    except OSError:
+        pass
+
+    try:
+        return preprocess_image(image_path, output_path)
+    except Exception as e:
+        print(f"画像前処理エラー（元画像でOCRします）: {e}")
+        return image_path
@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+"""
+DBベースのジョブキュー
+- ジョブは "T_ジョブ" に保存し、Webプロセスとは別のワーカープロセスが取り出して実行する
+- PostgreSQL: SELECT ... FOR UPDATE SKIP LOCKED で複数ワーカーが同じジョブを取らない
+- SQLite: BEGIN IMMEDIATE で書き込みロックを取ってから取り出す
+- 失敗したジョブは指数バックオフで再試行し、最大試行回数を超えたら failed にする
+- 実行中の段階（処理段階）を記録し、ステータス確認APIから参照できる
+
+ワーカーの起動:
+    python -m app.utils.jobs [--workers 2]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import traceback
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from .db import get_db, _is_pg, _sql
+from .statements import Statement
+
+
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_SECONDS = float(os.environ.get("JOB_RETRY_BASE_SECONDS", "30"))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "2"))
+# ワーカーが一度に取り出すジョブ数（同じ種別はハンドラの prefetch でまとめて前処理できる）
+JOB_CLAIM_BATCH = int(os.environ.get("JOB_CLAIM_BATCH", "8"))
+# running のまま更新されないジョブ（ワーカーの強制終了など）を再実行するまでの秒数
+JOB_LOCK_TIMEOUT = int(os.environ.get("JOB_LOCK_TIMEOUT", "600"))
+# 参照されなくなったアップロードファイルを削除する間隔（秒。0 で削除しない）
+FILE_GC_INTERVAL = float(os.environ.get("FILE_GC_INTERVAL", "600"))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+JOB_COLUMNS = 'id, tenant_id, 種別, 証憑ID, 入力データ, 試行回数, 最大試行回数'
+
+
+@dataclass
+class Job:
+    """取り出したジョブ"""
+    id: int
+    tenant_id: int
+    kind: str
+    voucher_id: Optional[int]
+    payload: Dict = field(default_factory=dict)
+    attempts: int = 1
+    max_attempts: int = JOB_MAX_ATTEMPTS
+    # prefetch でまとめて取得した途中結果（ハンドラ間で受け渡す。DBには保存しない）
+    prefetched: Dict = field(default_factory=dict)
+
+    @classmethod
+    def from_row(cls, row) -> 'Job':
+        return cls(
+            id=row['id'],
+            tenant_id=row['tenant_id'],
+            kind=row['種別'],
+            voucher_id=row['証憑ID'],
+            payload=json.loads(row['入力データ'] or '{}'),
+            attempts=row['試行回数'],
+            max_attempts=row['最大試行回数'],
+        )
+
+
+# 種別 -> ハンドラ(conn, job) -> 結果 dict
+_handlers: Dict[str, Callable] = {}
+
+
+def job_handler(kind: str):
+    """ジョブ種別のハンドラを登録するデコレータ"""
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def init_job_schema(conn):
+    """ジョブキューのテーブルとインデックスの作成"""
+    cur = conn.cursor()
+    if _is_pg(conn):
+        pk = 'INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY'
+    else:
+        pk = 'INTEGER PRIMARY KEY AUTOINCREMENT'
+
+    cur.execute(f'''
+    CREATE TABLE IF NOT EXISTS "T_ジョブ"(
+        id                  {pk},
+        tenant_id           INTEGER,
+        種別                TEXT NOT NULL,
+        証憑ID              INTEGER,
+        ステータス          TEXT NOT NULL DEFAULT 'queued',
+        処理段階            TEXT,
+        試行回数            INTEGER NOT NULL DEFAULT 0,
+        最大試行回数        INTEGER NOT NULL DEFAULT 3,
+        実行予定日時        TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        ロック者            TEXT,
+        ロック日時          TIMESTAMP,
+        入力データ          TEXT,
+        結果                TEXT,
+        エラー内容          TEXT,
+        created_at          TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at          TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    # 取り出し: WHERE ステータス ORDER BY 実行予定日時, id
+    cur.execute('CREATE INDEX IF NOT EXISTS "idx_ジョブ_status_run_at" ON "T_ジョブ" (ステータス, 実行予定日時, id)')
+    # ステータス確認: 証憑ごとの最新ジョブ
+    cur.execute('CREATE INDEX IF NOT EXISTS "idx_ジョブ_voucher" ON "T_ジョブ" (証憑ID, id)')
+
+    if not _is_pg(conn):
+        conn.commit()
+
+
+def _now(conn, offset_seconds: float = 0):
+    """現在時刻（+offset 秒）の SQL 式とパラメータ"""
+    if _is_pg(conn):
+        return 'now() + make_interval(secs => %s)', (offset_seconds,)
+    return "datetime('now', %s)", (f'{offset_seconds:+.0f} seconds',)
+
+
+def _claim_candidates(conn):
+    """取り出し対象のジョブを選ぶ SELECT とパラメータ（実行予定日時の到来した queued と、ロックの期限切れの running）"""
+    now_sql, now_params = _now(conn)
+    stale_sql, stale_params = _now(conn, -JOB_LOCK_TIMEOUT)
+    sql = f'''
+        SELECT id FROM "T_ジョブ"
+        WHERE (ステータス = 'queued' AND 実行予定日時 <= {now_sql})
+           OR (ステータス = 'running' AND ロック日時 < {stale_sql})
+        ORDER BY 実行予定日時, id
+    '''
+    return sql, (*now_params, *stale_params)
+
+
+# 証憑の最新ジョブ（頻出クエリ）
+LATEST_JOB_FOR_VOUCHER = Statement('latest_job_for_voucher', '''
+    SELECT id, ステータス, 処理段階, 試行回数, 最大試行回数, 結果, エラー内容, 実行予定日時, updated_at
+    FROM "T_ジョブ"
+    WHERE 証憑ID = %s AND tenant_id = %s
+    ORDER BY id DESC
+    LIMIT 1
+''')
+
+
+def enqueue(conn, kind: str, tenant_id: Optional[int], payload: Optional[Dict] = None,
+            voucher_id: Optional[int] = None, max_attempts: int = JOB_MAX_ATTEMPTS) -> int:
+    """
+    ジョブを登録（コミットは呼び出し側）
+
+    Returns:
+        ジョブID
+    """
+    cur = conn.cursor()
+    sql = '''
+        INSERT INTO "T_ジョブ" (tenant_id, 種別, 証憑ID, 入力データ, 最大試行回数)
+        VALUES (%s, %s, %s, %s, %s)
+    '''
+    params = (tenant_id, kind, voucher_id, json.dumps(payload or {}, ensure_ascii=False), max_attempts)
+    if _is_pg(conn):
+        cur.execute(sql + ' RETURNING id', params)
+        return cur.fetchone()[0]
+    cur.execute(_sql(conn, sql), params)
+    return cur.lastrowid
+
+
+def claim(conn, worker_id: str, limit: int = 1) -> List[Job]:
+    """実行可能なジョブを最大 limit 件取り出して running にする"""
+    now_sql, now_params = _now(conn)
+    candidates, candidate_params = _claim_candidates(conn)
+    update = f'''
+        UPDATE "T_ジョブ"
+        SET ステータス = 'running', ロック者 = %s, ロック日時 = {now_sql},
+            試行回数 = 試行回数 + 1, updated_at = CURRENT_TIMESTAMP
+    '''
+    cur = conn.cursor()
+
+    if _is_pg(conn):
+        cur.execute(f'''
+            {update}
+            WHERE id IN ({candidates} FOR UPDATE SKIP LOCKED LIMIT %s)
+            RETURNING {JOB_COLUMNS}
+        ''', (worker_id, *now_params, *candidate_params, limit))
+        return sorted((Job.from_row(row) for row in cur.fetchall()), key=lambda job: job.id)
+
+    # SQLite: 書き込みロックを取ってから選ぶので、同時に同じジョブを取ることはない
+    if conn.in_transaction:
+        conn.commit()
+    cur.execute('BEGIN IMMEDIATE')
+    try:
+        cur.execute(_sql(conn, candidates + ' LIMIT %s'), (*candidate_params, limit))
+        ids = [row['id'] for row in cur.fetchall()]
+        if not ids:
+            conn.rollback()
+            return []
+        placeholders = ', '.join(['%s'] * len(ids))
+        cur.execute(_sql(conn, update + f' WHERE id IN ({placeholders})'), (worker_id, *now_params, *ids))
+        cur.execute(_sql(conn, f'SELECT {JOB_COLUMNS} FROM "T_ジョブ" WHERE id IN ({placeholders}) ORDER BY id'), ids)
+        jobs = [Job.from_row(row) for row in cur.fetchall()]
+        conn.commit()
+        return jobs
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def renew_locks(conn, job_ids: List[int]):
+    """
+    処理中のジョブのロック日時を現在時刻に更新する
+    まとめて取り出したジョブは順に実行するため、後ろのジョブが処理中のまま
+    JOB_LOCK_TIMEOUT を過ぎて他のワーカーに取り直されないようにする
+    """
+    if not job_ids:
+        return
+    now_sql, now_params = _now(conn)
+    placeholders = ', '.join(['%s'] * len(job_ids))
+    cur = conn.cursor()
+    cur.execute(_sql(conn, f'''
+        UPDATE "T_ジョブ" SET ロック日時 = {now_sql}
+        WHERE id IN ({placeholders}) AND ステータス = 'running'
+    '''), (*now_params, *job_ids))
+    if not _is_pg(conn):
+        conn.commit()
+
+
+def set_stage(conn, job_id: int, stage: str):
+    """処理段階を記録（ステータス確認用）。処理が進んでいるのでロック日時も更新する"""
+    now_sql, now_params = _now(conn)
+    cur = conn.cursor()
+    cur.execute(_sql(conn, f'''
+        UPDATE "T_ジョブ" SET 処理段階 = %s, ロック日時 = {now_sql}, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s
+    '''), (stage, *now_params, job_id))
+    if not _is_pg(conn):
+        conn.commit()
+
+
+def complete(conn, job: Job, result: Optional[Dict] = None):
+    cur = conn.cursor()
+    cur.execute(_sql(conn, '''
+        UPDATE "T_ジョブ"
+        SET ステータス = 'done', 処理段階 = 'done', 結果 = %s, エラー内容 = NULL,
+            ロック者 = NULL, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s
+    '''), (json.dumps(result or {}, ensure_ascii=False, default=str), job.id))
+    if not _is_pg(conn):
+        conn.commit()
+
+
+def fail(conn, job: Job, error: str, retryable: bool = True) -> str:
+    """
+    失敗を記録。試行回数が残っていれば指数バックオフで再登録、なければ failed
+
+    Returns:
+        新しいステータス（queued / failed）
+    """
+    if not _is_pg(conn) and conn.in_transaction:
+        conn.rollback()
+    cur = conn.cursor()
+    if retryable and job.attempts < job.max_attempts:
+        delay = JOB_RETRY_BASE_SECONDS * (2 ** (job.attempts - 1))
+        run_at_sql, run_at_params = _now(conn, delay)
+        cur.execute(_sql(conn, f'''
+            UPDATE "T_ジョブ"
+            SET ステータス = 'queued', エラー内容 = %s, ロック者 = NULL,
+                実行予定日時 = {run_at_sql}, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+        '''), (error, *run_at_params, job.id))
+        status = QUEUED
+    else:
+        cur.execute(_sql(conn, '''
+            UPDATE "T_ジョブ"
+            SET ステータス = 'failed', エラー内容 = %s, ロック者 = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+        '''), (error, job.id))
+        status = FAILED
+    if not _is_pg(conn):
+        conn.commit()
+    return status
+
+
+def latest_job_for_voucher(conn, voucher_id: int, tenant_id: int):
+    """証憑の最新ジョブ（ステータス確認用）"""
+    cur = conn.cursor()
+    cur.execute(*LATEST_JOB_FOR_VOUCHER.bind(conn, (voucher_id, tenant_id)))
+    return cur.fetchone()
+
+
+def execute(conn, job: Job) -> str:
+    """
+    取り出したジョブをハンドラで実行し、結果を記録
+
+    Returns:
+        ジョブの新しいステータス
+    """
+    handler = _handlers.get(job.kind)
+    if handler is None:
+        return fail(conn, job, f'未登録のジョブ種別: {job.kind}', retryable=False)
+    if job.attempts > job.max_attempts:
+        return fail(conn, job, 'ワーカーが応答しないまま試行回数の上限に達しました', retryable=False)
+    renew_locks(conn, [job.id])
+    try:
+        result = handler(conn, job)
+    except Exception as e:
+        print(f"❌ ジョブ失敗 #{job.id} ({job.kind}, {job.attempts}/{job.max_attempts}回目): {e}")
+        traceback.print_exc()
+        status = fail(conn, job, str(e) or e.__class__.__name__)
+        on_failed = getattr(handler, 'on_failed', None)
+        if status == FAILED and on_failed is not None:
+            on_failed(conn, job, e)
+        return status
+    complete(conn, job, result)
+    return DONE
+
+
+def _load_handlers():
+    # ハンドラはモジュールの import 時に登録される
+    from . import voucher_pipeline  # noqa: F401
+
+
+def prefetch(conn, jobs: List[Job]):
+    """
+    同じ種別のジョブが複数あれば、ハンドラの prefetch(conn, jobs) でまとめて前処理する
+    （例: 複数画像の OCR を1回の API 呼び出しで行う）。失敗しても各ジョブは個別に実行される
+    """
+    by_kind: Dict[str, List[Job]] = {}
+    for job in jobs:
+        by_kind.setdefault(job.kind, []).append(job)
+    for kind, group in by_kind.items():
+        batch = getattr(_handlers.get(kind), 'prefetch', None)
+        if batch is None or len(group) < 2:
+            continue
+        try:
+            batch(conn, group)
+        except Exception as e:
+            print(f"⚠️ ジョブの一括前処理に失敗（個別に処理します）: {kind}: {e}")
+
+
+def work_once(worker_id: str, limit: int = JOB_CLAIM_BATCH) -> bool:
+    """ジョブを最大 limit 件取り出して処理（処理したら True）"""
+    conn = get_db()
+    try:
+        jobs = claim(conn, worker_id, limit)
+        if not jobs:
+            return False
+        prefetch(conn, jobs)
+        renew_locks(conn, [job.id for job in jobs])
+        for job in jobs:
+            execute(conn, job)
+        return True
+    finally:
+        conn.close()
+
+
+def _collect_files():
+    """参照数 0 のアップロードファイルを削除"""
+    from .upload_store import collect_garbage
+    try:
+        removed = collect_garbage()
+        if removed:
+            print(f"✅ 参照されていないファイルを削除: {removed}件")
+    except Exception as e:
+        print(f"⚠️ ファイル削除エラー: {e}")
+
+
+def run_worker(stop: Optional[threading.Event] = None, poll_interval: float = JOB_POLL_INTERVAL):
+    """ジョブがあれば続けて処理し、なければ poll_interval 秒待つ。FILE_GC_INTERVAL ごとに不要なファイルも削除する"""
+    _load_handlers()
+    worker_id = f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+    print(f"✅ ジョブワーカー起動: {worker_id}")
+    stop = stop or threading.Event()
+    next_gc = time.monotonic()
+    while not stop.is_set():
+        if FILE_GC_INTERVAL > 0 and time.monotonic() >= next_gc:
+            next_gc = time.monotonic() + FILE_GC_INTERVAL
+            _collect_files()
+        try:
+            if work_once(worker_id):
+                continue
+        except Exception as e:
+            print(f"❌ ジョブワーカーエラー: {e}")
+        stop.wait(poll_interval)
+
+
+def start_worker_threads(count: int) -> threading.Event:
+    """
+    Webプロセス内でワーカースレッドを起動（開発用。本番は別プロセスで python -m app.utils.jobs）
+
+    Returns:
+        停止用イベント
+    """
+    stop = threading.Event()
+    for i in range(count):
+        threading.Thread(target=run_worker, args=(stop,), name=f'job-worker-{i}', daemon=True).start()
+    return stop
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ジョブワーカー')
+    parser.add_argument('--workers', type=int,
+                        default=int(os.environ.get('JOB_WORKERS', os.cpu_count() or 1)),
+                        help='ワーカープロセス数')
+    args = parser.parse_args(argv)
+    if args.workers <= 1:
+        run_worker()
+        return
+    procs = [multiprocessing.Process(target=run_worker, name=f'job-worker-{i}') for i in range(args.workers)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+
+
+if __name__ == '__main__':
+    main()
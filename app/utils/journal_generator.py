@@ -174,6 +174,53 @@ def estimate_account_subject(
     return '雑費', description
 
 
+def estimate_account_subjects(
+    items: List[Dict],
+    use_ai: bool = False,
+    ai_model: Optional[str] = None,
+    api_keys: Optional[Dict] = None,
+    tenant_id: Optional[int] = None,
+    conn=None
+) -> List[Tuple[str, str]]:
+    """
+    複数の証憑の勘定科目をまとめて推定
+    AIを使う場合は数十件ずつ1回の呼び出しで推定し（ai_helper.estimate_account_subjects_with_ai）、
+    推定できなかった件だけキーワードマッチングにフォールバックする
+    
+    Args:
+        items: 証憑のリスト（description, amount, company_name, ocr_text）
+        use_ai: AIを使用するか
+        ai_model: AIモデル名
+        api_keys: APIキーの辞書
+        tenant_id: テナントID
+        conn: DB接続
+    
+    Returns:
+        items と同じ順の (推定された勘定科目, 摘要) のリスト
+    """
+    ai_results = [None] * len(items)
+    if use_ai and ai_model and api_keys and items:
+        try:
+            from .ai_helper import estimate_account_subjects_with_ai
+            ai_results = estimate_account_subjects_with_ai(
+                items, ai_model, api_keys, tenant_id=tenant_id, conn=conn
+            )
+        except Exception as e:
+            print(f"AI勘定科目一括推定エラー: {e}")
+
+    results = []
+    for item, ai_result in zip(items, ai_results):
+        if ai_result:
+            results.append((ai_result['account_subject'], ai_result['description']))
+        else:
+            results.append(estimate_account_subject(
+                item.get('description') or '',
+                item.get('amount') or 0,
+                item.get('company_name'),
+            ))
+    return results
+
+
 def generate_journal_entry(
     voucher_data: Dict,
     company_data: Optional[Dict] = None,
@@ -199,8 +246,10 @@ def generate_journal_entry(
     description = voucher_data.get('摘要', '')
     company_name = company_data.get('会社名', '') if company_data else ''
     
-    # 勘定科目の推定
-    expense_subject = estimate_account_subject(description, amount, company_name)
+    # 勘定科目の推定（証憑処理時にAIが推定した候補があればそれを使う）
+    expense_subject = voucher_data.get('勘定科目候補')
+    if expense_subject not in ACCOUNT_SUBJECTS:
+        expense_subject, _ = estimate_account_subject(description, amount, company_name)
     
     # 仕訳の生成（借方：費用、貸方：現金/預金）
     journal_entry = {
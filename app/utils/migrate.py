@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+スキーママイグレーション
+- "T_スキーマバージョン" に適用済みバージョンを記録し、各マイグレーションを1度だけ適用
+- Python マイグレーション（init_schema 等）と migrations/*.sql を バージョン順に実行
+- PostgreSQL はアドバイザリロック、SQLite はファイルロックで同時実行を防止
+
+デプロイ時に1回:
+    python -m app.utils.migrate
+"""
+
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+try:
+    import fcntl
+except ImportError:  # Windows 開発環境
+    fcntl = None
+
+from .db import init_schema, init_voucher_schema, _is_pg, _sql, SQLITE_PATH
+from .jobs import init_job_schema
+from .ocr_cache import init_ocr_cache_schema
+from .ai_cache import init_ai_cache_schema
+from .upload_store import init_file_store_schema
+from .rate_limit import init_rate_limit_schema
+
+
+MIGRATIONS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'migrations'))
+
+# pg_advisory_lock のキー（アプリ固有の任意の定数）
+ADVISORY_LOCK_KEY = 0x766F7563
+
+# Python で記述するマイグレーション（バージョン -> 適用関数）
+PY_MIGRATIONS: Dict[str, Callable] = {
+    '0001_init_schema': init_schema,
+    '0003_voucher_journal_company_tables': init_voucher_schema,
+    '0004_job_queue': init_job_schema,
+    '0005_ocr_cache': init_ocr_cache_schema,
+    '0006_file_store': init_file_store_schema,
+    '0007_ai_cache': init_ai_cache_schema,
+    '0009_rate_limit': init_rate_limit_schema,
+}
+
+_ensured = set()
+_ensured_lock = threading.Lock()
+
+
+def _raw(conn):
+    """PooledConnection の場合は実接続を返す"""
+    return getattr(conn, 'raw', conn)
+
+
+def _sql_migrations(is_pg: bool) -> Dict[str, str]:
+    """
+    migrations/*.sql を収集
+    - <version>.sql        : 両DB共通
+    - <version>.pg.sql     : PostgreSQL のみ
+    - <version>.sqlite.sql : SQLite のみ
+    """
+    found = {}
+    if not os.path.isdir(MIGRATIONS_DIR):
+        return found
+    skip_suffix = '.sqlite.sql' if is_pg else '.pg.sql'
+    for name in os.listdir(MIGRATIONS_DIR):
+        if not name.endswith('.sql') or name.endswith(skip_suffix):
+            continue
+        version = name[:-len('.sql')]
+        for suffix in ('.pg', '.sqlite'):
+            if version.endswith(suffix):
+                version = version[:-len(suffix)]
+        found[version] = os.path.join(MIGRATIONS_DIR, name)
+    return found
+
+
+def _split_statements(text: str) -> List[str]:
+    """SQLファイルを文単位に分割（行コメントは除去）"""
+    body = '\n'.join(line for line in text.splitlines() if not line.strip().startswith('--'))
+    return [stmt.strip() for stmt in body.split(';') if stmt.strip()]
+
+
+def _apply_sql_file(conn, path: str):
+    with open(path, encoding='utf-8') as f:
+        statements = _split_statements(f.read())
+
+    cur = conn.cursor()
+    for stmt in statements:
+        if _is_pg(conn):
+            cur.execute(stmt)
+            continue
+        # SQLite は ADD COLUMN IF NOT EXISTS 非対応のため、既存列エラーを無視する
+        stmt = re.sub(r'ADD\s+COLUMN\s+IF\s+NOT\s+EXISTS', 'ADD COLUMN', stmt, flags=re.IGNORECASE)
+        try:
+            cur.execute(stmt)
+        except Exception as e:
+            if 'duplicate column name' not in str(e):
+                raise
+
+
+@contextmanager
+def _migration_lock(conn):
+    """複数ワーカーの同時マイグレーションを防ぐ排他ロック"""
+    if _is_pg(conn):
+        cur = conn.cursor()
+        cur.execute('SELECT pg_advisory_lock(%s)', (ADVISORY_LOCK_KEY,))
+        try:
+            yield
+        finally:
+            cur.execute('SELECT pg_advisory_unlock(%s)', (ADVISORY_LOCK_KEY,))
+        return
+
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(SQLITE_PATH), exist_ok=True)
+    with open(SQLITE_PATH + '.migrate.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _ensure_version_table(conn):
+    cur = conn.cursor()
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS "T_スキーマバージョン"(
+        version     TEXT PRIMARY KEY,
+        applied_at  TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    if not _is_pg(conn):
+        conn.commit()
+
+
+def _applied_versions(conn) -> set:
+    cur = conn.cursor()
+    cur.execute('SELECT version FROM "T_スキーマバージョン"')
+    return {row[0] for row in cur.fetchall()}
+
+
+def pending_migrations(conn) -> List[str]:
+    """未適用のバージョン一覧（バージョン順）"""
+    conn = _raw(conn)
+    _ensure_version_table(conn)
+    available = set(PY_MIGRATIONS) | set(_sql_migrations(_is_pg(conn)))
+    return sorted(available - _applied_versions(conn))
+
+
+def run_migrations(conn) -> List[str]:
+    """
+    未適用のマイグレーションを順に適用
+    PostgreSQL では1マイグレーション＝1トランザクションで、バージョン記録と同時にコミットする
+
+    Returns:
+        今回適用したバージョンのリスト
+    """
+    conn = _raw(conn)
+    is_pg = _is_pg(conn)
+    applied = []
+
+    with _migration_lock(conn):
+        sql_files = _sql_migrations(is_pg)
+        for version in pending_migrations(conn):
+            autocommit = conn.autocommit if is_pg else None
+            if is_pg:
+                conn.autocommit = False
+            try:
+                if version in PY_MIGRATIONS:
+                    PY_MIGRATIONS[version](conn)
+                else:
+                    _apply_sql_file(conn, sql_files[version])
+                cur = conn.cursor()
+                cur.execute(_sql(conn, 'INSERT INTO "T_スキーマバージョン"(version) VALUES (%s)'), (version,))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                if is_pg:
+                    conn.autocommit = autocommit
+            print(f"✅ マイグレーション適用: {version}")
+            applied.append(version)
+
+    return applied
+
+
+def ensure_schema(conn):
+    """
+    プロセス内で最初の接続時に1度だけマイグレーションを確認・適用
+    以降の接続では何もしない（DDLの往復なし）
+    """
+    backend = 'pg' if _is_pg(conn) else 'sqlite'
+    if backend in _ensured:
+        return
+    with _ensured_lock:
+        if backend in _ensured:
+            return
+        run_migrations(conn)
+        _ensured.add(backend)
+
+
+if __name__ == '__main__':
+    import sys
+    from .db import get_release_db
+
+    # DATABASE_URL が設定されていれば PostgreSQL のみ（SQLite に切り替えて成功扱いにしない）
+    try:
+        conn = get_release_db()
+    except Exception as e:
+        print(f"❌ マイグレーション用の DB に接続できません: {e}")
+        sys.exit(1)
+    try:
+        versions = run_migrations(conn)
+        print(f"✅ 適用済み: {', '.join(versions) if versions else '変更なし'}")
+    except Exception as e:
+        print(f"❌ マイグレーションに失敗しました: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
@@ -7,6 +7,9 @@ import requests
 from typing import Dict, Optional, List
 import re
 
+from .address_parser import parse_address, same_municipality
+from .rate_limit import acquire as acquire_rate_limit, PROVIDER_NTA
+
 
 class NTAInvoiceAPI:
     """国税庁インボイス登録番号検索APIクライアント"""
@@ -25,6 +28,11 @@ class NTAInvoiceAPI:
         """
         self.api_id = api_id
     
+    def _get(self, url: str, params: Dict) -> requests.Response:
+        """GETリクエスト（全ワーカーで共有する国税庁APIの呼び出し回数の制限を守る）"""
+        acquire_rate_limit(PROVIDER_NTA)
+        return requests.get(url, params=params, timeout=10)
+    
     def search_by_invoice_number(self, invoice_number: str) -> Optional[Dict]:
         """
         インボイス登録番号で検索
@@ -53,7 +61,7 @@ class NTAInvoiceAPI:
                 'type': '12',  # 法人番号指定
             }
             
-            response = requests.get(url, params=params, timeout=10)
+            response = self._get(url, params)
             
             if response.status_code == 200:
                 data = response.json()
@@ -93,7 +101,7 @@ class NTAInvoiceAPI:
                 'type': '12',
             }
             
-            response = requests.get(url, params=params, timeout=10)
+            response = self._get(url, params)
             
             if response.status_code == 200:
                 data = response.json()
@@ -129,7 +137,7 @@ class NTAInvoiceAPI:
             if prefecture:
                 params['address'] = prefecture
             
-            response = requests.get(url, params=params, timeout=10)
+            response = self._get(url, params)
             
             if response.status_code == 200:
                 data = response.json()
@@ -299,21 +307,7 @@ def extract_prefecture_from_address(address: str) -> Optional[str]:
     Returns:
         都道府県名
     """
-    prefectures = [
-        '北海道', '青森県', '岩手県', '宮城県', '秋田県', '山形県', '福島県',
-        '茨城県', '栃木県', '群馬県', '埼玉県', '千葉県', '東京都', '神奈川県',
-        '新潟県', '富山県', '石川県', '福井県', '山梨県', '長野県', '岐阜県',
-        '静岡県', '愛知県', '三重県', '滋賀県', '京都府', '大阪府', '兵庫県',
-        '奈良県', '和歌山県', '鳥取県', '島根県', '岡山県', '広島県', '山口県',
-        '徳島県', '香川県', '愛媛県', '高知県', '福岡県', '佐賀県', '長崎県',
-        '熊本県', '大分県', '宮崎県', '鹿児島県', '沖縄県'
-    ]
-    
-    for prefecture in prefectures:
-        if prefecture in address:
-            return prefecture
-    
-    return None
+    return parse_address(address).prefecture
 
 
 def filter_by_address(companies: List[Dict], target_address: str) -> List[Dict]:
@@ -332,18 +326,9 @@ def filter_by_address(companies: List[Dict], target_address: str) -> List[Dict]:
     for company in companies:
         company_address = company.get('住所', '')
         
-        # 簡易的な類似度チェック（市区町村レベル）
-        if company_address:
-            # 都道府県を除いた住所で比較
-            target_parts = target_address.split('県')[-1].split('都')[-1].split('府')[-1].split('道')[-1]
-            company_parts = company_address.split('県')[-1].split('都')[-1].split('府')[-1].split('道')[-1]
-            
-            # 市区町村が一致するかチェック
-            target_city = target_parts.split('市')[0] if '市' in target_parts else target_parts.split('区')[0] if '区' in target_parts else ''
-            company_city = company_parts.split('市')[0] if '市' in company_parts else company_parts.split('区')[0] if '区' in company_parts else ''
-            
-            if target_city and company_city and target_city in company_city:
-                filtered.append(company)
+        # 市区町村（政令指定都市は区まで）が一致するかチェック
+        if company_address and same_municipality(target_address, company_address):
+            filtered.append(company)
     
     return filtered if filtered else companies
 
@@ -380,21 +365,7 @@ def search_company_by_address(address: str, api_id: Optional[str] = None) -> Lis
         企業情報のリスト
     """
     # 都道府県を抽出
-    prefectures = [
-        '北海道', '青森県', '岩手県', '宮城県', '秋田県', '山形県', '福島県',
-        '茨城県', '栃木県', '群馬県', '埼玉県', '千葉県', '東京都', '神奈川県',
-        '新潟県', '富山県', '石川県', '福井県', '山梨県', '長野県', '岐阜県',
-        '静岡県', '愛知県', '三重県', '滋賀県', '京都府', '大阪府', '兵庫県',
-        '奈良県', '和歌山県', '鳥取県', '島根県', '岡山県', '広島県', '山口県',
-        '徳島県', '香川県', '愛媛県', '高知県', '福岡県', '佐賀県', '長崎県',
-        '熊本県', '大分県', '宮崎県', '鹿児島県', '沖縄県'
-    ]
-    
-    prefecture = None
-    for pref in prefectures:
-        if pref in address:
-            prefecture = pref
-            break
+    prefecture = extract_prefecture_from_address(address)
     
     # 住所から会社名を推測するのは困難なため、
     # 実際には別のアプローチが必要
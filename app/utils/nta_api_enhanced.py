@@ -6,7 +6,8 @@
 import requests
 from typing import Dict, Optional, List, Tuple
 import re
-from .nta_api import NTAInvoiceAPI, extract_prefecture_from_address
+from .nta_api import NTAInvoiceAPI, extract_prefecture_from_address, filter_by_address
+from .fanout import run_all
 
 
 def search_corporate_number_by_contact(
@@ -36,6 +37,9 @@ def search_corporate_number_by_contact(
             prefecture = extract_prefecture_from_address(address)
         
         results = api.search_by_name(company_name, prefecture)
+        if results and address:
+            # 同名の法人が複数ある場合は市区町村が一致する候補を優先
+            results = filter_by_address(results, address)
         
         if results and len(results) > 0:
             # 最初の候補の法人番号を返す
@@ -121,25 +125,29 @@ def enhanced_company_search(
         'warning_message': None,
     }
     
-    # 1. OCRでインボイス番号が読み取れた場合
     ocr_invoice = ocr_result.get('invoice_number')
-    if ocr_invoice:
-        api = NTAInvoiceAPI(api_id)
-        company_info = api.search_by_invoice_number(ocr_invoice)
-        
-        if company_info:
-            result['company_info'] = company_info
-            result['invoice_number'] = company_info.get('インボイス登録番号')
-            result['corporate_number'] = company_info.get('法人番号')
-    
-    # 2. 電話番号・住所・会社名から法人番号を検索
-    corporate_number = search_corporate_number_by_contact(
-        phone_number=ocr_result.get('phone_numbers', [None])[0] if ocr_result.get('phone_numbers') else None,
-        address=ocr_result.get('addresses', [None])[0] if ocr_result.get('addresses') else None,
+    phone_numbers = ocr_result.get('phone_numbers')
+    addresses = ocr_result.get('addresses')
+
+    # 1 と 2 は互いに依存しないため並行して検索する
+    lookups = [lambda: search_corporate_number_by_contact(
+        phone_number=phone_numbers[0] if phone_numbers else None,
+        address=addresses[0] if addresses else None,
         company_name=ocr_result.get('company_name'),
         api_id=api_id
-    )
+    )]
+    if ocr_invoice:
+        lookups.append(lambda: NTAInvoiceAPI(api_id).search_by_invoice_number(ocr_invoice))
+    corporate_number, *invoice_lookup = run_all(lookups)
+
+    # 1. OCRでインボイス番号が読み取れた場合
+    company_info = invoice_lookup[0] if invoice_lookup else None
+    if company_info:
+        result['company_info'] = company_info
+        result['invoice_number'] = company_info.get('インボイス登録番号')
+        result['corporate_number'] = company_info.get('法人番号')
     
+    # 2. 電話番号・住所・会社名から法人番号を検索（上で並行して実行済み）
     if corporate_number:
         result['corporate_number'] = corporate_number
         
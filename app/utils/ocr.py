@@ -4,11 +4,17 @@ OCR処理とデータ抽出ユーティリティ
 Google Cloud Vision API統合版
 """
 
-import re
-import os
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Tuple
 from PIL import Image
-import pytesseract
+
+from . import receipt_fields
+from .image_preprocess import preprocess_for_ocr
+from .tesseract_pool import recognize as tesseract_recognize, settings_tag, DOC_RECEIPT
+from .google_vision_helper import get_vision_client, batch_detect_text, is_google_vision_available
+from .ocr_cache import ocr_cache, file_sha256
+
+ENGINE_VISION = 'vision'
+ENGINE_TESSERACT = 'tesseract'
 
 
 def extract_text_from_image(image_path: str, use_google_vision: bool = True) -> str:
@@ -22,19 +28,99 @@ def extract_text_from_image(image_path: str, use_google_vision: bool = True) ->
     Returns:
         抽出されたテキスト
     """
+    return ocr_image(image_path, use_google_vision=use_google_vision)[0]
+
+
+def ocr_image(image_path: str, use_google_vision: bool = True) -> Tuple[str, str]:
+    """
+    画像からテキストを抽出し、使用したエンジンと合わせて返す
+    
+    Returns:
+        (抽出されたテキスト, エンジン名)
+    """
+    # 向き・傾き・余白・解像度を整えた画像でOCRする（送信量とCPU時間の削減）
+    image_path = preprocess_for_ocr(image_path)
+    
     # Google Cloud Vision APIを優先的に使用
     if use_google_vision:
         try:
-            return extract_text_with_google_vision(image_path)
+            return extract_text_with_google_vision(image_path), ENGINE_VISION
         except Exception as e:
             print(f"Google Vision APIエラー: {e}")
             print("Tesseract OCRにフォールバック")
     
     # フォールバック: Tesseract OCR
+    return extract_text_with_tesseract(image_path), ENGINE_TESSERACT
+
+
+def extract_texts_from_images(image_paths: List[str], use_google_vision: bool = True) -> List[str]:
+    """
+    複数画像からテキストを抽出（Vision API は batch_annotate_images でまとめて送信）
+    Vision API で失敗した画像だけ Tesseract OCR にフォールバックする
+    
+    Args:
+        image_paths: 画像ファイルのパスのリスト
+        use_google_vision: Google Cloud Vision APIを使用するか
+    
+    Returns:
+        画像ごとの抽出テキスト（image_paths と同じ順）
+    """
+    return [text for text, _ in ocr_images(image_paths, use_google_vision=use_google_vision)]
+
+
+def ocr_images(image_paths: List[str], use_google_vision: bool = True) -> List[Tuple[str, str]]:
+    """
+    複数画像からテキストを抽出し、画像ごとに使用したエンジンと合わせて返す
+    
+    Returns:
+        画像ごとの (抽出されたテキスト, エンジン名)
+    """
+    paths = [preprocess_for_ocr(path) for path in image_paths]
+    texts: List[Optional[str]] = [None] * len(paths)
+    
+    if use_google_vision and paths:
+        try:
+            for i, (text, error) in enumerate(batch_detect_text(paths)):
+                if error:
+                    print(f"Google Vision APIエラー: {error}")
+                texts[i] = text
+        except Exception as e:
+            print(f"Google Vision APIエラー: {e}")
+            print("Tesseract OCRにフォールバック")
+    
+    return [(text, ENGINE_VISION) if text is not None else (extract_text_with_tesseract(path), ENGINE_TESSERACT)
+            for text, path in zip(texts, paths)]
+
+
+def _preferred_engine(use_google_vision: bool) -> str:
+    """通常使われるエンジン（キャッシュはこのエンジンの結果だけを保存・参照する）"""
+    if use_google_vision and is_google_vision_available():
+        return ENGINE_VISION
+    return ENGINE_TESSERACT
+
+
+def _cache_engine(engine: str) -> str:
+    """OCRキャッシュのキーに使うエンジン名（Tesseract は PSM/OEM の設定を含める）"""
+    if engine == ENGINE_TESSERACT:
+        return f'{engine}-{settings_tag(DOC_RECEIPT)}'
+    return engine
+
+
+def extract_text_with_tesseract(image_path: str, doc_type: str = DOC_RECEIPT) -> str:
+    """
+    Tesseract OCRで画像からテキストを抽出
+    学習データを読み込み済みのエンジンをプロセス内で使い回す（tesserocr 未導入時は pytesseract）
+    
+    Args:
+        image_path: 画像ファイルのパス
+        doc_type: 書類の種類（PSM/OEM の設定に使う）
+    
+    Returns:
+        抽出されたテキスト（失敗時は空文字）
+    """
     try:
-        image = Image.open(image_path)
-        text = pytesseract.image_to_string(image, lang='jpn')
-        return text
+        with Image.open(image_path) as image:
+            return tesseract_recognize(image, doc_type)
     except Exception as e:
         print(f"Tesseract OCRエラー: {e}")
         return ""
@@ -53,13 +139,8 @@ def extract_text_with_google_vision(image_path: str) -> str:
     from google.cloud import vision
     import io
     
-    # 環境変数からAPIキーを取得
-    google_credentials = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
-    if not google_credentials:
-        raise Exception("GOOGLE_APPLICATION_CREDENTIALS環境変数が設定されていません")
-    
-    # Vision APIクライアントを初期化
-    client = vision.ImageAnnotatorClient()
+    # プロセス内で共有するクライアント（認証情報が未設定なら例外）
+    client = get_vision_client()
     
     # 画像ファイルを読み込み
     with io.open(image_path, 'rb') as image_file:
@@ -91,21 +172,7 @@ def extract_phone_numbers(text: str) -> List[str]:
     Returns:
         抽出された電話番号のリスト
     """
-    # 日本の電話番号パターン
-    patterns = [
-        r'\d{2,4}-\d{2,4}-\d{4}',  # 03-1234-5678
-        r'\d{3}-\d{3}-\d{4}',      # 090-1234-5678
-        r'\(\d{2,4}\)\s*\d{2,4}-\d{4}',  # (03) 1234-5678
-        r'\d{10,11}',              # 09012345678
-    ]
-    
-    phone_numbers = []
-    for pattern in patterns:
-        matches = re.findall(pattern, text)
-        phone_numbers.extend(matches)
-    
-    # 重複を削除
-    return list(set(phone_numbers))
+    return receipt_fields.phone_numbers(text)
 
 
 def extract_addresses(text: str) -> List[str]:
@@ -118,30 +185,7 @@ def extract_addresses(text: str) -> List[str]:
     Returns:
         抽出された住所のリスト
     """
-    # 日本の住所パターン（都道府県から始まる）
-    prefectures = [
-        '北海道', '青森県', '岩手県', '宮城県', '秋田県', '山形県', '福島県',
-        '茨城県', '栃木県', '群馬県', '埼玉県', '千葉県', '東京都', '神奈川県',
-        '新潟県', '富山県', '石川県', '福井県', '山梨県', '長野県', '岐阜県',
-        '静岡県', '愛知県', '三重県', '滋賀県', '京都府', '大阪府', '兵庫県',
-        '奈良県', '和歌山県', '鳥取県', '島根県', '岡山県', '広島県', '山口県',
-        '徳島県', '香川県', '愛媛県', '高知県', '福岡県', '佐賀県', '長崎県',
-        '熊本県', '大分県', '宮崎県', '鹿児島県', '沖縄県'
-    ]
-    
-    addresses = []
-    lines = text.split('\n')
-    
-    for line in lines:
-        for prefecture in prefectures:
-            if prefecture in line:
-                # 都道府県を含む行全体を住所として抽出
-                cleaned = line.strip()
-                if cleaned and len(cleaned) > 5:  # 最低限の長さチェック
-                    addresses.append(cleaned)
-                    break
-    
-    return addresses
+    return receipt_fields.addresses(text)
 
 
 def extract_invoice_number(text: str) -> Optional[str]:
@@ -154,23 +198,7 @@ def extract_invoice_number(text: str) -> Optional[str]:
     Returns:
         抽出されたインボイス登録番号（T + 13桁）
     """
-    # インボイス登録番号パターン（T + 13桁の数字）
-    patterns = [
-        r'T\s*\d{13}',  # T 1234567890123
-        r'T-\d{13}',    # T-1234567890123
-        r'T\d{13}',     # T1234567890123
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, text.replace(' ', '').replace('-', ''))
-        if match:
-            # ハイフンとスペースを削除して正規化
-            invoice_number = match.group(0).replace(' ', '').replace('-', '')
-            # T + 13桁の形式に正規化
-            if len(invoice_number) == 14 and invoice_number[0] == 'T':
-                return invoice_number
-    
-    return None
+    return receipt_fields.invoice_number(text)
 
 
 def extract_corporate_number(text: str) -> Optional[str]:
@@ -183,15 +211,7 @@ def extract_corporate_number(text: str) -> Optional[str]:
     Returns:
         抽出された法人番号（13桁）
     """
-    # 法人番号パターン（13桁の数字）
-    # インボイス番号（T付き）と区別するため、Tがないことを確認
-    pattern = r'(?<!T)\b\d{13}\b'
-    match = re.search(pattern, text)
-    
-    if match:
-        return match.group(0)
-    
-    return None
+    return receipt_fields.corporate_number(text)
 
 
 def extract_postal_code(text: str) -> Optional[str]:
@@ -204,13 +224,7 @@ def extract_postal_code(text: str) -> Optional[str]:
     Returns:
         抽出された郵便番号（最初の1件）
     """
-    # 郵便番号パターン（〒123-4567 または 123-4567）
-    pattern = r'〒?\s*(\d{3}-\d{4})'
-    match = re.search(pattern, text)
-    
-    if match:
-        return match.group(1)
-    return None
+    return receipt_fields.postal_code(text)
 
 
 def extract_company_name(text: str) -> Optional[str]:
@@ -223,33 +237,7 @@ def extract_company_name(text: str) -> Optional[str]:
     Returns:
         抽出された会社名
     """
-    # 会社名のパターン（株式会社、有限会社、合同会社など）
-    patterns = [
-        r'株式会社[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFFa-zA-Z0-9]+',
-        r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFFa-zA-Z0-9]+株式会社',
-        r'有限会社[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFFa-zA-Z0-9]+',
-        r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFFa-zA-Z0-9]+有限会社',
-        r'合同会社[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFFa-zA-Z0-9]+',
-        r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFFa-zA-Z0-9]+合同会社',
-        r'合資会社[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFFa-zA-Z0-9]+',
-        r'合名会社[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFFa-zA-Z0-9]+',
-        # 略称対応
-        r'㈱[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFFa-zA-Z0-9]+',
-        r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFFa-zA-Z0-9]+㈱',
-        r'\(株\)[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFFa-zA-Z0-9]+',
-        r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFFa-zA-Z0-9]+\(株\)',
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, text)
-        if match:
-            company_name = match.group(0)
-            # 略称を正式名称に変換
-            company_name = company_name.replace('㈱', '株式会社')
-            company_name = company_name.replace('(株)', '株式会社')
-            return company_name
-    
-    return None
+    return receipt_fields.company_name(text)
 
 
 def extract_amount(text: str) -> Optional[float]:
@@ -262,27 +250,7 @@ def extract_amount(text: str) -> Optional[float]:
     Returns:
         抽出された金額（最大値）
     """
-    # 金額パターン（¥1,234 または 1,234円 または 1234）
-    patterns = [
-        r'¥\s*([\d,]+)',
-        r'([\d,]+)\s*円',
-        r'合計\s*[：:]\s*([\d,]+)',
-        r'小計\s*[：:]\s*([\d,]+)',
-    ]
-    
-    amounts = []
-    for pattern in patterns:
-        matches = re.findall(pattern, text)
-        for match in matches:
-            # カンマを削除して数値に変換
-            try:
-                amount = float(match.replace(',', ''))
-                amounts.append(amount)
-            except ValueError:
-                continue
-    
-    # 最大値を返す（通常、合計金額が最大）
-    return max(amounts) if amounts else None
+    return receipt_fields.amount(text)
 
 
 def extract_date(text: str) -> Optional[str]:
@@ -295,77 +263,72 @@ def extract_date(text: str) -> Optional[str]:
     Returns:
         抽出された日付（YYYY-MM-DD形式）
     """
-    # 日付パターン
-    patterns = [
-        r'(\d{4})[年/\-](\d{1,2})[月/\-](\d{1,2})',  # 2024年1月1日, 2024/1/1, 2024-1-1
-        r'(\d{4})\.(\d{1,2})\.(\d{1,2})',  # 2024.1.1
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, text)
-        if match:
-            year, month, day = match.groups()
-            # YYYY-MM-DD形式に変換
-            return f"{year}-{int(month):02d}-{int(day):02d}"
-    
-    return None
+    return receipt_fields.date(text)
 
 
-def process_receipt_image(image_path: str, use_google_vision: bool = True) -> Dict[str, any]:
+def process_receipt_image(image_path: str, use_google_vision: bool = True,
+                          content_hash: Optional[str] = None, conn=None) -> Dict[str, any]:
     """
     レシート画像を処理して情報を抽出
+    同じ内容のファイルを処理済みなら OCR を行わずキャッシュを使う
     
     Args:
         image_path: 画像ファイルのパス
         use_google_vision: Google Cloud Vision APIを使用するか
+        content_hash: ファイル内容の SHA-256（省略時はここで計算）
+        conn: OCRキャッシュの参照に使うDB接続（省略時は get_db()。保存は別の接続で行う）
     
     Returns:
         抽出された情報の辞書
     """
-    # OCRでテキスト抽出
-    text = extract_text_from_image(image_path, use_google_vision=use_google_vision)
-    
-    # 各種情報を抽出
-    result = {
-        'full_text': text,
-        'raw_text': text,  # 後方互換性のため
-        'company_name': extract_company_name(text),
-        'phone_numbers': extract_phone_numbers(text),
-        'addresses': extract_addresses(text),
-        'postal_code': extract_postal_code(text),
-        'amount': extract_amount(text),
-        'date': extract_date(text),
-        'invoice_number': extract_invoice_number(text),  # インボイス番号
-        'corporate_number': extract_corporate_number(text),  # 法人番号
-    }
-    
-    return result
+    content_hash = content_hash or file_sha256(image_path)
+    engine = _preferred_engine(use_google_vision)
+    text = ocr_cache.get(content_hash, _cache_engine(engine), conn)
+    if text is None:
+        # OCRでテキスト抽出
+        text, used = ocr_image(image_path, use_google_vision=use_google_vision)
+        if text and used == engine:
+            ocr_cache.put(content_hash, _cache_engine(engine), text)
+    return parse_receipt_text(text)
 
 
-def save_uploaded_file(file, upload_folder: str = 'uploads') -> str:
+def process_receipt_images(image_paths: List[str], use_google_vision: bool = True,
+                           content_hashes: Optional[List[Optional[str]]] = None, conn=None) -> List[Dict[str, any]]:
     """
-    アップロードされたファイルを保存
+    複数のレシート画像をまとめて処理（キャッシュにないものだけ Vision API にまとめて送信）
     
     Args:
-        file: アップロードされたファイルオブジェクト
-        upload_folder: 保存先フォルダ
+        image_paths: 画像ファイルのパスのリスト
+        use_google_vision: Google Cloud Vision APIを使用するか
+        content_hashes: 画像ごとのファイル内容の SHA-256（None の画像はここで計算）
+        conn: OCRキャッシュの参照に使うDB接続（省略時は get_db()。保存は別の接続で行う）
     
     Returns:
-        保存されたファイルのパス
+        画像ごとの抽出結果（image_paths と同じ順）
     """
-    os.makedirs(upload_folder, exist_ok=True)
-    
-    # ファイル名を安全にする
-    filename = file.filename
-    filepath = os.path.join(upload_folder, filename)
+    engine = _preferred_engine(use_google_vision)
+    content_hashes = content_hashes or [None] * len(image_paths)
+    hashes = [h or file_sha256(path) for h, path in zip(content_hashes, image_paths)]
+    texts = [ocr_cache.get(h, _cache_engine(engine), conn) for h in hashes]
+    
+    missing = [i for i, text in enumerate(texts) if text is None]
+    if missing:
+        results = ocr_images([image_paths[i] for i in missing], use_google_vision=use_google_vision)
+        for i, (text, used) in zip(missing, results):
+            texts[i] = text
+            if text and used == engine:
+                ocr_cache.put(hashes[i], _cache_engine(engine), text)
+    return [parse_receipt_text(text) for text in texts]
+
+
+def parse_receipt_text(text: str) -> Dict[str, any]:
+    """
+    OCRテキストからレシートの各項目を抽出
     
-    # 同名ファイルがある場合は連番を付ける
-    base, ext = os.path.splitext(filename)
-    counter = 1
-    while os.path.exists(filepath):
-        filename = f"{base}_{counter}{ext}"
-        filepath = os.path.join(upload_folder, filename)
-        counter += 1
+    Args:
+        text: OCRで抽出したテキスト
     
-    file.save(filepath)
-    return filepath
+    Returns:
+        抽出された情報の辞書
+    """
+    return receipt_fields.extract_fields(text)
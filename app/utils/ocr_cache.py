@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+OCR結果のキャッシュ
+ファイル内容の SHA-256 と OCR エンジンのバージョンをキーに、OCR テキストを "T_OCRキャッシュ" に保存する。
+同じレシートを再アップロードしても Vision API / Tesseract を呼ばずに済む。
+プロセス内の LRU を前段に置き、直近のものは DB にも問い合わせない
+保存は呼び出し元（ジョブなど）のトランザクションを巻き込まないよう、get_independent_db() の
+別の接続でその場でコミットする（保存できなかったテキストもプロセス内の LRU には残る）
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from .db import get_db, get_independent_db, _is_pg, _sql
+from .image_preprocess import PREPROCESS_VERSION
+
+
+# OCR の方法（エンジンの設定・前処理など）を変えたら上げる（古いキャッシュを使わないため）
+OCR_ENGINE_REVISION = 1
+OCR_CACHE_MEMORY_ITEMS = int(os.environ.get("OCR_CACHE_MEMORY_ITEMS", "1024"))
+
+
+def engine_version(engine: str) -> str:
+    """キャッシュキーに使う OCR エンジンのバージョン"""
+    return f'{engine}:{OCR_ENGINE_REVISION}:pre{PREPROCESS_VERSION}'
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """ファイル内容の SHA-256（少しずつ読んでメモリを使わない）"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def init_ocr_cache_schema(conn):
+    """OCRキャッシュのテーブル作成"""
+    cur = conn.cursor()
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS "T_OCRキャッシュ"(
+        content_hash        TEXT NOT NULL,
+        エンジン            TEXT NOT NULL,
+        テキスト            TEXT NOT NULL,
+        created_at          TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (content_hash, エンジン)
+    )''')
+    if not _is_pg(conn):
+        conn.commit()
+
+
+class OcrCache:
+    """OCR テキストのキャッシュ（プロセス内 LRU + DB）"""
+
+    def __init__(self, max_items: int = OCR_CACHE_MEMORY_ITEMS):
+        self._max_items = max_items
+        self._items: 'OrderedDict[Tuple[str, str], str]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, key: Tuple[str, str], text: str):
+        with self._lock:
+            self._items[key] = text
+            self._items.move_to_end(key)
+            while len(self._items) > self._max_items:
+                self._items.popitem(last=False)
+
+    def get(self, content_hash: str, engine: str, conn=None) -> Optional[str]:
+        """キャッシュ済みの OCR テキスト（なければ None）"""
+        key = (content_hash, engine_version(engine))
+        with self._lock:
+            text = self._items.get(key)
+            if text is not None:
+                self._items.move_to_end(key)
+                return text
+
+        own = conn is None
+        if own:
+            conn = get_db()
+        try:
+            cur = conn.cursor()
+            cur.execute(_sql(conn, '''
+                SELECT テキスト FROM "T_OCRキャッシュ" WHERE content_hash = %s AND エンジン = %s
+            '''), key)
+            row = cur.fetchone()
+        except Exception as e:
+            print(f"OCRキャッシュ参照エラー: {e}")
+            return None
+        finally:
+            if own:
+                conn.close()
+        if row is None:
+            return None
+        self._remember(key, row[0])
+        return row[0]
+
+    def put(self, content_hash: str, engine: str, text: str):
+        """OCR テキストを保存（同じキーが既にあれば何もしない）"""
+        key = (content_hash, engine_version(engine))
+        self._remember(key, text)
+
+        try:
+            conn = get_independent_db()
+        except Exception as e:
+            print(f"OCRキャッシュ保存エラー: {e}")
+            return
+        try:
+            cur = conn.cursor()
+            cur.execute(_sql(conn, '''
+                INSERT INTO "T_OCRキャッシュ" (content_hash, エンジン, テキスト)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (content_hash, エンジン) DO NOTHING
+            '''), (*key, text))
+            if not _is_pg(conn):
+                conn.commit()
+        except Exception as e:
+            print(f"OCRキャッシュ保存エラー: {e}")
+        finally:
+            conn.close()
+
+
+ocr_cache = OcrCache()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+キーセット（カーソル）ページネーション
+OFFSET を使わず、並び順のキー（例: created_at, id）の値で続きを取得するため、
+履歴が増えてもページの取得時間が一定になる
+"""
+
+import base64
+import json
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import List, Optional, Sequence, Tuple
+
+from .db import _is_pg, _sql
+from .statements import Statement
+
+
+PAGE_SIZE_DEFAULT = 50
+PAGE_SIZE_MAX = 200
+
+
+@dataclass
+class Page:
+    """1ページ分の結果"""
+    rows: List = field(default_factory=list)
+    page_size: int = PAGE_SIZE_DEFAULT
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+    total: Optional[int] = None
+    total_is_estimate: bool = False
+
+
+def parse_page_size(value, default: int = PAGE_SIZE_DEFAULT) -> int:
+    """クエリ文字列のページサイズを 1〜PAGE_SIZE_MAX に丸める"""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, PAGE_SIZE_MAX))
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        # SQLite の CURRENT_TIMESTAMP と同じ 'YYYY-MM-DD HH:MM:SS' 形式で比較させる
+        return str(value)
+    return value
+
+
+def encode_cursor(key: Sequence, direction: str) -> str:
+    payload = json.dumps({'k': [_encode_value(v) for v in key], 'd': direction}, ensure_ascii=False, default=str)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[list, str]]:
+    """カーソル文字列を (キー値, 方向) に戻す。不正な値は None（先頭ページ扱い）"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        key, direction = payload['k'], payload['d']
+    except Exception:
+        return None
+    if direction not in ('next', 'prev') or not isinstance(key, list):
+        return None
+    return key, direction
+
+
+class KeysetQuery:
+    """
+    降順一覧のキーセットページネーション定義
+
+    Args:
+        name: ステートメント名（集計・プリペアド用）
+        select: WHERE 句まで含む SELECT 文（%s プレースホルダ）
+        keys: 並び順のキー列（例: ('v.created_at', 'v.id')）。最後は一意な列にする
+        key_positions: SELECT 結果の行におけるキー列の位置
+        count_from: 件数取得用の FROM 〜 WHERE 句（省略時は件数を出さない）
+    """
+
+    def __init__(self, name: str, select: str, keys: Sequence[str], key_positions: Sequence[int],
+                 count_from: Optional[str] = None):
+        self.keys = tuple(keys)
+        self.key_positions = tuple(key_positions)
+        self.count_from = count_from
+        key_list = ', '.join(self.keys)
+        placeholders = ', '.join(['%s'] * len(self.keys))
+        desc = ', '.join(f'{k} DESC' for k in self.keys)
+        asc = ', '.join(f'{k} ASC' for k in self.keys)
+        self._first = Statement(f'{name}_first', f'{select} ORDER BY {desc} LIMIT %s')
+        self._next = Statement(f'{name}_next', f'{select} AND ({key_list}) < ({placeholders}) ORDER BY {desc} LIMIT %s')
+        self._prev = Statement(f'{name}_prev', f'{select} AND ({key_list}) > ({placeholders}) ORDER BY {asc} LIMIT %s')
+
+    def statements(self) -> Tuple[Statement, Statement, Statement]:
+        """先頭ページ・次ページ・前ページの Statement（実行計画の確認用）"""
+        return self._first, self._next, self._prev
+
+    def _key_of(self, row) -> list:
+        return [row[i] for i in self.key_positions]
+
+    def fetch(self, conn, params: Sequence, cursor: Optional[str] = None,
+              page_size: int = PAGE_SIZE_DEFAULT, with_total: bool = False) -> Page:
+        """
+        1ページ分を取得（page_size + 1 件を読んで続きの有無を判定）
+
+        Args:
+            conn: DB接続
+            params: select の WHERE 句のパラメータ
+            cursor: 前回のページで返したカーソル（None なら先頭ページ）
+            page_size: 1ページの件数（PAGE_SIZE_MAX まで）
+            with_total: 総件数（PostgreSQL では推定値）も返すか
+        """
+        page_size = max(1, min(page_size, PAGE_SIZE_MAX))
+        decoded = decode_cursor(cursor)
+        if decoded and len(decoded[0]) != len(self.keys):
+            decoded = None
+
+        cur = conn.cursor()
+        if decoded is None:
+            cur.execute(*self._first.bind(conn, (*params, page_size + 1)))
+            direction = 'next'
+        else:
+            key, direction = decoded
+            stmt = self._next if direction == 'next' else self._prev
+            cur.execute(*stmt.bind(conn, (*params, *key, page_size + 1)))
+
+        rows = list(cur.fetchall())
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if direction == 'prev':
+            rows.reverse()
+
+        page = Page(rows=rows, page_size=page_size)
+        if rows:
+            first_key, last_key = self._key_of(rows[0]), self._key_of(rows[-1])
+            if direction == 'next':
+                page.next_cursor = encode_cursor(last_key, 'next') if has_more else None
+                page.prev_cursor = encode_cursor(first_key, 'prev') if decoded else None
+            else:
+                page.next_cursor = encode_cursor(last_key, 'next')
+                page.prev_cursor = encode_cursor(first_key, 'prev') if has_more else None
+
+        if with_total and self.count_from:
+            page.total, page.total_is_estimate = approximate_count(conn, self.count_from, params)
+        return page
+
+
+def approximate_count(conn, from_where: str, params: Sequence) -> Tuple[int, bool]:
+    """
+    件数を返す
+    - PostgreSQL: 実行計画の推定行数（COUNT(*) の全件走査を避ける）
+    - SQLite: インデックスで COUNT(*)
+
+    Returns:
+        (件数, 推定値かどうか)
+    """
+    cur = conn.cursor()
+    if _is_pg(conn):
+        cur.execute(f'EXPLAIN (FORMAT JSON) SELECT 1 {from_where}', tuple(params))
+        plan = cur.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows']), True
+    cur.execute(_sql(conn, f'SELECT COUNT(*) {from_where}'), tuple(params))
+    return cur.fetchone()[0], False
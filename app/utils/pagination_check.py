@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+仕訳一覧（JOURNAL_LIST）のキーセットページネーションのチェック
+日付が NULL の仕訳を含むテナントの行を追加し、次ページ・前ページを辿って全件が1回ずつ、
+COALESCE(日付, '') DESC, id DESC の順（NULL は最後）に返ることを確認する
+
+    python -m app.utils.pagination_check   # 問題があれば終了コード1
+
+DATABASE_URL が設定されていれば PostgreSQL、なければ SQLite で確認する（マイグレーション適用済みの DB）。
+追加した行は最後にロールバックする（開発・CI の DB で実行する）
+"""
+
+import sys
+from typing import List
+
+from .db import get_release_db, _is_pg, _sql
+
+
+# 確認用の行を追加するテナント（実在しない id）
+CHECK_TENANT_ID = -20240401
+PAGE_SIZE = 4
+
+# 日付が NULL の行を先頭・途中・末尾に混ぜ、同じ日付も複数置く
+CHECK_DATES = [None, '2024-03-01', None, '2024-01-15', '2024-01-15', None, '2024-02-29',
+               '2024-01-15', None, '2023-12-31', '2024-03-01', None, None, '2024-01-01']
+
+
+def _walk(conn, query, cursor=None, direction='next') -> List[List[int]]:
+    """カーソルを辿って各ページの id を返す"""
+    pages = []
+    while True:
+        page = query.fetch(conn, (CHECK_TENANT_ID,), cursor=cursor, page_size=PAGE_SIZE)
+        pages.append([row[0] for row in page.rows])
+        cursor = page.next_cursor if direction == 'next' else page.prev_cursor
+        if cursor is None:
+            return pages
+
+
+def check_journal_pagination(conn) -> List[str]:
+    """問題の一覧を返す（空なら問題なし）。追加した行はロールバックする"""
+    from ..blueprints.journal import JOURNAL_LIST
+
+    problems = []
+    if _is_pg(conn):
+        conn.autocommit = False
+    try:
+        cur = conn.cursor()
+        inserted = []
+        for day in CHECK_DATES:
+            cur.execute(_sql(conn, '''
+                INSERT INTO "T_仕訳" (tenant_id, 日付, 摘要) VALUES (%s, %s, 'pagination_check') RETURNING id
+            '''), (CHECK_TENANT_ID, day))
+            inserted.append((day or '', cur.fetchone()[0]))
+        expected = [journal_id for _, journal_id in sorted(inserted, reverse=True)]
+
+        pages = _walk(conn, JOURNAL_LIST)
+        got = [journal_id for page in pages for journal_id in page]
+        if got != expected:
+            problems.append(f"次ページを辿った順序が異なります: 期待={expected} 実際={got}")
+
+        # 最後のページから前ページを辿ると、同じページが逆順に返る
+        last = JOURNAL_LIST.fetch(conn, (CHECK_TENANT_ID,), page_size=PAGE_SIZE)
+        while last.next_cursor:
+            cursor = last.next_cursor
+            last = JOURNAL_LIST.fetch(conn, (CHECK_TENANT_ID,), cursor=cursor, page_size=PAGE_SIZE)
+        if last.prev_cursor:
+            backward = _walk(conn, JOURNAL_LIST, last.prev_cursor, 'prev')
+            if list(reversed(backward)) != pages[:-1]:
+                problems.append(f"前ページを辿ったページが異なります: 次ページ={pages[:-1]} 前ページ={backward[::-1]}")
+    finally:
+        conn.rollback()
+    return problems
+
+
+if __name__ == '__main__':
+    try:
+        check_conn = get_release_db()
+    except Exception as e:
+        print(f"❌ ページネーションのチェック用の DB に接続できません: {e}")
+        sys.exit(1)
+    try:
+        failures = check_journal_pagination(check_conn)
+    finally:
+        check_conn.close()
+    if failures:
+        for failure in failures:
+            print(f"❌ {failure}")
+        sys.exit(1)
+    print(f"✅ 仕訳一覧のページネーション（日付が NULL の {CHECK_DATES.count(None)}件を含む {len(CHECK_DATES)}件）")
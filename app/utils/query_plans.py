@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+頻出クエリの実行計画チェック
+EXPLAIN の結果に（インデックスを使わない）全件スキャンが含まれていれば失敗とする
+
+    python -m app.utils.query_plans   # 問題があれば終了コード1（Procfile の release で実行）
+"""
+
+import json
+import sys
+from typing import Dict, List, Sequence, Tuple
+
+from .db import get_db, get_release_db, _is_pg, _sql
+
+
+def hot_queries(conn) -> List[Tuple[str, str, Sequence]]:
+    """
+    確認対象の頻出クエリ（名前, SQL, EXPLAIN 用のダミーパラメータ）
+    SQL は実際に実行している Statement / KeysetQuery から取り出す（手で写した SQL は実装とずれるため）
+    Blueprint は Flask に依存するため、ここで読み込む
+    """
+    from ..blueprints.auth import ADMIN_LOGIN_LOOKUP, EMPLOYEE_LOGIN_LOOKUP
+    from ..blueprints.company import COMPANY_LIST, COMPANY_LOOKUP_BY_INVOICE
+    from ..blueprints.export import EXPORT_CONFIRMED_COUNT, _export_params, _export_statement
+    from ..blueprints.journal import JOURNAL_INSERT, JOURNAL_LIST, JOURNAL_PENDING_VOUCHERS
+    from ..blueprints.voucher import VOUCHER_LIST
+    from .jobs import LATEST_JOB_FOR_VOUCHER, _claim_candidates
+    from .voucher_pipeline import COMPANY_LOOKUP_BY_NUMBER
+
+    queries: List[Tuple[str, str, Sequence]] = []
+
+    def add(stmt, params: Sequence):
+        queries.append((stmt.name, stmt.text, tuple(params)))
+
+    # キーセットページネーション（先頭・次・前ページ）: WHERE 句のパラメータ + キー + LIMIT
+    for keyset, params, key in (
+        (VOUCHER_LIST, (1,), ('2024-01-01 00:00:00', 1)),
+        (JOURNAL_LIST, (1,), ('2024-01-01', 1)),
+        (COMPANY_LIST, (1,), ('2024-01-01 00:00:00', 1)),
+    ):
+        first, next_, prev = keyset.statements()
+        add(first, (*params, 51))
+        add(next_, (*params, *key, 51))
+        add(prev, (*params, *key, 51))
+
+    add(JOURNAL_PENDING_VOUCHERS, (1,))
+    add(JOURNAL_INSERT, (1, 1, 1, '2024-01-01', '旅費交通費', 1000, None, '現金', 1000, None, '確認用', 1, 0, 1))
+    add(EXPORT_CONFIRMED_COUNT, (1,))
+    for start_date, end_date, confirmed_only in (
+        ('2024-01-01', '2024-12-31', True),
+        ('2024-01-01', '2024-12-31', False),
+        (None, None, False),
+    ):
+        add(_export_statement(start_date, end_date, confirmed_only),
+            _export_params(1, start_date, end_date))
+    add(COMPANY_LOOKUP_BY_NUMBER, ('1234567890123', 'T1234567890123'))
+    add(COMPANY_LOOKUP_BY_INVOICE, ('T1234567890123',))
+    add(LATEST_JOB_FOR_VOUCHER, (1, 1))
+    add(ADMIN_LOGIN_LOOKUP, ('x', 'admin'))
+    add(EMPLOYEE_LOGIN_LOOKUP, ('x', 'x'))
+
+    claim_sql, claim_params = _claim_candidates(conn)
+    queries.append(('job_claim', claim_sql + ' LIMIT %s', (*claim_params, 1)))
+    return queries
+
+
+def _pg_seq_scans(plan: Dict) -> List[str]:
+    """PostgreSQL の JSON 実行計画から Seq Scan 対象のテーブル名を集める"""
+    found = []
+    if plan.get('Node Type') == 'Seq Scan':
+        found.append(plan.get('Relation Name'))
+    for child in plan.get('Plans', []):
+        found.extend(_pg_seq_scans(child))
+    return found
+
+
+def explain_full_scans(conn, sql: str, params: Sequence = ()) -> List[str]:
+    """
+    クエリの実行計画のうち、全件スキャンになっている箇所を返す（空なら問題なし）
+    PostgreSQL は enable_seqscan=off で評価するため、テーブルが小さくても
+    使えるインデックスがあるかどうかを判定できる
+    """
+    cur = conn.cursor()
+    if _is_pg(conn):
+        cur.execute('SET enable_seqscan = off')
+        try:
+            cur.execute('EXPLAIN (FORMAT JSON) ' + sql, tuple(params))
+            plan = cur.fetchone()[0]
+        finally:
+            cur.execute('RESET enable_seqscan')
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return [f'Seq Scan on {name}' for name in _pg_seq_scans(plan[0]['Plan'])]
+
+    cur.execute(_sql(conn, 'EXPLAIN QUERY PLAN ' + sql), tuple(params))
+    scans = []
+    for row in cur.fetchall():
+        detail = row[3]
+        if detail.startswith('SCAN ') and 'INDEX' not in detail:
+            scans.append(detail)
+    return scans
+
+
+def check_query_plans(conn=None) -> Dict[str, List[str]]:
+    """
+    hot_queries() の実行計画を確認
+
+    Returns:
+        {クエリ名: [全件スキャン箇所, ...]}（問題のあるクエリのみ）
+    """
+    own = conn is None
+    if own:
+        conn = get_db()
+    try:
+        failures = {}
+        for name, sql, params in hot_queries(conn):
+            scans = explain_full_scans(conn, sql, params)
+            if scans:
+                failures[name] = scans
+        return failures
+    finally:
+        if own:
+            conn.close()
+
+
+if __name__ == '__main__':
+    # DATABASE_URL が設定されていれば PostgreSQL のみで確認する（SQLite で確認して成功扱いにしない）
+    try:
+        release_conn = get_release_db()
+    except Exception as e:
+        print(f"❌ 実行計画チェック用の DB に接続できません: {e}")
+        sys.exit(1)
+    try:
+        failures = check_query_plans(release_conn)
+    finally:
+        release_conn.close()
+    if failures:
+        for name, scans in failures.items():
+            print(f"❌ {name}: {', '.join(scans)}")
+        sys.exit(1)
+    print("✅ 頻出クエリに全件スキャンなし")
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+外部APIの呼び出し回数の制限（トークンバケット）
+プロバイダー（Gemini / OpenAI / 国税庁API）ごとのバケットを "T_レート制限" に置き、
+gunicorn の全ワーカー・全ノードで共有する。並行して呼び出しても 429 を連発しないよう、
+呼び出しの前に acquire() でトークンを1つ取得する。
+- トークンの補充と取得は1つの UPSERT（1往復）で行うため、同時に取得しても上限を超えない
+- 足りないときも先にトークンを予約し（残りが負になる）、補充されるまで待ってから呼び出す。
+  再確認のために DB に問い合わせ直さない
+- 経過時間は DB の時刻で計算する（ノード間の時計のずれの影響を受けない）
+- 呼び出し元のトランザクションとは別の接続（get_independent_db）で、その場でコミットする
+- DB が使えない・接続プールが RATE_LIMIT_DB_TIMEOUT 秒で空かない場合は制限せずに呼び出し、
+  その回数を数える（/healthz/rate-limit の bypassed）
+  （SQLite では呼び出し元が書き込み中のトランザクションを持っているとロック待ちになるため、
+  外部APIはコミットしてから呼び出す）
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from .db import get_independent_db, _is_pg, _sql
+
+
+PROVIDER_GOOGLE = 'google'
+PROVIDER_OPENAI = 'openai'
+PROVIDER_NTA = 'nta'
+
+# トークンが足りないときに待つ最大秒数（超えたら RateLimitTimeout）
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.environ.get("RATE_LIMIT_MAX_WAIT_SECONDS", "30"))
+# バケットの確認で DB接続を待つ最大秒数（超えたら制限せずに呼び出す）
+RATE_LIMIT_DB_TIMEOUT = float(os.environ.get("RATE_LIMIT_DB_TIMEOUT", "1"))
+
+
+@dataclass(frozen=True)
+class Bucket:
+    """1秒あたりの補充数と、ためておける最大数（同時に呼び出せる数）"""
+    rate: float
+    burst: float
+
+
+def _bucket_from_env(name: str, rate: str, burst: str) -> Bucket:
+    # RATE_LIMIT_GOOGLE_PER_SEC=10 / RATE_LIMIT_GOOGLE_BURST=20 のように環境変数で変更できる
+    return Bucket(
+        rate=float(os.environ.get(f"RATE_LIMIT_{name.upper()}_PER_SEC", rate)),
+        burst=max(1.0, float(os.environ.get(f"RATE_LIMIT_{name.upper()}_BURST", burst))),
+    )
+
+
+BUCKETS: Dict[str, Bucket] = {
+    PROVIDER_GOOGLE: _bucket_from_env(PROVIDER_GOOGLE, "5", "10"),
+    PROVIDER_OPENAI: _bucket_from_env(PROVIDER_OPENAI, "5", "10"),
+    PROVIDER_NTA: _bucket_from_env(PROVIDER_NTA, "2", "4"),
+}
+
+# 制限を確認できずに呼び出した回数（このプロセスの起動後の累計）
+_bypassed: Dict[str, int] = {}
+_bypassed_lock = threading.Lock()
+
+
+class RateLimitTimeout(RuntimeError):
+    """待機時間内にトークンを取得できなかった"""
+
+
+def init_rate_limit_schema(conn):
+    """レート制限のバケットのテーブル作成"""
+    cur = conn.cursor()
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS "T_レート制限"(
+        名前                TEXT PRIMARY KEY,
+        トークン            DOUBLE PRECISION NOT NULL,
+        更新時刻            DOUBLE PRECISION NOT NULL
+    )''')
+    if not _is_pg(conn):
+        conn.commit()
+
+
+def _now_expr(conn) -> str:
+    """DB の現在時刻（UNIX 時間の秒）"""
+    if _is_pg(conn):
+        return 'EXTRACT(EPOCH FROM clock_timestamp())'
+    return "((julianday('now') - 2440587.5) * 86400.0)"
+
+
+def _reserve(conn, name: str, bucket: Bucket, max_wait: float) -> Optional[float]:
+    """
+    トークンを1つ予約（補充と取得を1つの UPSERT で行う）
+    Returns:
+        予約できた場合は呼び出せるまでの秒数（すぐ呼び出せるなら 0）。
+        max_wait 秒より長く待つことになる場合は予約せずに None
+    """
+    now = _now_expr(conn)
+    least = 'LEAST' if _is_pg(conn) else 'MIN'
+    refilled = f'{least}(%s, "T_レート制限".トークン + ({now} - "T_レート制限".更新時刻) * %s)'
+    cur = conn.cursor()
+    cur.execute(_sql(conn, f'''
+        INSERT INTO "T_レート制限" (名前, トークン, 更新時刻)
+        VALUES (%s, %s, {now})
+        ON CONFLICT (名前) DO UPDATE SET トークン = {refilled} - 1, 更新時刻 = {now}
+        WHERE {refilled} - 1 >= %s
+        RETURNING トークン
+    '''), (name, bucket.burst - 1, bucket.burst, bucket.rate, bucket.burst, bucket.rate,
+           -bucket.rate * max_wait))
+    row = cur.fetchone()
+    conn.commit()
+    if row is None:
+        return None
+    # 残りが負なら、その分が補充されるまで待つ
+    return max(0.0, -row[0] / bucket.rate)
+
+
+def _record_bypass(name: str, error: Exception):
+    with _bypassed_lock:
+        count = _bypassed[name] = _bypassed.get(name, 0) + 1
+    print(f"⚠️ レート制限を確認できないため制限せずに呼び出します（{name}、{count}回目）: {error}")
+
+
+def acquire(name: str, max_wait: float = RATE_LIMIT_MAX_WAIT_SECONDS):
+    """
+    プロバイダーのトークンを1つ取得（足りなければ補充されるまで待つ）
+    BUCKETS にない名前と、1秒あたりの補充数が 0 以下のものは制限しない
+
+    Raises:
+        RateLimitTimeout: max_wait 秒待っても取得できない場合（待たずに送出する）
+    """
+    bucket = BUCKETS.get(name)
+    if bucket is None or bucket.rate <= 0:
+        return
+    try:
+        conn = get_independent_db(timeout=RATE_LIMIT_DB_TIMEOUT)
+        try:
+            wait = _reserve(conn, name, bucket, max_wait)
+        finally:
+            conn.close()
+    except Exception as e:
+        _record_bypass(name, e)
+        return
+    if wait is None:
+        raise RateLimitTimeout(f"{name} のレート制限の待機時間（{max_wait}秒）を超えます")
+    if wait > 0:
+        time.sleep(wait)
+
+
+def snapshot() -> Dict:
+    """バケットの設定と、制限を確認できずに呼び出した回数（このプロセスの起動後の累計）"""
+    with _bypassed_lock:
+        bypassed = dict(_bypassed)
+    return {
+        'buckets': {name: {'per_sec': b.rate, 'burst': b.burst} for name, b in BUCKETS.items()},
+        'bypassed': bypassed,
+    }
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+OCRテキストからのレシート項目の抽出
+正規表現はインポート時に一度だけコンパイルし、extract_fields はテキストの行を1回だけ走査して
+すべての項目を集める（目印の文字（「円」「株式会社」など）がない行ではそのパターンを実行しない）。
+行をまたいで一致しうるのは \s* を含む電話番号 "(03)\n1234-5678" と金額（"¥\n1,000" など）だけで、
+行末が一致の途中で終わっている行に限り、その位置から元のテキスト上で一致させる
+（数字・ハイフン・会社名の文字は改行に一致しないため、法人番号などほかの項目は行の中で完結する）。
+1項目だけ必要な場合は phone_numbers などの個別の関数を使う。
+保存済みの OCR結果_生データ を大量に再抽出する場合もこちらを使う
+以前の実装と同じ結果になることは python -m app.utils.receipt_fields_check で確認する
+"""
+
+import re
+from typing import Dict, List, Optional
+
+from .address_parser import has_prefecture
+
+
+# 日本の電話番号パターン（パターンごとに findall した結果をまとめる）
+_PHONE_RES = tuple(re.compile(p) for p in (
+    r'\d{2,4}-\d{2,4}-\d{4}',  # 03-1234-5678
+    r'\d{3}-\d{3}-\d{4}',      # 090-1234-5678
+    r'\(\d{2,4}\)\s*\d{2,4}-\d{4}',  # (03) 1234-5678
+    r'\d{10,11}',              # 09012345678
+))
+
+# インボイス登録番号（空白とハイフンを除いたテキストで T + 13桁 を探す）
+_INVOICE_RE = re.compile(r'T\d{13}')
+# 法人番号（前後が単語の区切りの13桁。T付きのインボイス番号は T との間に区切りがないため一致しない）
+_CORPORATE_RE = re.compile(r'\b\d{13}\b')
+_POSTAL_RE = re.compile(r'〒?\s*(\d{3}-\d{4})')
+
+# 会社名のパターン（優先順）と、そのパターンが一致するために必要な文字列
+_NAME_CHARS = r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFFa-zA-Z0-9]+'
+_COMPANY_RES = tuple((marker, re.compile(pattern)) for marker, pattern in (
+    ('株式会社', '株式会社' + _NAME_CHARS),
+    ('株式会社', _NAME_CHARS + '株式会社'),
+    ('有限会社', '有限会社' + _NAME_CHARS),
+    ('有限会社', _NAME_CHARS + '有限会社'),
+    ('合同会社', '合同会社' + _NAME_CHARS),
+    ('合同会社', _NAME_CHARS + '合同会社'),
+    ('合資会社', '合資会社' + _NAME_CHARS),
+    ('合名会社', '合名会社' + _NAME_CHARS),
+    # 略称対応
+    ('㈱', '㈱' + _NAME_CHARS),
+    ('㈱', _NAME_CHARS + '㈱'),
+    ('(株)', r'\(株\)' + _NAME_CHARS),
+    ('(株)', _NAME_CHARS + r'\(株\)'),
+))
+
+# 金額パターン（¥1,234 または 1,234円 または 合計/小計）と必要な文字列
+_AMOUNT_RES = tuple((marker, re.compile(pattern)) for marker, pattern in (
+    ('¥', r'¥\s*([\d,]+)'),
+    ('円', r'([\d,]+)\s*円'),
+    ('合計', r'合計\s*[：:]\s*([\d,]+)'),
+    ('小計', r'小計\s*[：:]\s*([\d,]+)'),
+))
+
+_DATE_RES = (
+    re.compile(r'(\d{4})[年/\-](\d{1,2})[月/\-](\d{1,2})'),  # 2024年1月1日, 2024/1/1, 2024-1-1
+    re.compile(r'(\d{4})\.(\d{1,2})\.(\d{1,2})'),  # 2024.1.1
+)
+
+
+def phone_numbers(text: str) -> List[str]:
+    """電話番号（重複なし・見つかった順）"""
+    found = {}
+    for pattern in _PHONE_RES:
+        for match in pattern.findall(text):
+            found.setdefault(match, None)
+    return list(found)
+
+
+def addresses(text: str) -> List[str]:
+    """都道府県名を含む行（前後の空白を除いて6文字以上のもの）"""
+    result = []
+    for line in text.split('\n'):
+        if has_prefecture(line):
+            cleaned = line.strip()
+            if len(cleaned) > 5:
+                result.append(cleaned)
+    return result
+
+
+def invoice_number(text: str) -> Optional[str]:
+    """インボイス登録番号（T + 13桁）"""
+    match = _INVOICE_RE.search(text.replace(' ', '').replace('-', ''))
+    return match.group(0) if match else None
+
+
+def corporate_number(text: str) -> Optional[str]:
+    """法人番号（13桁）"""
+    match = _CORPORATE_RE.search(text)
+    return match.group(0) if match else None
+
+
+def postal_code(text: str) -> Optional[str]:
+    """郵便番号（最初の1件）"""
+    match = _POSTAL_RE.search(text)
+    return match.group(1) if match else None
+
+
+def company_name(text: str) -> Optional[str]:
+    """会社名（略称は正式名称に変換）"""
+    for marker, pattern in _COMPANY_RES:
+        if marker not in text:
+            continue
+        match = pattern.search(text)
+        if match:
+            return match.group(0).replace('㈱', '株式会社').replace('(株)', '株式会社')
+    return None
+
+
+def amount(text: str) -> Optional[float]:
+    """金額（最大値。通常は合計金額が最大）"""
+    best = None
+    for marker, pattern in _AMOUNT_RES:
+        if marker not in text:
+            continue
+        for match in pattern.findall(text):
+            try:
+                value = float(match.replace(',', ''))
+            except ValueError:
+                continue
+            if best is None or value > best:
+                best = value
+    return best
+
+
+def date(text: str) -> Optional[str]:
+    """日付（YYYY-MM-DD形式）"""
+    for pattern in _DATE_RES:
+        match = pattern.search(text)
+        if match:
+            year, month, day = match.groups()
+            return f"{year}-{int(month):02d}-{int(day):02d}"
+    return None
+
+
+# 行末で一致が途中になっている箇所（次の行に続く可能性がある）
+_PHONE_PAREN_RE = _PHONE_RES[2]
+_PHONE_PAREN_TAIL_RE = re.compile(r'\(\d{2,4}\)\s*\Z')
+_YEN_RE, _EN_RE, _TOTAL_RE, _SUBTOTAL_RE = (pattern for _, pattern in _AMOUNT_RES)
+_EN_TAIL_RE = re.compile(r'[\d,]+\s*\Z')
+_TOTAL_TAIL_RE = re.compile(r'合計\s*(?:[：:]\s*)?\Z')
+_SUBTOTAL_TAIL_RE = re.compile(r'小計\s*(?:[：:]\s*)?\Z')
+
+
+_DIGIT_RE = re.compile(r'\d')
+# 日付のパターンの区切り文字
+_DATE_MARKER_RE = re.compile(r'[年/\-.]')
+
+
+def _amount_tails(text: str, line: str, stripped: str, last: str, offset: int, amounts: List[str]) -> int:
+    """
+    行末で途中になっている金額を、元のテキスト上で次の行に続けて一致させる（amounts に追加）
+    Returns:
+        次の行の先頭の位置
+    """
+    tails = []
+    if last == '¥':
+        tails.append((_YEN_RE, len(stripped) - 1))
+    elif last and (last == ',' or last.isdecimal()):
+        tails.append((_EN_RE, _EN_TAIL_RE.search(line).start()))
+    for marker, tail_re, pattern in (('合計', _TOTAL_TAIL_RE, _TOTAL_RE), ('小計', _SUBTOTAL_TAIL_RE, _SUBTOTAL_RE)):
+        if marker in line:
+            tail = tail_re.search(line)
+            if tail:
+                tails.append((pattern, tail.start()))
+    for pattern, start in tails:
+        match = pattern.match(text, offset + start)
+        if match:
+            amounts.append(match.group(1))
+    return offset + len(line) + 1
+
+
+def _amount_value(match: str) -> Optional[float]:
+    try:
+        return float(match.replace(',', ''))
+    except ValueError:
+        return None
+
+
+def extract_fields(text: str) -> Dict[str, any]:
+    """
+    OCRテキストからレシートの各項目をまとめて抽出（行を1回だけ走査する）
+    結果は個別の関数（company_name など）をテキスト全体に使った場合と同じ
+    """
+    phones = {}
+    address_lines = []
+    postal = invoice = corporate = None
+    # 会社名はパターンの優先順位が高いものを、日付は1つ目のパターンを優先する
+    company_rank, company = len(_COMPANY_RES), None
+    dates = [None] * len(_DATE_RES)
+    amounts = []
+
+    offset = 0
+    for line in text.split('\n'):
+        stripped = line.rstrip()
+        last = stripped[-1:]
+
+        if has_prefecture(line):
+            cleaned = line.strip()
+            if len(cleaned) > 5:
+                address_lines.append(cleaned)
+
+        for rank, (marker, pattern) in enumerate(_COMPANY_RES[:company_rank]):
+            if marker in line:
+                match = pattern.search(line)
+                if match:
+                    company_rank, company = rank, match.group(0)
+                    break
+
+        if not _DIGIT_RE.search(line):
+            # 数字のない行に一致しうるのは、次の行の数字に続く "¥" "合計：" などの行末だけ
+            offset = _amount_tails(text, line, stripped, last, offset, amounts)
+            continue
+
+        hyphen = '-' in line
+        for pattern in (_PHONE_RES if hyphen else _PHONE_RES[3:]):
+            for match in pattern.findall(line):
+                phones.setdefault(match, None)
+        if last == ')':
+            tail = _PHONE_PAREN_TAIL_RE.search(line)
+            if tail:
+                match = _PHONE_PAREN_RE.match(text, offset + tail.start())
+                if match:
+                    phones.setdefault(match.group(0), None)
+
+        if postal is None and hyphen:
+            match = _POSTAL_RE.search(line)
+            if match:
+                postal = match.group(1)
+        if invoice is None and 'T' in line:
+            match = _INVOICE_RE.search(line.replace(' ', '').replace('-', ''))
+            if match:
+                invoice = match.group(0)
+        if corporate is None:
+            match = _CORPORATE_RE.search(line)
+            if match:
+                corporate = match.group(0)
+
+        for marker, pattern in _AMOUNT_RES:
+            if marker in line:
+                amounts.extend(pattern.findall(line))
+
+        if dates[0] is None and _DATE_MARKER_RE.search(line):
+            for index, pattern in enumerate(_DATE_RES):
+                if dates[index] is None:
+                    match = pattern.search(line)
+                    if match:
+                        dates[index] = match
+
+        offset = _amount_tails(text, line, stripped, last, offset, amounts)
+
+    best = None
+    for match in amounts:
+        value = _amount_value(match)
+        if value is not None and (best is None or value > best):
+            best = value
+    date_match = next((match for match in dates if match is not None), None)
+    if date_match:
+        year, month, day = date_match.groups()
+        date_value = f"{year}-{int(month):02d}-{int(day):02d}"
+    else:
+        date_value = None
+
+    return {
+        'full_text': text,
+        'raw_text': text,  # 後方互換性のため
+        'company_name': company.replace('㈱', '株式会社').replace('(株)', '株式会社') if company else None,
+        'phone_numbers': list(phones),
+        'addresses': address_lines,
+        'postal_code': postal,
+        'amount': best,
+        'date': date_value,
+        'invoice_number': invoice,  # インボイス番号
+        'corporate_number': corporate,  # 法人番号
+    }
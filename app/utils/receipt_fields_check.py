@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+レシート項目の抽出（receipt_fields.extract_fields）の同等性チェック
+receipt_fields 導入前の ocr.extract_* の実装をここに固定して残し、固定のコーパスで
+すべての項目が同じ結果になることを確認する（電話番号は以前の実装が set の順だったため集合で比較）
+
+    python -m app.utils.receipt_fields_check [--count 20000]   # 違いがあれば終了コード1
+
+コーパスは手書きの境界ケースと、シードを固定して生成したテキストからなる
+"""
+
+import argparse
+import random
+import re
+import sys
+from typing import Dict, List, Optional
+
+from .receipt_fields import extract_fields
+
+
+SEED = 20240401
+
+# ---- 以前の ocr.extract_* の実装（比較の基準。変更しないこと） ----
+
+_LEGACY_PREFECTURES = [
+    '北海道', '青森県', '岩手県', '宮城県', '秋田県', '山形県', '福島県',
+    '茨城県', '栃木県', '群馬県', '埼玉県', '千葉県', '東京都', '神奈川県',
+    '新潟県', '富山県', '石川県', '福井県', '山梨県', '長野県', '岐阜県',
+    '静岡県', '愛知県', '三重県', '滋賀県', '京都府', '大阪府', '兵庫県',
+    '奈良県', '和歌山県', '鳥取県', '島根県', '岡山県', '広島県', '山口県',
+    '徳島県', '香川県', '愛媛県', '高知県', '福岡県', '佐賀県', '長崎県',
+    '熊本県', '大分県', '宮崎県', '鹿児島県', '沖縄県'
+]
+_LEGACY_NAME = r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFFa-zA-Z0-9]+'
+
+
+def _legacy_phone_numbers(text: str) -> List[str]:
+    patterns = [
+        r'\d{2,4}-\d{2,4}-\d{4}',
+        r'\d{3}-\d{3}-\d{4}',
+        r'\(\d{2,4}\)\s*\d{2,4}-\d{4}',
+        r'\d{10,11}',
+    ]
+    phone_numbers = []
+    for pattern in patterns:
+        phone_numbers.extend(re.findall(pattern, text))
+    return list(set(phone_numbers))
+
+
+def _legacy_addresses(text: str) -> List[str]:
+    addresses = []
+    for line in text.split('\n'):
+        for prefecture in _LEGACY_PREFECTURES:
+            if prefecture in line:
+                cleaned = line.strip()
+                if cleaned and len(cleaned) > 5:
+                    addresses.append(cleaned)
+                    break
+    return addresses
+
+
+def _legacy_invoice_number(text: str) -> Optional[str]:
+    for pattern in (r'T\s*\d{13}', r'T-\d{13}', r'T\d{13}'):
+        match = re.search(pattern, text.replace(' ', '').replace('-', ''))
+        if match:
+            invoice_number = match.group(0).replace(' ', '').replace('-', '')
+            if len(invoice_number) == 14 and invoice_number[0] == 'T':
+                return invoice_number
+    return None
+
+
+def _legacy_corporate_number(text: str) -> Optional[str]:
+    match = re.search(r'(?<!T)\b\d{13}\b', text)
+    return match.group(0) if match else None
+
+
+def _legacy_postal_code(text: str) -> Optional[str]:
+    match = re.search(r'〒?\s*(\d{3}-\d{4})', text)
+    return match.group(1) if match else None
+
+
+def _legacy_company_name(text: str) -> Optional[str]:
+    patterns = [
+        r'株式会社' + _LEGACY_NAME, _LEGACY_NAME + r'株式会社',
+        r'有限会社' + _LEGACY_NAME, _LEGACY_NAME + r'有限会社',
+        r'合同会社' + _LEGACY_NAME, _LEGACY_NAME + r'合同会社',
+        r'合資会社' + _LEGACY_NAME, r'合名会社' + _LEGACY_NAME,
+        r'㈱' + _LEGACY_NAME, _LEGACY_NAME + r'㈱',
+        r'\(株\)' + _LEGACY_NAME, _LEGACY_NAME + r'\(株\)',
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, text)
+        if match:
+            return match.group(0).replace('㈱', '株式会社').replace('(株)', '株式会社')
+    return None
+
+
+def _legacy_amount(text: str) -> Optional[float]:
+    patterns = [
+        r'¥\s*([\d,]+)',
+        r'([\d,]+)\s*円',
+        r'合計\s*[：:]\s*([\d,]+)',
+        r'小計\s*[：:]\s*([\d,]+)',
+    ]
+    amounts = []
+    for pattern in patterns:
+        for match in re.findall(pattern, text):
+            try:
+                amounts.append(float(match.replace(',', '')))
+            except ValueError:
+                continue
+    return max(amounts) if amounts else None
+
+
+def _legacy_date(text: str) -> Optional[str]:
+    for pattern in (r'(\d{4})[年/\-](\d{1,2})[月/\-](\d{1,2})', r'(\d{4})\.(\d{1,2})\.(\d{1,2})'):
+        match = re.search(pattern, text)
+        if match:
+            year, month, day = match.groups()
+            return f"{year}-{int(month):02d}-{int(day):02d}"
+    return None
+
+
+def legacy_fields(text: str) -> Dict[str, any]:
+    """以前の ocr.parse_receipt_text と同じ結果"""
+    return {
+        'full_text': text,
+        'raw_text': text,
+        'company_name': _legacy_company_name(text),
+        'phone_numbers': _legacy_phone_numbers(text),
+        'addresses': _legacy_addresses(text),
+        'postal_code': _legacy_postal_code(text),
+        'amount': _legacy_amount(text),
+        'date': _legacy_date(text),
+        'invoice_number': _legacy_invoice_number(text),
+        'corporate_number': _legacy_corporate_number(text),
+    }
+
+
+# ---- コーパス ----
+
+# 境界ケース（略称・区切り文字・行をまたぐ番号・T の有無・短い住所行など）
+EDGE_CASES = [
+    '',
+    '\n\n',
+    '㈱サンプル商店\nTEL 03-1234-5678\n合計：1,100',
+    '(株)テスト\n小計:980\n¥ 1,078\n2024.4.1',
+    'サンプル合同会社\n東京都\n東京都千代田区丸の内1-1-1\n〒100-0005',
+    '登録番号 T-1234-5678-9012-3\n法人番号 1234567890123',
+    '登録番号 T 1234567890123\nT1234567890123',
+    'T12345678901234\n12345678901234\n0312345678\n09012345678',
+    '(03) 1234-5678\n(0120)12-3456\n03-1234-\n5678',
+    '2024年12月31日 23:59\n2024/1/2\n2024-1-3',
+    '合資会社ABC\n合名会社XYZ\nABC有限会社\n有限会社DEF',
+    '1,2,3円\n,円\n¥,\n合計：,',
+    '北海道札幌市中央区北1条西2丁目\n  京都府 \n大阪府大阪市北区梅田1-1',
+    '愛知県名古屋市中村区名駅1-1-4\n神奈川県横浜市西区みなとみらい2-2-1',
+    'ＴＥＬ０３ー１２３４ー５６７８\n￥１，０００\n令和6年4月1日',
+    # 行をまたぐ金額・電話番号（\s* が改行に一致する）
+    '¥\n1,000\n1,200 \n  円\n合計\n：\n3,000',
+    '小計：\n\n500\n¥ \nabc\n合計 合計\n:9,999',
+    '(03)\n1234-5678\n(045) \n\n 123-4567\n(06)\nabc',
+    '100円 2,000\n円\n¥\n¥\n300',
+]
+
+_STORES = ['サンプル', 'テスト商事', 'ABC', 'みどり', 'カフェ東京', 'Foo Bar', '山田']
+_ENTITIES = ['株式会社{}', '{}株式会社', '有限会社{}', '{}有限会社', '合同会社{}', '{}合同会社',
+             '合資会社{}', '合名会社{}', '㈱{}', '{}㈱', '(株){}', '{}(株)', '{}商店']
+_TOWNS = ['千代田区丸の内1-1-1', '札幌市中央区北1条西2丁目', '名古屋市中村区名駅1-1-4',
+          '大阪市北区梅田1-1', '那覇市泉崎1-2-2', '中央', '']
+_ITEMS = ['コーヒー', 'サンドイッチ', '文具', 'タクシー代', 'コピー用紙', '駐車料金']
+
+
+def _number(rnd: random.Random, digits: int) -> str:
+    return ''.join(rnd.choice('0123456789') for _ in range(digits))
+
+
+def _amount_text(rnd: random.Random) -> str:
+    value = rnd.randint(0, 2_000_000)
+    text = f'{value:,}' if rnd.random() < 0.7 else str(value)
+    return rnd.choice(['¥{}', '¥ {}', '{}円', '{} 円', '合計：{}', '合計:{}', '小計 : {}', '{}',
+                       '¥\n{}', '{}\n円', '合計\n：{}', '小計：\n{}']).format(text)
+
+
+def _generated_text(rnd: random.Random) -> str:
+    """ランダムなレシート風のテキスト（シード固定で毎回同じ）"""
+    lines = []
+    if rnd.random() < 0.8:
+        lines.append(rnd.choice(_ENTITIES).format(rnd.choice(_STORES)))
+    if rnd.random() < 0.7:
+        prefecture = rnd.choice(_LEGACY_PREFECTURES)
+        lines.append(rnd.choice(['', '  ', '〒' + _number(rnd, 3) + '-' + _number(rnd, 4) + ' '])
+                     + prefecture + rnd.choice(_TOWNS))
+    for _ in range(rnd.randint(0, 3)):
+        lines.append(rnd.choice([
+            'TEL ' + _number(rnd, rnd.randint(2, 4)) + '-' + _number(rnd, rnd.randint(2, 4)) + '-' + _number(rnd, 4),
+            '(' + _number(rnd, rnd.randint(2, 4)) + rnd.choice([') ', ')\n']) + _number(rnd, rnd.randint(2, 4)) + '-' + _number(rnd, 4),
+            _number(rnd, rnd.choice([9, 10, 11, 12])),
+        ]))
+    if rnd.random() < 0.6:
+        year, month, day = rnd.randint(2019, 2026), rnd.randint(1, 12), rnd.randint(1, 28)
+        lines.append(rnd.choice(['{}年{}月{}日', '{}/{}/{}', '{}-{}-{}', '{}.{}.{}', '{}/{:02d}/{:02d}'])
+                     .format(year, month, day))
+    for _ in range(rnd.randint(0, 6)):
+        lines.append(f'{rnd.choice(_ITEMS)} {_amount_text(rnd)}')
+    if rnd.random() < 0.5:
+        digits = _number(rnd, 13)
+        lines.append(rnd.choice(['登録番号 T{}', '登録番号 T-{}', 'T {}', '法人番号 {}', '{}'])
+                     .format(digits if rnd.random() < 0.8 else '-'.join([digits[:1], digits[1:5], digits[5:9], digits[9:]])))
+    rnd.shuffle(lines)
+    return '\n'.join(lines)
+
+
+def corpus(count: int, seed: int = SEED) -> List[str]:
+    """境界ケース + 生成したテキスト count 件"""
+    rnd = random.Random(seed)
+    return EDGE_CASES + [_generated_text(rnd) for _ in range(count)]
+
+
+def differences(text: str) -> Dict[str, tuple]:
+    """以前の実装と結果が異なる項目 {項目名: (以前, 現在)}"""
+    expected, actual = legacy_fields(text), extract_fields(text)
+    diff = {}
+    for key, value in expected.items():
+        got = actual.get(key)
+        if key == 'phone_numbers':
+            same = set(value) == set(got) and len(got) == len(set(got))
+        else:
+            same = value == got
+        if not same:
+            diff[key] = (value, got)
+    return diff
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='レシート項目の抽出の同等性チェック')
+    parser.add_argument('--count', type=int, default=20000, help='生成するテキストの件数')
+    args = parser.parse_args(argv)
+
+    texts = corpus(args.count)
+    failures = 0
+    for text in texts:
+        diff = differences(text)
+        if diff:
+            failures += 1
+            if failures <= 10:
+                print(f"❌ {text!r}")
+                for key, (expected, actual) in diff.items():
+                    print(f"    {key}: 以前={expected!r} 現在={actual!r}")
+    if failures:
+        print(f"❌ {failures}/{len(texts)}件で結果が異なります")
+        return 1
+    print(f"✅ {len(texts)}件すべて同じ結果")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
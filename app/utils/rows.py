@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+PostgreSQL / SQLite 共通の結果行
+- tuple のサブクラスなので row[0] の位置指定はそのまま使える
+- row['会社名'] / row.会社名 / row.get('会社名') で列名でも参照できる
+- 列名→位置の対応表は結果の列構成ごとに1つだけ作り、行ごとの dict は作らない
+"""
+
+import threading
+from functools import lru_cache
+from typing import Tuple
+
+try:
+    import psycopg2.extensions
+except Exception:
+    psycopg2 = None
+
+
+class Row(tuple):
+    """列名でも位置でも参照できる軽量な行"""
+
+    __slots__ = ()
+    _fields: Tuple[str, ...] = ()
+    _index: dict = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return tuple.__getitem__(self, self._index[key])
+        return tuple.__getitem__(self, key)
+
+    def __getattr__(self, name):
+        try:
+            return tuple.__getitem__(self, self._index[name])
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def get(self, key, default=None):
+        i = self._index.get(key)
+        return default if i is None else tuple.__getitem__(self, i)
+
+    def keys(self):
+        # dict(row) で {列名: 値} に変換できるようにする
+        return list(self._index)
+
+    def _asdict(self) -> dict:
+        return {name: tuple.__getitem__(self, i) for name, i in self._index.items()}
+
+    def __repr__(self):
+        body = ', '.join(f'{name}={tuple.__getitem__(self, i)!r}' for name, i in self._index.items())
+        return f'Row({body})'
+
+
+@lru_cache(maxsize=512)
+def row_class(fields: Tuple[str, ...]) -> type:
+    """列名の並びに対応する Row サブクラス（同名列は sqlite3.Row と同じく先頭を優先）"""
+    index = {}
+    for i, name in enumerate(fields):
+        index.setdefault(name, i)
+    return type('Row', (Row,), {'__slots__': (), '_fields': fields, '_index': index})
+
+
+def _fields_of(description) -> Tuple[str, ...]:
+    return tuple(col[0] for col in description)
+
+
+# ---- SQLite ----
+_sqlite_local = threading.local()
+
+
+def sqlite_row_factory(cursor, values):
+    """sqlite3 の row_factory。同じ結果セットの間は Row クラスを使い回す"""
+    description = cursor.description
+    if getattr(_sqlite_local, 'description', None) is not description:
+        _sqlite_local.description = description
+        _sqlite_local.cls = row_class(_fields_of(description))
+    return _sqlite_local.cls(values)
+
+
+# ---- PostgreSQL ----
+if psycopg2:
+    class RowCursor(psycopg2.extensions.cursor):
+        """fetch 系の結果を Row で返す psycopg2 カーソル"""
+
+        def _row_cls(self):
+            description = self.description
+            if getattr(self, '_description', None) is not description:
+                self._description = description
+                self._cls = row_class(_fields_of(description))
+            return self._cls
+
+        def fetchone(self):
+            row = super().fetchone()
+            return None if row is None else self._row_cls()(row)
+
+        def fetchmany(self, size=None):
+            rows = super().fetchmany(self.arraysize if size is None else size)
+            if not rows:
+                return rows
+            cls = self._row_cls()
+            return [cls(r) for r in rows]
+
+        def fetchall(self):
+            rows = super().fetchall()
+            if not rows:
+                return rows
+            cls = self._row_cls()
+            return [cls(r) for r in rows]
+
+        def __iter__(self):
+            while True:
+                row = self.fetchone()
+                if row is None:
+                    return
+                yield row
+else:
+    RowCursor = None
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+リクエスト単位のSQL計測
+- get_db() が返す接続のカーソルをラップし、SQL・所要時間・行数を記録
+- 同じ形のSQLが1リクエストで繰り返し実行されたら N+1 として警告
+- 遅いSQLは構造化ログ（app.sql）に出力
+- エンドポイントごとの累計をヘルスチェックで参照できるよう集計
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from .statements import _summarize
+
+
+DB_SLOW_QUERY_MS = float(os.environ.get("DB_SLOW_QUERY_MS", "200"))
+DB_N_PLUS_ONE_THRESHOLD = int(os.environ.get("DB_N_PLUS_ONE_THRESHOLD", "5"))
+
+logger = logging.getLogger("app.sql")
+
+
+class QueryRecord:
+    """1回分のSQL実行記録"""
+
+    __slots__ = ("sql", "duration_ms", "rows")
+
+    def __init__(self, sql: str, duration_ms: float, rows: int):
+        self.sql = sql
+        self.duration_ms = duration_ms
+        self.rows = rows
+
+
+class RequestQueryLog:
+    """1リクエスト内で実行されたSQLの記録"""
+
+    def __init__(self, endpoint: Optional[str] = None):
+        self.endpoint = endpoint or "<unknown>"
+        self.queries: List[QueryRecord] = []
+        self.shapes = Counter()
+
+    def record(self, sql: str, duration_ms: float, rowcount: int) -> QueryRecord:
+        rec = QueryRecord(sql, duration_ms, max(rowcount, 0))
+        self.queries.append(rec)
+        self.shapes[sql] += 1
+        if duration_ms >= DB_SLOW_QUERY_MS:
+            logger.warning("slow query", extra={"fields": {
+                "event": "slow_query",
+                "endpoint": self.endpoint,
+                "duration_ms": round(duration_ms, 2),
+                "rowcount": rowcount if rowcount >= 0 else None,
+                "sql": _summarize(sql, 500),
+            }})
+        return rec
+
+    @property
+    def total_ms(self) -> float:
+        return sum(q.duration_ms for q in self.queries)
+
+    def repeated_shapes(self, threshold: int = DB_N_PLUS_ONE_THRESHOLD) -> Dict[str, int]:
+        """閾値回数以上繰り返された同一形状のSQL（N+1 の疑い）"""
+        return {sql: n for sql, n in self.shapes.items() if n >= threshold}
+
+
+class InstrumentedCursor:
+    """DB-API カーソルのラッパー。execute の所要時間と行数を RequestQueryLog に記録する"""
+
+    __slots__ = ("_cur", "_log", "_last")
+
+    def __init__(self, cur, log: RequestQueryLog):
+        self._cur = cur
+        self._log = log
+        self._last: Optional[QueryRecord] = None
+
+    def _run(self, method, sql, params):
+        start = time.perf_counter()
+        try:
+            if params is None:
+                return method(sql)
+            return method(sql, params)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            self._last = self._log.record(sql, duration_ms, getattr(self._cur, "rowcount", -1))
+
+    def execute(self, sql, params=None):
+        return self._run(self._cur.execute, sql, params)
+
+    def executemany(self, sql, params):
+        return self._run(self._cur.executemany, sql, params)
+
+    def _count(self, n: int):
+        # SELECT は execute 時点の rowcount が -1（SQLite）のため、取得した行数で補う
+        if self._last is not None and n:
+            if getattr(self._cur, "rowcount", -1) < 0:
+                self._last.rows += n
+
+    def fetchone(self):
+        row = self._cur.fetchone()
+        if row is not None:
+            self._count(1)
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cur.fetchmany(*args)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cur.fetchall()
+        self._count(len(rows))
+        return rows
+
+    def __iter__(self):
+        for row in self._cur:
+            self._count(1)
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+
+class EndpointTotals:
+    """エンドポイントごとのSQL実行の累計（プロセス内）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: Dict[str, Dict] = {}
+
+    def add(self, log: RequestQueryLog, n_plus_one: int):
+        with self._lock:
+            t = self._totals.setdefault(log.endpoint, {
+                "requests": 0,
+                "queries": 0,
+                "total_ms": 0.0,
+                "max_queries": 0,
+                "n_plus_one_requests": 0,
+            })
+            t["requests"] += 1
+            t["queries"] += len(log.queries)
+            t["total_ms"] += log.total_ms
+            t["max_queries"] = max(t["max_queries"], len(log.queries))
+            if n_plus_one:
+                t["n_plus_one_requests"] += 1
+
+    def snapshot(self) -> List[Dict]:
+        """SQL所要時間の合計が大きい順"""
+        with self._lock:
+            rows = [
+                {
+                    "endpoint": endpoint,
+                    **t,
+                    "total_ms": round(t["total_ms"], 2),
+                    "avg_queries": round(t["queries"] / t["requests"], 2),
+                }
+                for endpoint, t in self._totals.items()
+            ]
+        rows.sort(key=lambda r: r["total_ms"], reverse=True)
+        return rows
+
+
+endpoint_totals = EndpointTotals()
+
+
+def finish_request(log: RequestQueryLog):
+    """リクエスト終了時に N+1 を判定し、エンドポイント別の累計に加算"""
+    repeated = log.repeated_shapes()
+    for sql, count in repeated.items():
+        logger.warning("possible N+1 query", extra={"fields": {
+            "event": "n_plus_one",
+            "endpoint": log.endpoint,
+            "count": count,
+            "sql": _summarize(sql, 500),
+        }})
+    endpoint_totals.add(log, len(repeated))
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite 設定のベンチマーク
+既定設定（ロールバックジャーナル・busy_timeout なし・操作ごとに接続）と
+configure_sqlite() の設定（WAL など・接続を使い回す）で、
+1/4/8 ワーカープロセスの書き込み／読み取りスループットを比較する
+
+    python -m app.utils.sqlite_bench [--ops 500] [--workers 1,4,8]
+
+一時ディレクトリのファイルで計測し、アプリの DB には触れない
+"""
+
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+
+from .db import configure_sqlite
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS bench(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tenant_id INTEGER NOT NULL,
+    摘要 TEXT,
+    金額 REAL
+)
+'''
+
+
+def _connect(path: str, tuned: bool):
+    if tuned:
+        return configure_sqlite(sqlite3.connect(path, timeout=30))
+    # sqlite3.connect の既定 timeout（5秒）も使わない＝従来の「即ロックエラー」に近い挙動
+    return sqlite3.connect(path, timeout=0)
+
+
+def _worker(path: str, tuned: bool, mode: str, ops: int, seed: int, result):
+    errors = 0
+    conn = _connect(path, tuned) if tuned else None
+    start = time.perf_counter()
+    for i in range(ops):
+        c = conn if tuned else _connect(path, False)
+        try:
+            if mode == 'write':
+                c.execute('INSERT INTO bench(tenant_id, 摘要, 金額) VALUES (?, ?, ?)',
+                          (seed, f'item {i}', i * 1.5))
+                c.commit()
+            else:
+                c.execute('SELECT id, 摘要, 金額 FROM bench WHERE id = ?',
+                          ((seed * 7919 + i) % 1000 + 1,)).fetchone()
+        except sqlite3.OperationalError:
+            errors += 1
+            try:
+                c.rollback()
+            except Exception:
+                pass
+        finally:
+            if not tuned:
+                c.close()
+    result.put((time.perf_counter() - start, errors))
+    if conn is not None:
+        conn.close()
+
+
+def run(path: str, tuned: bool, mode: str, workers: int, ops: int) -> dict:
+    """workers プロセスで ops 回ずつ操作し、合計スループットとエラー数を返す"""
+    result = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=_worker, args=(path, tuned, mode, ops, n, result))
+             for n in range(workers)]
+    start = time.perf_counter()
+    for p in procs:
+        p.start()
+    outcomes = [result.get() for _ in procs]
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - start
+    errors = sum(e for _, e in outcomes)
+    done = workers * ops - errors
+    return {'ops_per_sec': done / elapsed if elapsed else 0.0, 'errors': errors}
+
+
+def _prepare(path: str, tuned: bool):
+    conn = _connect(path, tuned)
+    conn.execute(SCHEMA)
+    conn.executemany('INSERT INTO bench(tenant_id, 摘要, 金額) VALUES (?, ?, ?)',
+                     [(0, f'seed {i}', float(i)) for i in range(1000)])
+    conn.commit()
+    conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='SQLite 設定のベンチマーク')
+    parser.add_argument('--ops', type=int, default=500, help='1ワーカーあたりの操作回数')
+    parser.add_argument('--workers', default='1,4,8', help='ワーカー数（カンマ区切り）')
+    args = parser.parse_args(argv)
+    worker_counts = [int(w) for w in args.workers.split(',')]
+
+    print(f"{'設定':<8}{'操作':<8}{'ワーカー':>8}{'ops/秒':>12}{'エラー':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for tuned in (False, True):
+            label = 'tuned' if tuned else 'default'
+            for mode in ('write', 'read'):
+                for workers in worker_counts:
+                    path = os.path.join(tmp, f'{label}-{mode}-{workers}.db')
+                    _prepare(path, tuned)
+                    r = run(path, tuned, mode, workers, args.ops)
+                    print(f"{label:<8}{mode:<8}{workers:>8}{r['ops_per_sec']:>12.0f}{r['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+SQL ステートメントレジストリ
+- SQL テキストをDB方言ごとに1度だけ変換してキャッシュ（%s → ?）
+- ステートメントごとの実行回数を集計
+- 頻出クエリは Statement として登録し、PostgreSQL ではサーバー側の
+  プリペアドステートメント（PREPARE / EXECUTE）を任意で使用できる
+"""
+
+import os
+import re
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+# PgBouncer（transaction プーリング）経由ではプリペアドステートメントが使えないため既定は無効
+DB_PREPARED_STATEMENTS = os.environ.get("DB_PREPARED_STATEMENTS", "0") in ("1", "true", "True")
+# 変換結果・実行回数を保持する SQL の最大数（IN (...) の長さ違いなど SQL テキストが増え続けても上限を超えない）
+STATEMENT_REGISTRY_MAX_ENTRIES = int(os.environ.get("STATEMENT_REGISTRY_MAX_ENTRIES", "1024"))
+
+
+class StatementRegistry:
+    """方言別の変換結果と実行回数を保持するスレッドセーフなキャッシュ（上限を超えたら使われていないものから削除）"""
+
+    def __init__(self, max_entries: int = STATEMENT_REGISTRY_MAX_ENTRIES):
+        self._lock = threading.Lock()
+        self._max_entries = max_entries
+        self._compiled: 'OrderedDict[Tuple[str, bool], str]' = OrderedDict()
+        self._hits: 'OrderedDict[str, int]' = OrderedDict()
+        self._labels: Dict[str, str] = {}
+
+    def translate(self, text: str, is_pg: bool, label: Optional[str] = None) -> str:
+        """
+        SQL を方言に合わせて変換（2回目以降はキャッシュを返す）
+
+        Args:
+            text: %s プレースホルダで書かれた SQL
+            is_pg: PostgreSQL なら True
+            label: 集計用の名前（省略時は SQL の先頭部分）
+        """
+        key = (text, is_pg)
+        with self._lock:
+            compiled = self._compiled.get(key)
+            if compiled is None:
+                compiled = text if is_pg else text.replace("%s", "?")
+                self._compiled[key] = compiled
+                if len(self._compiled) > self._max_entries:
+                    self._compiled.popitem(last=False)
+            else:
+                self._compiled.move_to_end(key)
+            if text not in self._labels:
+                self._labels[text] = label or _summarize(text)
+            self._hits[text] = self._hits.get(text, 0) + 1
+            self._hits.move_to_end(text)
+            while len(self._hits) > self._max_entries:
+                evicted, _ = self._hits.popitem(last=False)
+                self._labels.pop(evicted, None)
+        return compiled
+
+    def stats(self, limit: Optional[int] = None) -> List[Dict]:
+        """実行回数の多い順にステートメントを返す"""
+        with self._lock:
+            rows = [
+                {"statement": self._labels.get(text, _summarize(text)), "hits": hits}
+                for text, hits in self._hits.items()
+            ]
+        rows.sort(key=lambda r: r["hits"], reverse=True)
+        return rows[:limit] if limit else rows
+
+    def reset(self):
+        with self._lock:
+            self._hits.clear()
+            self._labels.clear()
+
+
+registry = StatementRegistry()
+
+
+def _summarize(text: str, width: int = 120) -> str:
+    """集計表示用に SQL を1行に詰める"""
+    one_line = " ".join(text.split())
+    return one_line if len(one_line) <= width else one_line[:width - 1] + "…"
+
+
+def _to_pg_params(text: str) -> Tuple[str, int]:
+    """%s を $1, $2 ... に置き換える（PREPARE 用）"""
+    counter = [0]
+
+    def repl(_):
+        counter[0] += 1
+        return f"${counter[0]}"
+
+    return re.sub(r"%s", repl, text), counter[0]
+
+
+# 実接続ごとに PREPARE 済みのステートメント名を保持（接続が破棄されれば自動で消える）
+_prepared_by_conn = weakref.WeakKeyDictionary()
+
+
+class Statement:
+    """
+    名前付きの頻出ステートメント
+
+    使い方:
+        VOUCHER_LIST = Statement('voucher_list', 'SELECT ... WHERE tenant_id = %s')
+        cur.execute(*VOUCHER_LIST.bind(conn, (tenant_id,)))
+    """
+
+    def __init__(self, name: str, text: str, prepare: bool = True):
+        self.name = name
+        self.text = text
+        self.prepare = prepare
+        self._pg_text, self._nparams = _to_pg_params(text)
+
+    def sql(self, conn) -> str:
+        """方言変換済みの SQL"""
+        from .db import _is_pg      # db.py がこのモジュールを読み込むため遅延 import
+        return registry.translate(self.text, _is_pg(conn), self.name)
+
+    def bind(self, conn, params: Sequence = ()) -> Tuple[str, Sequence]:
+        """
+        cursor.execute() に渡す (SQL, パラメータ) を返す
+        PostgreSQL でプリペアドステートメントが有効なら、初回のみ PREPARE してから EXECUTE を返す
+        """
+        from .db import _is_pg
+        sql = self.sql(conn)
+        if not (self.prepare and DB_PREPARED_STATEMENTS and _is_pg(conn)):
+            return sql, params
+
+        raw = getattr(conn, "raw", conn)
+        try:
+            prepared = _prepared_by_conn.setdefault(raw, set())
+        except TypeError:
+            return sql, params
+
+        if self.name not in prepared:
+            cur = raw.cursor()
+            cur.execute(f'PREPARE "{self.name}" AS {self._pg_text}')
+            cur.close()
+            prepared.add(self.name)
+
+        if self._nparams == 0:
+            return f'EXECUTE "{self.name}"', params
+        placeholders = ", ".join(["%s"] * self._nparams)
+        return f'EXECUTE "{self.name}" ({placeholders})', params
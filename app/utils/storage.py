@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+証憑画像の保存先（ストレージバックエンド）
+- local: Webノードのディスク（従来どおり。キーはカレントディレクトリからの相対パス）
+- s3:    S3 互換のオブジェクトストレージ（AWS S3 / MinIO など）。
+         どのノードでアップロードした画像も表示・再OCRでき、Webノードにデータを持たない
+
+キーは内容のハッシュから決まる（uploads/ab/cd/<ハッシュ>.jpg）ため、保存後に内容が変わらない。
+S3 の場合、OCR など手元のファイルが必要な処理は local_path() でノードのキャッシュにダウンロードして使う
+保存は同じ内容でも必ず書き直し、更新日時を新しくする。参照数 0 のファイルの削除（delete_if_older）は
+更新日時が新しいファイルを消さないため、削除の確認中に同じ内容が再アップロードされても残る
+（S3 は確認したバージョンだけを消すため、バケットのバージョニングを有効にしておく。
+再アップロードで古いバージョンが溜まるので、ライフサイクルルールで古いバージョンを期限切れにする）
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import uuid
+from typing import BinaryIO, Iterator, Tuple
+
+try:
+    import boto3
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError
+except Exception:
+    boto3 = None
+    BotoConfig = None
+    ClientError = Exception
+
+from .image_preprocess import derived_path
+
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "local")
+UPLOAD_FOLDER = os.environ.get("UPLOAD_FOLDER", "uploads")
+
+# S3 互換ストレージ（MinIO などは S3_ENDPOINT_URL を指定。認証情報は AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY）
+S3_BUCKET = os.environ.get("S3_BUCKET", "")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL", "")
+S3_REGION = os.environ.get("S3_REGION", "ap-northeast-1")
+# マルチパートアップロードの1パートの大きさ（S3 の下限は 5MB）
+S3_PART_SIZE = max(5 * 1024 * 1024, int(os.environ.get("S3_PART_SIZE", str(8 * 1024 * 1024))))
+# S3 から取得したファイルを OCR などのために置くノード内のキャッシュ
+STORAGE_CACHE_DIR = os.environ.get("STORAGE_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "voucher-storage")
+
+CHUNK_SIZE = 1024 * 1024
+TMP_DIR = '.tmp'
+
+
+def content_path(content_hash: str, ext: str, upload_folder: str = UPLOAD_FOLDER) -> str:
+    """ハッシュから保存先のキー（パス）を決める"""
+    return os.path.join(upload_folder, content_hash[:2], content_hash[2:4], f'{content_hash}{ext}')
+
+
+def _hashed_chunks(stream: BinaryIO, digest, chunk_size: int) -> Iterator[bytes]:
+    """ストリームを chunk_size ずつ（最後以外は必ず chunk_size）読み、読んだ分をハッシュに加える"""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        while len(chunk) < chunk_size:
+            more = stream.read(chunk_size - len(chunk))
+            if not more:
+                break
+            chunk += more
+        digest.update(chunk)
+        yield chunk
+
+
+class LocalStorage:
+    """Webノードのディスクに保存"""
+
+    name = 'local'
+
+    def __init__(self, upload_folder: str = UPLOAD_FOLDER):
+        self.upload_folder = upload_folder
+
+    def save(self, stream: BinaryIO, ext: str) -> Tuple[str, str, int]:
+        """
+        一時ファイルに書きながらハッシュを計算し、ハッシュで決まるパスに rename する
+
+        Returns:
+            (キー, 内容の SHA-256, バイト数)
+        """
+        tmp_dir = os.path.join(self.upload_folder, TMP_DIR)
+        os.makedirs(tmp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in _hashed_chunks(stream, digest, CHUNK_SIZE):
+                    out.write(chunk)
+                    size += len(chunk)
+            content_hash = digest.hexdigest()
+            key = content_path(content_hash, ext, self.upload_folder)
+            os.makedirs(os.path.dirname(key), exist_ok=True)
+            # 同じ内容のファイルが保存済みでも置き換える。内容は同じだが更新日時が新しくなるため、
+            # 参照数 0 のファイルとして削除待ちになっていても delete_if_older で消されない
+            os.replace(tmp_path, key)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return key, content_hash, size
+
+    def open(self, key: str) -> BinaryIO:
+        return open(key, 'rb')
+
+    def read_range(self, key: str, start: int, end: int) -> bytes:
+        """start〜end バイト目（end を含む）"""
+        with open(key, 'rb') as f:
+            f.seek(start)
+            return f.read(end - start + 1)
+
+    def size(self, key: str) -> int:
+        return os.path.getsize(key)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(key)
+
+    def delete(self, key: str):
+        """ファイルと OCR 用の前処理済み画像を削除"""
+        for target in (key, derived_path(key)):
+            if os.path.exists(target):
+                os.remove(target)
+
+    def delete_if_older(self, key: str, min_age: float) -> bool:
+        """
+        最終更新から min_age 秒以上経っていればファイルと前処理済み画像を削除（削除した・なかった場合 True）
+        確認と削除の間に同じ内容が保存されても消さないよう、いったん退避してから更新日時を確認する
+        """
+        moved = f'{key}.{os.getpid()}.{threading.get_ident()}.gc'
+        try:
+            os.rename(key, moved)
+        except FileNotFoundError:
+            self.delete(key)
+            return True
+        if time.time() - os.path.getmtime(moved) < min_age:
+            # 直前に保存されたファイル（内容は同じなので、その後の保存があっても戻してよい）
+            os.replace(moved, key)
+            return False
+        os.remove(moved)
+        derived = derived_path(key)
+        if os.path.exists(derived):
+            os.remove(derived)
+        return True
+
+    def local_path(self, key: str) -> str:
+        return key
+
+
+class S3Storage:
+    """S3 互換のオブジェクトストレージに保存"""
+
+    name = 's3'
+
+    def __init__(self, bucket: str = S3_BUCKET, endpoint_url: str = S3_ENDPOINT_URL,
+                 region: str = S3_REGION, upload_folder: str = UPLOAD_FOLDER,
+                 cache_dir: str = STORAGE_CACHE_DIR, part_size: int = S3_PART_SIZE):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 には boto3 が必要です")
+        if not bucket:
+            raise RuntimeError("S3_BUCKET環境変数が設定されていません")
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url or None
+        self.region = region
+        self.upload_folder = upload_folder
+        self.cache_dir = cache_dir
+        self.part_size = part_size
+        self._client = None
+        self._client_pid = None
+        self._lock = threading.Lock()
+        self._warned_unversioned = False
+
+    @property
+    def client(self):
+        """プロセス内で共有するクライアント（fork 後は作り直す）"""
+        if self._client is None or self._client_pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._client_pid != os.getpid():
+                    # MinIO などはバケット名をパスに含める形式で接続する
+                    config = BotoConfig(s3={'addressing_style': 'path'} if self.endpoint_url else {})
+                    self._client = boto3.client('s3', endpoint_url=self.endpoint_url,
+                                                region_name=self.region, config=config)
+                    self._client_pid = os.getpid()
+        return self._client
+
+    def save(self, stream: BinaryIO, ext: str) -> Tuple[str, str, int]:
+        """
+        マルチパートアップロードで一時キーに書きながらハッシュを計算し、
+        ハッシュで決まるキーにサーバー側でコピーする（1パートに収まる場合は直接 PUT）
+
+        Returns:
+            (キー, 内容の SHA-256, バイト数)
+        """
+        digest = hashlib.sha256()
+        chunks = _hashed_chunks(stream, digest, self.part_size)
+        first = next(chunks, b'')
+        second = next(chunks, None)
+
+        if second is None:
+            content_hash = digest.hexdigest()
+            key = content_path(content_hash, ext, self.upload_folder)
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=first)
+            return key, content_hash, len(first)
+
+        tmp_key = f'{self.upload_folder}/{TMP_DIR}/{uuid.uuid4().hex}'
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=tmp_key)['UploadId']
+        parts = []
+        size = 0
+        try:
+            for number, chunk in enumerate(self._chain(first, second, chunks), start=1):
+                part = self.client.upload_part(Bucket=self.bucket, Key=tmp_key, UploadId=upload_id,
+                                               PartNumber=number, Body=chunk)
+                parts.append({'PartNumber': number, 'ETag': part['ETag']})
+                size += len(chunk)
+            completed = self.client.complete_multipart_upload(Bucket=self.bucket, Key=tmp_key, UploadId=upload_id,
+                                                              MultipartUpload={'Parts': parts})
+        except Exception:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=tmp_key, UploadId=upload_id)
+            raise
+
+        content_hash = digest.hexdigest()
+        key = content_path(content_hash, ext, self.upload_folder)
+        try:
+            # 保存済みでもコピーし直して更新日時を新しくする（削除待ちのオブジェクトを delete_if_older で消さないため）
+            self.client.copy({'Bucket': self.bucket, 'Key': tmp_key}, self.bucket, key)
+        finally:
+            # バージョニングが有効なバケットでは削除マーカーを残さないよう、バージョンを指定して消す
+            version = {'VersionId': completed['VersionId']} if completed.get('VersionId') else {}
+            self.client.delete_object(Bucket=self.bucket, Key=tmp_key, **version)
+        return key, content_hash, size
+
+    @staticmethod
+    def _chain(first: bytes, second: bytes, rest: Iterator[bytes]) -> Iterator[bytes]:
+        yield first
+        yield second
+        yield from rest
+
+    def open(self, key: str) -> BinaryIO:
+        return self.client.get_object(Bucket=self.bucket, Key=key)['Body']
+
+    def read_range(self, key: str, start: int, end: int) -> bytes:
+        """start〜end バイト目（end を含む）"""
+        body = self.client.get_object(Bucket=self.bucket, Key=key, Range=f'bytes={start}-{end}')['Body']
+        return body.read()
+
+    def size(self, key: str) -> int:
+        return self.client.head_object(Bucket=self.bucket, Key=key)['ContentLength']
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def delete(self, key: str):
+        """オブジェクトと、このノードのキャッシュ（前処理済み画像も）を削除"""
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+        self._delete_cache(key)
+
+    def _delete_cache(self, key: str):
+        """このノードのキャッシュ（前処理済み画像も）を削除"""
+        cached = self._cache_path(key)
+        for target in (cached, derived_path(cached)):
+            if os.path.exists(target):
+                os.remove(target)
+
+    def delete_if_older(self, key: str, min_age: float) -> bool:
+        """
+        最終更新から min_age 秒以上経っていればオブジェクトを削除（削除した・なかった場合 True）
+        確認したバージョンだけを VersionId を指定して削除する。確認と削除の間に同じ内容が保存されても、
+        新しいバージョンとして残る（バージョニングが有効でないバケットでは削除しない）
+        """
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                self._delete_cache(key)
+                return True
+            raise
+        if time.time() - head['LastModified'].timestamp() < min_age:
+            return False
+        version_id = head.get('VersionId')
+        if not version_id or version_id == 'null':
+            # 条件付きで消せないため、直前の再アップロードを消してしまわないよう残す
+            if not self._warned_unversioned:
+                self._warned_unversioned = True
+                print(f"⚠️ バケット {self.bucket} のバージョニングが有効でないため、参照されていないオブジェクトを削除しません")
+            return False
+        self.client.delete_object(Bucket=self.bucket, Key=key, VersionId=version_id)
+        self._delete_cache(key)
+        return True
+
+    def _cache_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def local_path(self, key: str) -> str:
+        """ノードのキャッシュにダウンロードしたパス（キーの内容は変わらないので、あればそのまま使う）"""
+        path = self._cache_path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            try:
+                self.client.download_file(self.bucket, key, tmp_path)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return path
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """設定（STORAGE_BACKEND）に応じたストレージ"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = S3Storage() if STORAGE_BACKEND == 's3' else LocalStorage()
+    return _storage
+
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Tesseract のベンチマーク
+pytesseract（画像ごとに tesseract プロセスを起動）と、プロセス内で使い回すエンジン（tesserocr）で
+1枚あたりの処理時間を比較する
+
+    python -m app.utils.tesseract_bench [--count 20] [--doc-type receipt] [画像ファイル ...]
+
+画像を指定しなければ、合成したレシート画像で計測する
+"""
+
+import argparse
+import statistics
+import time
+from typing import Callable, List
+
+from PIL import Image, ImageDraw
+
+from . import tesseract_pool
+from .tesseract_pool import DOC_RECEIPT, TesseractPool, settings_for
+
+
+def _synthetic_receipt() -> Image.Image:
+    """計測用のレシート風の画像（既定フォントで描画）"""
+    lines = ['SAMPLE STORE', 'TEL 03-1234-5678', '2024/04/01 12:34',
+             'COFFEE          480', 'SANDWICH        620', 'TOTAL         1,100',
+             'T1234567890123']
+    image = Image.new('L', (600, 40 * len(lines) + 40), 255)
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(lines):
+        draw.text((30, 20 + 40 * i), line, fill=0)
+    return image
+
+
+def _measure(label: str, images: List[Image.Image], fn: Callable[[Image.Image], str]):
+    """1枚目（初期化を含む）と2枚目以降の時間を表示"""
+    timings = []
+    for image in images:
+        start = time.perf_counter()
+        fn(image)
+        timings.append((time.perf_counter() - start) * 1000)
+    rest = timings[1:] or timings
+    print(f"{label:<12}{timings[0]:>12.1f}{statistics.mean(rest):>12.1f}"
+          f"{statistics.median(rest):>12.1f}{sum(timings):>12.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Tesseract のベンチマーク')
+    parser.add_argument('images', nargs='*', help='計測に使う画像（省略時は合成画像）')
+    parser.add_argument('--count', type=int, default=20, help='処理する枚数')
+    parser.add_argument('--doc-type', default=DOC_RECEIPT, help='書類の種類（PSM/OEM の設定）')
+    args = parser.parse_args(argv)
+
+    sources = [Image.open(path) for path in args.images] or [_synthetic_receipt()]
+    images = [sources[i % len(sources)] for i in range(args.count)]
+    psm, oem = settings_for(args.doc_type)
+    print(f"{args.count} 枚 / PSM {psm} / OEM {oem}（単位: ミリ秒）")
+    print(f"{'方式':<12}{'1枚目':>12}{'平均':>12}{'中央値':>12}{'合計':>12}")
+
+    if tesseract_pool.pytesseract is not None:
+        _measure('subprocess', images, lambda image: tesseract_pool.recognize_with_subprocess(image, args.doc_type))
+    else:
+        print("⚠️ pytesseract が未導入のため subprocess は計測しません")
+
+    if tesseract_pool.is_pool_available():
+        pool = TesseractPool(size=1)
+        _measure('pool', images, lambda image: pool.recognize(image, psm, oem))
+    else:
+        print("⚠️ tesserocr が未導入のため pool は計測しません")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Tesseract エンジンのプール
+pytesseract は画像ごとに一時ファイルを書き、tesseract プロセスを起動して jpn の学習データを
+読み直すため、1枚あたりの時間の大半が起動処理になる。
+tesserocr（libtesseract の Python バインディング）が使える場合は、学習データを読み込んだ
+エンジンをプロセス内に保持して使い回す。使えない場合は従来どおり pytesseract で処理する
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+from PIL import Image
+
+try:
+    import tesserocr
+except Exception:
+    tesserocr = None
+
+try:
+    import pytesseract
+except Exception:
+    pytesseract = None
+
+
+TESSERACT_LANG = os.environ.get("TESSERACT_LANG", "jpn")
+# 学習データのフォルダ（空なら Tesseract の既定の場所）
+TESSERACT_DATA_PATH = os.environ.get("TESSERACT_DATA_PATH", "")
+# 1プロセスで同時に使うエンジン数（エンジン1つにつき学習データ分のメモリを使う）
+TESSERACT_POOL_SIZE = int(os.environ.get("TESSERACT_POOL_SIZE", "1"))
+
+DOC_RECEIPT = 'receipt'
+DOC_INVOICE = 'invoice'
+
+# 書類の種類ごとのページ分割モード（PSM）とエンジンモード（OEM）
+# 既定値は pytesseract の既定（PSM 3: 自動 / OEM 3: 利用可能なもの）と同じ。
+# TESSERACT_PSM_RECEIPT=4 のように環境変数で変更できる
+DOC_TYPE_SETTINGS: Dict[str, Tuple[int, int]] = {
+    doc_type: (
+        int(os.environ.get(f"TESSERACT_PSM_{doc_type.upper()}", "3")),
+        int(os.environ.get(f"TESSERACT_OEM_{doc_type.upper()}", "3")),
+    )
+    for doc_type in (DOC_RECEIPT, DOC_INVOICE)
+}
+
+
+def settings_for(doc_type: str) -> Tuple[int, int]:
+    """書類の種類の (PSM, OEM)"""
+    return DOC_TYPE_SETTINGS.get(doc_type, DOC_TYPE_SETTINGS[DOC_RECEIPT])
+
+
+def settings_tag(doc_type: str = DOC_RECEIPT) -> str:
+    """OCRキャッシュのキーに含める設定（設定を変えたら別の結果として扱う）"""
+    psm, oem = settings_for(doc_type)
+    return f'psm{psm}oem{oem}'
+
+
+class TesseractPool:
+    """
+    学習データを読み込み済みの tesserocr エンジンのプール
+    エンジンはスレッドセーフではないため、使用中のエンジンは他のスレッドに渡さない。
+    OEM はエンジンの初期化時に決まるので OEM ごとに分けて保持し、PSM は認識のたびに設定する
+    """
+
+    def __init__(self, size: int = TESSERACT_POOL_SIZE):
+        self._size = max(1, size)
+        self._cond = threading.Condition()
+        self._idle: Dict[int, List] = {}
+        self._created = 0
+        self._pid = os.getpid()
+
+    def _reset_after_fork(self):
+        # fork 前のエンジンは親プロセスのものなので使わない（End() も呼ばない）
+        if self._pid != os.getpid():
+            self._idle = {}
+            self._created = 0
+            self._pid = os.getpid()
+
+    def _create(self, oem: int):
+        kwargs = {'lang': TESSERACT_LANG, 'oem': tesserocr.OEM(oem)}
+        if TESSERACT_DATA_PATH:
+            kwargs['path'] = TESSERACT_DATA_PATH
+        return tesserocr.PyTessBaseAPI(**kwargs)
+
+    @contextmanager
+    def engine(self, oem: int):
+        """空いているエンジンを借りる（上限まで使用中なら返却を待つ）"""
+        with self._cond:
+            self._reset_after_fork()
+            while True:
+                idle = self._idle.get(oem)
+                if idle:
+                    api = idle.pop()
+                    break
+                if self._created < self._size:
+                    self._created += 1
+                    api = None
+                    break
+                # 別の OEM のエンジンしか空いていなければ、1つ破棄して作り直す
+                other = next((k for k, v in self._idle.items() if v), None)
+                if other is not None:
+                    self._idle[other].pop().End()
+                    api = None
+                    break
+                self._cond.wait()
+
+        if api is None:
+            try:
+                api = self._create(oem)
+            except Exception:
+                with self._cond:
+                    self._created -= 1
+                    self._cond.notify()
+                raise
+
+        ok = False
+        try:
+            yield api
+            ok = True
+        finally:
+            with self._cond:
+                if ok:
+                    api.Clear()
+                    self._idle.setdefault(oem, []).append(api)
+                else:
+                    # 失敗したエンジンは状態が分からないため作り直す
+                    self._created -= 1
+                    try:
+                        api.End()
+                    except Exception:
+                        pass
+                self._cond.notify()
+
+    def recognize(self, image: Image.Image, psm: int, oem: int) -> str:
+        """画像のテキストを認識"""
+        with self.engine(oem) as api:
+            api.SetPageSegMode(tesserocr.PSM(psm))
+            api.SetImage(image)
+            return api.GetUTF8Text()
+
+
+_pool = TesseractPool()
+
+
+def is_pool_available() -> bool:
+    """プロセス内のエンジンを使えるか（tesserocr が導入済みか）"""
+    return tesserocr is not None
+
+
+def recognize(image: Image.Image, doc_type: str = DOC_RECEIPT) -> str:
+    """
+    画像のテキストを Tesseract で認識
+    tesserocr があればプール内のエンジンで、なければ pytesseract（サブプロセス）で処理する
+    """
+    psm, oem = settings_for(doc_type)
+    if tesserocr is not None:
+        return _pool.recognize(image, psm, oem)
+    return recognize_with_subprocess(image, doc_type)
+
+
+def recognize_with_subprocess(image: Image.Image, doc_type: str = DOC_RECEIPT) -> str:
+    """pytesseract で認識（画像ごとに tesseract プロセスを起動する従来の方法）"""
+    if pytesseract is None:
+        raise RuntimeError("tesserocr も pytesseract も利用できません")
+    psm, oem = settings_for(doc_type)
+    config = f'--psm {psm} --oem {oem}'
+    if TESSERACT_DATA_PATH:
+        config += f' --tessdata-dir "{TESSERACT_DATA_PATH}"'
+    return pytesseract.image_to_string(image, lang=TESSERACT_LANG, config=config)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+アップロードファイルの保存（内容のハッシュで保存先を決める）
+- アップロードを少しずつ書き込みながら SHA-256 を計算し、
+  uploads/<ハッシュ先頭2桁>/<次の2桁>/<ハッシュ><拡張子> に保存する
+  （同名ファイルの有無を調べるループがなく、1つのフォルダのファイル数も増えすぎない）
+- 保存先はストレージバックエンド（storage.py。ローカルディスク／S3 互換）
+- 同じ内容のファイルは1つだけ保存し、"T_ファイル" の参照数で管理する。
+  参照数が 0 になったファイルは、ジョブワーカーが定期的に collect_garbage で削除する
+  （削除の直前に同じ内容が再アップロードされても消さないよう、行をロックして参照数を確認し、
+  最終更新から FILE_GC_GRACE_SECONDS 秒以上経ったファイルだけを消す）
+"""
+
+import os
+from dataclasses import dataclass
+
+from .db import get_db, transaction, _is_pg, _sql
+from .storage import get_storage
+
+
+# 参照数 0 のファイルを削除するまでの猶予（最終更新からの秒数）/ 1回に確認するファイル数
+FILE_GC_GRACE_SECONDS = int(os.environ.get("FILE_GC_GRACE_SECONDS", "3600"))
+FILE_GC_BATCH = int(os.environ.get("FILE_GC_BATCH", "100"))
+
+
+@dataclass(frozen=True)
+class StoredFile:
+    """保存したファイル"""
+    path: str
+    content_hash: str
+    size: int
+
+
+def init_file_store_schema(conn):
+    """ファイル参照数のテーブル作成"""
+    cur = conn.cursor()
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS "T_ファイル"(
+        パス                TEXT PRIMARY KEY,
+        content_hash        TEXT NOT NULL,
+        サイズ              BIGINT NOT NULL DEFAULT 0,
+        参照数              INTEGER NOT NULL DEFAULT 0,
+        created_at          TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    if not _is_pg(conn):
+        conn.commit()
+
+
+def store_file(file) -> StoredFile:
+    """
+    アップロードされたファイルを保存（参照数の登録は add_reference で行う）
+
+    Args:
+        file: アップロードされたファイルオブジェクト（werkzeug の FileStorage）
+    """
+    ext = os.path.splitext(file.filename or '')[1].lower()
+    path, content_hash, size = get_storage().save(file.stream, ext)
+    return StoredFile(path=path, content_hash=content_hash, size=size)
+
+
+def add_reference(conn, stored: StoredFile):
+    """ファイルの参照数を1増やす（コミットは呼び出し側）"""
+    cur = conn.cursor()
+    cur.execute(_sql(conn, '''
+        INSERT INTO "T_ファイル" (パス, content_hash, サイズ, 参照数)
+        VALUES (%s, %s, %s, 1)
+        ON CONFLICT (パス) DO UPDATE SET 参照数 = "T_ファイル".参照数 + 1
+    '''), (stored.path, stored.content_hash, stored.size))
+
+
+def release_reference(conn, path: str):
+    """
+    ファイルの参照数を1減らす（コミットは呼び出し側）
+    参照数が 0 になったファイルはここでは消さず、collect_garbage が削除する
+    （"T_ファイル" にない以前の形式のファイルは参照数 0 で登録する）
+    """
+    cur = conn.cursor()
+    cur.execute(_sql(conn, '''
+        UPDATE "T_ファイル" SET 参照数 = 参照数 - 1 WHERE パス = %s
+    '''), (path,))
+    if cur.rowcount == 0:
+        cur.execute(_sql(conn, '''
+            INSERT INTO "T_ファイル" (パス, content_hash, サイズ, 参照数)
+            VALUES (%s, '', 0, 0)
+            ON CONFLICT (パス) DO NOTHING
+        '''), (path,))
+
+
+def save_uploaded_file(conn, file) -> StoredFile:
+    """
+    アップロードされたファイルを保存して参照数を登録（コミットは呼び出し側）
+
+    Args:
+        conn: DB接続
+        file: アップロードされたファイルオブジェクト
+
+    Returns:
+        保存したファイル（パスと内容のハッシュ）
+    """
+    stored = store_file(file)
+    add_reference(conn, stored)
+    return stored
+
+
+def _remove_if_unreferenced(conn, path: str, grace: float) -> bool:
+    """
+    参照数 0 のファイルを1件削除（削除したら True）
+    行をロックして参照数を確認する間、同じ内容のアップロードの add_reference は待たされる。
+    アップロードはファイルを書き直してから add_reference するため、待っているアップロードの
+    ファイルは更新日時が新しく、delete_if_older で消されない
+    """
+    with transaction(conn):
+        cur = conn.cursor()
+        if _is_pg(conn):
+            cur.execute('SELECT 参照数 FROM "T_ファイル" WHERE パス = %s FOR UPDATE', (path,))
+        else:
+            cur.execute('BEGIN IMMEDIATE')
+            cur.execute('SELECT 参照数 FROM "T_ファイル" WHERE パス = ?', (path,))
+        row = cur.fetchone()
+        if row is None or row[0] > 0:
+            return False
+        if not get_storage().delete_if_older(path, grace):
+            return False
+        cur.execute(_sql(conn, 'DELETE FROM "T_ファイル" WHERE パス = %s'), (path,))
+        return True
+
+
+def collect_garbage(conn=None, grace: float = FILE_GC_GRACE_SECONDS, limit: int = FILE_GC_BATCH) -> int:
+    """
+    参照数 0 のファイルのうち、最終更新から grace 秒以上経ったものを削除
+
+    Returns:
+        削除したファイル数
+    """
+    own = conn is None
+    if own:
+        conn = get_db()
+    try:
+        cur = conn.cursor()
+        cur.execute(_sql(conn, 'SELECT パス FROM "T_ファイル" WHERE 参照数 <= 0 LIMIT %s'), (limit,))
+        paths = [row[0] for row in cur.fetchall()]
+        if not _is_pg(conn):
+            conn.commit()
+        removed = 0
+        for path in paths:
+            try:
+                if _remove_if_unreferenced(conn, path, grace):
+                    removed += 1
+            except Exception as e:
+                print(f"⚠️ ファイル削除エラー: {path}: {e}")
+        return removed
+    finally:
+        if own:
+            conn.close()
+
+
+if __name__ == '__main__':
+    print(f"✅ 参照されていないファイルを削除: {collect_garbage()}件")
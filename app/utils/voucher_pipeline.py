@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+証憑の非同期処理（ジョブワーカーで実行）
+アップロード時は画像を保存して ステータス='queued' の証憑を登録するだけにし、
+OCR → AI補正 → 企業検索 → 保存 をこのジョブで行う
+"""
+
+from functools import partial
+from typing import Dict, List, Optional
+
+from .db import _is_pg, _sql
+from .jobs import Job, job_handler, set_stage
+from .statements import Statement
+from .storage import get_storage
+from .ocr import process_receipt_image, process_receipt_images, extract_phone_numbers, extract_addresses, extract_company_name
+from .nta_api_enhanced import enhanced_company_search
+from .ai_helper import correct_ocr_text, normalize_company_name_with_ai, understand_receipt
+from .fanout import run_all
+
+
+JOB_KIND = 'voucher_process'
+
+# 証憑のステータス（'pending' 以降は従来どおり仕訳生成の対象）
+VOUCHER_QUEUED = 'queued'
+VOUCHER_READY = 'pending'
+VOUCHER_ERROR = 'error'
+
+# 法人番号・インボイス登録番号による既存の企業情報の確認（頻出クエリ）
+COMPANY_LOOKUP_BY_NUMBER = Statement(
+    'company_lookup_by_number',
+    'SELECT id FROM "T_企業情報" WHERE 法人番号 = %s OR インボイス登録番号 = %s'
+)
+
+
+def load_ai_settings(conn, tenant_id) -> tuple:
+    """
+    テナントのAI設定とAPIキーを取得
+
+    Returns:
+        (ai_settings, api_keys)
+    """
+    cur = conn.cursor()
+    ai_settings = {'ai_model': 'gemini-1.5-flash'}  # デフォルト
+    api_keys = {}
+    try:
+        cur.execute(_sql(conn, 'SELECT ai_model, openai_api_key, google_api_key, anthropic_api_key FROM "T_テナント" WHERE id = %s'), (tenant_id,))
+        tenant_settings = cur.fetchone()
+        if tenant_settings:
+            ai_settings['ai_model'] = tenant_settings[0] or 'gemini-1.5-flash'
+            api_keys = {
+                'openai_api_key': tenant_settings[1],
+                'google_api_key': tenant_settings[2],
+                'anthropic_api_key': tenant_settings[3],
+            }
+    except Exception as e:
+        print(f"AI設定取得エラー: {e}")
+    return ai_settings, api_keys
+
+
+def _has_ai_key(api_keys: Dict) -> bool:
+    return bool(api_keys.get('google_api_key') or api_keys.get('openai_api_key'))
+
+
+def upsert_company(conn, tenant_id, search_result: Dict) -> Optional[int]:
+    """検索結果の企業情報を登録（既存の場合はそのIDを返す）"""
+    company_info = search_result.get('company_info')
+    if not company_info:
+        return None
+
+    invoice_number = search_result.get('invoice_number')
+    corporate_number = search_result.get('corporate_number')
+    cur = conn.cursor()
+
+    # 既存の企業情報をチェック
+    cur.execute(*COMPANY_LOOKUP_BY_NUMBER.bind(conn, (corporate_number, invoice_number)))
+    existing = cur.fetchone()
+    if existing:
+        return existing['id']
+
+    # 新規企業情報を登録
+    insert_company_sql = '''
+        INSERT INTO "T_企業情報" (
+            tenant_id,
+            法人番号,
+            インボイス登録番号,
+            会社名,
+            会社名カナ,
+            郵便番号,
+            住所,
+            都道府県,
+            市区町村,
+            番地,
+            インボイス登録有無,
+            インボイス登録日,
+            法人種別
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    '''
+    params = (
+        tenant_id,
+        company_info.get('法人番号'),
+        company_info.get('インボイス登録番号'),
+        company_info.get('会社名'),
+        company_info.get('会社名カナ'),
+        company_info.get('郵便番号'),
+        company_info.get('住所'),
+        company_info.get('都道府県'),
+        company_info.get('市区町村'),
+        company_info.get('番地'),
+        company_info.get('インボイス登録有無', 0),
+        company_info.get('インボイス登録日'),
+        company_info.get('法人種別')
+    )
+    if _is_pg(conn):
+        cur.execute(insert_company_sql + ' RETURNING id', params)
+        return cur.fetchone()[0]
+    cur.execute(_sql(conn, insert_company_sql), params)
+    conn.commit()
+    return cur.lastrowid
+
+
+def _normalize_company_name(company_name: str, ai_model: str, api_keys: Dict, tenant_id) -> str:
+    """AIで会社名を正規化（並行実行のスレッドで呼ぶため、DB接続は渡さない）"""
+    try:
+        return normalize_company_name_with_ai(company_name, ai_model, api_keys, tenant_id=tenant_id)
+    except Exception as e:
+        print(f"AI会社名正規化エラー: {e}")
+        return company_name
+
+
+@job_handler(JOB_KIND)
+def process_voucher(conn, job: Job) -> Dict:
+    """証憑1件の OCR・AI補正・企業検索を行い、証憑を更新する"""
+    tenant_id = job.tenant_id
+    # S3 の場合はこのノードのキャッシュにダウンロードしたファイルで処理する
+    filepath = get_storage().local_path(job.payload['filepath'])
+
+    # OCR処理（prefetch で他の証憑とまとめて処理済みならその結果を使う）
+    set_stage(conn, job.id, 'ocr')
+    ocr_result = job.prefetched.get('ocr_result') or process_receipt_image(
+        filepath, content_hash=job.payload.get('content_hash'), conn=conn)
+
+    # AIでOCR結果を補正（補正・会社名の正規化・項目の読み取り・勘定科目の推定を1回の呼び出しで行う）
+    set_stage(conn, job.id, 'ai_correct')
+    ai_settings, api_keys = load_ai_settings(conn, tenant_id)
+    understanding = None
+    if 'understanding' in job.prefetched:
+        # prefetch で他の証憑と並行して読み取り済み（失敗した場合は None）
+        understanding = job.prefetched['understanding']
+    elif _has_ai_key(api_keys):
+        understanding = understand_receipt(
+            ocr_result.get('full_text', ''),
+            ai_settings['ai_model'],
+            api_keys,
+            tenant_id=tenant_id,
+            conn=conn
+        )
+    if understanding:
+        corrected_text = understanding['corrected_text']
+        ocr_result['phone_numbers'] = extract_phone_numbers(corrected_text)
+        ocr_result['addresses'] = extract_addresses(corrected_text)
+        # AIが読み取った項目（検証済み）を優先し、読み取れなかった項目は OCR の結果を使う
+        ocr_result['company_name'] = understanding['company_name'] or extract_company_name(corrected_text)
+        for field in ('amount', 'date', 'invoice_number'):
+            if understanding[field]:
+                ocr_result[field] = understanding[field]
+    elif _has_ai_key(api_keys):
+        # 1回の呼び出しで読み取れなかった場合は、従来どおり補正と正規化を個別に行う
+        try:
+            corrected_text = correct_ocr_text(
+                ocr_result.get('full_text', ''),
+                ai_settings['ai_model'],
+                api_keys,
+                tenant_id=tenant_id,
+                conn=conn
+            )
+            # 補正後のテキストを再解析
+            ocr_result['phone_numbers'] = extract_phone_numbers(corrected_text)
+            ocr_result['addresses'] = extract_addresses(corrected_text)
+            ocr_result['company_name'] = extract_company_name(corrected_text)
+        except Exception as e:
+            print(f"AI補正エラー: {e}")
+
+    # 電話番号と住所は最初の1件を使用
+    phone = ocr_result['phone_numbers'][0] if ocr_result['phone_numbers'] else None
+    address = ocr_result['addresses'][0] if ocr_result['addresses'] else None
+    company_name = ocr_result.get('company_name')
+
+    # 拡張検索フローを使用（AIでの会社名の正規化とは互いに依存しないため並行して行う。
+    # understand_receipt の結果は正規化済み）
+    set_stage(conn, job.id, 'company_search')
+    calls = [lambda: enhanced_company_search(ocr_result)]
+    if company_name and not understanding and _has_ai_key(api_keys):
+        calls.append(lambda: _normalize_company_name(company_name, ai_settings['ai_model'], api_keys, tenant_id))
+    search_result, *normalized = run_all(calls)
+    if normalized:
+        company_name = normalized[0]
+    warning = None
+    if not search_result.get('verification_passed'):
+        warning = search_result.get('warning_message')
+
+    # 企業情報と証憑を保存
+    set_stage(conn, job.id, 'save')
+    company_id = upsert_company(conn, tenant_id, search_result)
+
+    cur = conn.cursor()
+    cur.execute(_sql(conn, '''
+        UPDATE "T_証憑"
+        SET
+            company_id = %s,
+            OCR結果_生データ = %s,
+            電話番号 = %s,
+            住所 = %s,
+            金額 = %s,
+            日付 = %s,
+            勘定科目候補 = %s,
+            摘要 = COALESCE(摘要, %s),
+            ステータス = %s,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s AND tenant_id = %s
+    '''), (
+        company_id,
+        ocr_result['raw_text'],
+        phone,
+        address,
+        ocr_result['amount'],
+        ocr_result['date'],
+        understanding['account_subject'] if understanding else None,
+        (understanding['description'] or None) if understanding else None,
+        VOUCHER_READY,
+        job.voucher_id,
+        tenant_id
+    ))
+    if not _is_pg(conn):
+        conn.commit()
+
+    return {'company_id': company_id, 'company_name': company_name, 'warning': warning}
+
+
+def _mark_voucher_error(conn, job: Job, error: Exception):
+    """再試行の上限に達したら証憑を error にする"""
+    cur = conn.cursor()
+    cur.execute(_sql(conn, '''
+        UPDATE "T_証憑" SET ステータス = %s, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s AND tenant_id = %s
+    '''), (VOUCHER_ERROR, job.voucher_id, job.tenant_id))
+    if not _is_pg(conn):
+        conn.commit()
+
+
+def _prefetch_ocr(conn, jobs: List[Job]):
+    """同時に取り出した証憑の OCR をまとめて実行（Vision API は1往復で最大16枚）"""
+    results = process_receipt_images(
+        [get_storage().local_path(job.payload['filepath']) for job in jobs],
+        content_hashes=[job.payload.get('content_hash') for job in jobs],
+        conn=conn,
+    )
+    for job, ocr_result in zip(jobs, results):
+        job.prefetched['ocr_result'] = ocr_result
+
+
+def _prefetch_understanding(conn, jobs: List[Job]):
+    """同時に取り出した証憑の AI 読み取り（understand_receipt）を証憑ごとに並行して実行"""
+    settings = {}
+    calls, targets = [], []
+    for job in jobs:
+        if job.tenant_id not in settings:
+            settings[job.tenant_id] = load_ai_settings(conn, job.tenant_id)
+        ai_settings, api_keys = settings[job.tenant_id]
+        ocr_result = job.prefetched.get('ocr_result')
+        if not ocr_result or not _has_ai_key(api_keys):
+            continue
+        calls.append(partial(understand_receipt, ocr_result.get('full_text', ''), ai_settings['ai_model'],
+                             api_keys, tenant_id=job.tenant_id))
+        targets.append(job)
+    for job, understanding in zip(targets, run_all(calls)):
+        job.prefetched['understanding'] = understanding
+
+
+def _prefetch(conn, jobs: List[Job]):
+    """OCR をまとめて実行し、続けて AI の読み取りを証憑ごとに並行して実行"""
+    _prefetch_ocr(conn, jobs)
+    _prefetch_understanding(conn, jobs)
+
+
+process_voucher.on_failed = _mark_voucher_error
+process_voucher.prefetch = _prefetch
@@ -0,0 +1,3 @@
+-- T_証憑テーブルにAIが推定した勘定科目の候補を追加（仕訳生成時に使用）
+
+ALTER TABLE "T_証憑" ADD COLUMN IF NOT EXISTS 勘定科目候補 TEXT;
@@ -0,0 +1,3 @@
+-- 仕訳一覧のキーセットページネーション用（日付が NULL の仕訳も含めて COALESCE(日付, '') DESC, id DESC の順に辿る）
+
+CREATE INDEX IF NOT EXISTS "idx_仕訳_tenant_date_key" ON "T_仕訳" (tenant_id, (COALESCE(日付, '')), id);